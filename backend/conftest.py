@@ -0,0 +1,85 @@
+from datetime import timedelta
+
+import pytest
+from django.core.cache import cache
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from music_room.models import User, Artist, Track, Playlist, PlaylistTrack, PlayerSession, Event
+from music_room.services.catalog import cache as catalog_cache
+from music_room.services.session_state import engine
+from music_room.services.sync import coalescer
+
+
+@pytest.fixture(autouse=True)
+def clean_state():
+    """State kept in process memory outlives test database, ids are reused by the next test"""
+    yield
+    engine.states.clear()
+    coalescer.pending.clear()
+    coalescer.applied_at.clear()
+    catalog_cache.clear()
+    cache.clear()
+
+
+@pytest.fixture
+def media(settings, tmp_path):
+    """Storage of uploaded and transcoded files in temporary directory"""
+    settings.MEDIA_ROOT = tmp_path
+    return tmp_path
+
+
+@pytest.fixture
+def user(db) -> User:
+    return User.objects.create_user(username='alice', password='alice-password')
+
+
+@pytest.fixture
+def other_user(db) -> User:
+    return User.objects.create_user(username='bob', password='bob-password')
+
+
+@pytest.fixture
+def api_client(user) -> APIClient:
+    client = APIClient()
+    client.force_authenticate(user)
+    return client
+
+
+@pytest.fixture
+def make_playlist(db, user):
+    def make(tracks_count: int = 5, author: User = None) -> Playlist:
+        author = author or user
+        artist = Artist.objects.create(name=f'{author.username}-artist')
+        Track.objects.bulk_create([
+            Track(name=f'{author.username}-track-{i}', artist=artist) for i in range(tracks_count)
+        ])
+        playlist = Playlist.objects.create(name=f'{author.username}-playlist', author=author)
+        PlaylistTrack.objects.bulk_create([
+            PlaylistTrack(playlist=playlist, track=track, order=i)
+            for i, track in enumerate(Track.objects.filter(artist=artist).order_by('id'))
+        ])
+        return playlist
+
+    return make
+
+
+@pytest.fixture
+def make_session(make_playlist, user):
+    def make(tracks_count: int = 5, author: User = None) -> PlayerSession:
+        author = author or user
+        return PlayerSession.objects.create(playlist=make_playlist(tracks_count, author), author=author)
+
+    return make
+
+
+@pytest.fixture
+def make_event(make_session, user):
+    def make(author: User = None, access_type: str = Event.AccessTypes.public) -> Event:
+        author = author or user
+        return Event.objects.create(
+            name=f'{author.username}-event', author=author, access_type=access_type, start_date=timezone.now(),
+            end_date=timezone.now() + timedelta(days=1), player_session=make_session(author=author)
+        )
+
+    return make
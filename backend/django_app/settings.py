@@ -132,14 +132,82 @@ INSTALLED_APPS += ['music_room', 'rest_framework', 'channels', 'drf_yasg', 'rest
 
 ASGI_APPLICATION = 'django_app.asgi.application'
 
-CHANNEL_LAYERS = {
-    "default": {
-        "BACKEND": "channels.layers.InMemoryChannelLayer"
+REDIS_URL = os.getenv('REDIS_URL')
+
+# Several ASGI workers share channel layer and cache through Redis, in-memory backends work only for one process
+if REDIS_URL:
+    CHANNEL_LAYERS = {
+        "default": {
+            "BACKEND": "channels_redis.core.RedisChannelLayer",
+            "CONFIG": {
+                "hosts": [REDIS_URL],
+            },
+        }
+    }
+    CACHES = {
+        'default': {
+            'BACKEND': 'django_redis.cache.RedisCache',
+            'LOCATION': REDIS_URL,
+        }
+    }
+else:
+    CHANNEL_LAYERS = {
+        "default": {
+            "BACKEND": "channels.layers.InMemoryChannelLayer"
+        }
     }
-}
 
 AUTH_USER_MODEL = 'music_room.User'
 
+#: Seconds between writes of player session progress only changes, kept in memory till then
+PLAYER_STATE_FLUSH_INTERVAL = float(os.getenv('PLAYER_STATE_FLUSH_INTERVAL', '5'))
+
+#: Seconds of drift between reported and server counted track progress, which are corrected by sync
+PLAYER_SYNC_TOLERANCE = float(os.getenv('PLAYER_SYNC_TOLERANCE', '1'))
+
+#: Seconds between applied syncs of one player session, syncs inside window are coalesced to the latest one
+PLAYER_SYNC_WINDOW = float(os.getenv('PLAYER_SYNC_WINDOW', '1'))
+
+#: Seconds between logged counters of player sync coalescer and catalog cache of each process, 0 turns them off
+STATS_LOG_INTERVAL = float(os.getenv('STATS_LOG_INTERVAL', '60'))
+
+#: Default and max items in page of list views, see :mod:`music_room.pagination`
+PAGE_SIZE = int(os.getenv('PAGE_SIZE', '100'))
+MAX_PAGE_SIZE = int(os.getenv('MAX_PAGE_SIZE', '1000'))
+
+#: Serialized catalog responses kept in memory of each worker, see :mod:`music_room.services.catalog`
+CATALOG_CACHE_SIZE = int(os.getenv('CATALOG_CACHE_SIZE', '256'))
+
+#: Attempts of transcode job before it is failed, see :mod:`music_room.services.transcode`
+TRANSCODE_MAX_ATTEMPTS = int(os.getenv('TRANSCODE_MAX_ATTEMPTS', '3'))
+
+#: Seconds after which running transcode job is considered lost and queued again on worker start
+TRANSCODE_JOB_TIMEOUT = int(os.getenv('TRANSCODE_JOB_TIMEOUT', '3600'))
+
+#: Renditions made of uploaded track file as (codec, bitrate in kbps), e.g. ``mp3:96,mp3:320,opus:96``,
+#: codecs see :data:`music_room.services.transcode.CODECS`
+TRANSCODE_RENDITIONS = [
+    (codec, int(bitrate))
+    for codec, bitrate in (
+        item.split(':') for item in os.getenv('TRANSCODE_RENDITIONS', 'mp3:96,mp3:160,mp3:320,opus:96').split(',')
+    )
+]
+
+#: Rendition listed in track files, for clients which don't know about renditions
+TRANSCODE_DEFAULT_RENDITION = ('mp3', 320)
+
+#: Renditions of one file encoded at once, each by its own ffmpeg process. Worker runs
+#: ``CPU count // TRANSCODE_RENDITION_WORKERS`` jobs at once by default, so all encodes take about one process per CPU
+TRANSCODE_RENDITION_WORKERS = int(os.getenv(
+    'TRANSCODE_RENDITION_WORKERS', str(min(len(TRANSCODE_RENDITIONS), os.cpu_count() or 1))
+))
+
+#: Seconds of HLS segment of rendition, seeking fetches one segment
+TRANSCODE_HLS_SEGMENT_TIME = int(os.getenv('TRANSCODE_HLS_SEGMENT_TIME', '6'))
+
+#: Bytes of transcoded file kept in memory, the rest is written to temporary file on disk
+TRANSCODE_SPOOL_SIZE = int(os.getenv('TRANSCODE_SPOOL_SIZE', str(8 * 1024 * 1024)))
+
 PROJECT_NAME = 'Music Room API'
 
 API_INFO = {
@@ -166,7 +234,8 @@ MEDIA_URL = 'media/'
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
         'rest_framework_simplejwt.authentication.JWTAuthentication',
-    )
+    ),
+    'DEFAULT_PAGINATION_CLASS': 'music_room.pagination.CursorPagination',
 }
 
 SIMPLE_JWT = {
@@ -178,6 +247,23 @@ SIMPLE_JWT = {
 
 DOCS_ROOT = BASE_DIR / 'docs' / 'build' / 'html'
 
+#: Counters of services are logged by ``music_room`` loggers, see ``STATS_LOG_INTERVAL``
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {
+            'class': 'logging.StreamHandler',
+        },
+    },
+    'loggers': {
+        'music_room': {
+            'handlers': ['console'],
+            'level': os.getenv('MUSIC_ROOM_LOG_LEVEL', 'INFO'),
+        },
+    },
+}
+
 if ENABLE_S3:
     DEFAULT_FILE_STORAGE = 'storages.backends.s3boto3.S3Boto3Storage'
 
@@ -1,5 +1,6 @@
 from django.contrib import admin
-from .models import Playlist, PlaylistAccess, Track, User, TrackFile, PlaylistTrack, Artist, EventAccess, Event, PlayerSession
+from .models import Playlist, PlaylistAccess, Track, User, TrackFile, PlaylistTrack, Artist, EventAccess, Event, PlayerSession, \
+    TranscodeJob
 
 admin.site.register(User)
 admin.site.register(PlayerSession)
@@ -27,9 +28,14 @@ class TrackInline(admin.StackedInline):
 
 class FileInline(admin.StackedInline):
     model = TrackFile
+    fk_name = 'track'
     extra = 1
     max_num = 1
-    readonly_fields = ['duration', 'extension']
+    readonly_fields = ['duration', 'extension', 'size']
+
+    def get_queryset(self, request):
+        # Renditions are made by transcode worker, only uploaded file is edited
+        return super().get_queryset(request).filter(source__isnull=True)
 
 
 @admin.register(Playlist)
@@ -72,3 +78,10 @@ class EventAdmin(admin.ModelAdmin):
     @admin.display
     def event_access_users(self, instance: Event):
         return [event_access_users for event_access_users in instance.event_access_users.all()]
+
+
+@admin.register(TranscodeJob)
+class TranscodeJobAdmin(admin.ModelAdmin):
+    list_display = ['file', 'status', 'attempts', 'created_at', 'finished_at']
+    list_filter = ['status']
+    readonly_fields = ['file', 'attempts', 'error', 'created_at', 'started_at', 'finished_at']
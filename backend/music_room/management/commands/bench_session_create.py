@@ -0,0 +1,50 @@
+"""
+Measure player session creation time and queries count for playlists of different size
+"""
+import time
+import uuid
+
+from django.core.management import BaseCommand
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+
+
+class Command(BaseCommand):
+    help = 'Benchmark player session creation (track queue materialization) for playlists of given sizes'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', type=int, nargs='+', default=[10, 1000, 10000], help='Playlist sizes')
+        parser.add_argument('--repeat', type=int, default=3, help='Sessions created for each size')
+
+    def handle(self, *args, **options):
+        for size in options['sizes']:
+            # Benchmark data is rolled back after each size
+            with transaction.atomic():
+                timings, queries = self.bench(size, options['repeat'])
+                transaction.set_rollback(True)
+            self.stdout.write(
+                f'{size:>6} tracks: {min(timings) * 1000:9.1f} ms min, '
+                f'{sum(timings) / len(timings) * 1000:9.1f} ms avg, {queries} queries'
+            )
+
+    @staticmethod
+    def bench(size: int, repeat: int):
+        from music_room.models import User, Artist, Track, Playlist, PlaylistTrack, PlayerSession
+
+        user = User.objects.create(username=f'bench-{uuid.uuid4().hex[:8]}')
+        artist = Artist.objects.create(name=user.username)
+        Track.objects.bulk_create([Track(name=f'{user.username}-{i}', artist=artist) for i in range(size)])
+        playlist = Playlist.objects.create(name=user.username, author=user)
+        PlaylistTrack.objects.bulk_create([
+            PlaylistTrack(playlist=playlist, track_id=track, order=i)
+            for i, track in enumerate(Track.objects.filter(artist=artist).values_list('id', flat=True))
+        ])
+
+        timings, queries = [], 0
+        for _ in range(repeat):
+            with CaptureQueriesContext(connection) as context:
+                started_at = time.perf_counter()
+                PlayerSession.objects.create(playlist=playlist, author=user)
+                timings.append(time.perf_counter() - started_at)
+            queries = len(context.captured_queries)
+        return timings, queries
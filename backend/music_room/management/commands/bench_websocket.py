@@ -0,0 +1,199 @@
+"""
+Websocket load benchmark: authenticated clients in events send a mix of player actions
+to in-process ASGI application, latency is measured from initiator send till the last
+listener of the event receives the broadcast. Results are printed as JSON to compare between commits
+"""
+import asyncio
+import json
+import random
+import time
+from datetime import timedelta
+from typing import Dict, List
+
+from asgiref.sync import async_to_sync
+from django.core.management import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import setup_test_environment, teardown_test_environment
+from django.utils import timezone
+
+#: Action -> weight in default mix, sync is the most frequent message of playing clients
+MIX = {'sync_track': 5, 'vote_track': 3, 'play_next_track': 1, 'add_track': 1}
+#: Actions without broadcast, only sent and counted
+NO_RESPONSE = {'sync_track'}
+
+
+def percentile(values: List[float], rank: float) -> [float, None]:
+    """Nearest rank percentile"""
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, max(0, round(rank / 100 * len(values) + 0.5) - 1))]
+
+
+def summary(latencies: List[float]) -> dict:
+    return {
+        'count': len(latencies),
+        'p50': percentile(latencies, 50),
+        'p95': percentile(latencies, 95),
+        'p99': percentile(latencies, 99),
+        'max': max(latencies) if latencies else None,
+    }
+
+
+class Command(BaseCommand):
+    help = 'Benchmark websocket actions throughput and latency with in-process clients, on a test database'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--clients', type=int, default=20, help='Connected clients')
+        parser.add_argument('--events', type=int, default=4, help='Events, clients are spread between them')
+        parser.add_argument('--actions', type=int, default=50, help='Actions sent in each event')
+        parser.add_argument('--tracks', type=int, default=50, help='Tracks in each event playlist')
+        parser.add_argument('--mix', type=str, default=','.join(f'{k}={v}' for k, v in MIX.items()),
+                            help='Actions weights, e.g. vote_track=3,sync_track=5')
+        parser.add_argument('--timeout', type=float, default=10, help='Seconds to wait for broadcast')
+        parser.add_argument('--seed', type=int, default=0, help='Random seed of actions mix')
+        parser.add_argument('--output', type=str, default=None, help='Write JSON to file instead of stdout')
+
+    def handle(self, *args, **options):
+        if options['events'] < 1 or options['clients'] < options['events']:
+            raise CommandError('At least one event and one client for each event are required')
+        mix = {}
+        for item in options['mix'].split(','):
+            action, _, weight = item.partition('=')
+            if action not in MIX:
+                raise CommandError(f'Unknown action {action}, allowed: {", ".join(MIX)}')
+            mix[action] = float(weight or 1)
+
+        setup_test_environment()
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        try:
+            rooms = self.fixture(options['clients'], options['events'], options['tracks'])
+            result = async_to_sync(self.run)(rooms, mix, options)
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+
+        output = json.dumps(result, indent=2)
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                f.write(output)
+        else:
+            self.stdout.write(output)
+
+    @staticmethod
+    def fixture(clients: int, events: int, tracks_count: int) -> List[dict]:
+        """Events with playlist and accessed users, each user is one client"""
+        from rest_framework_simplejwt.tokens import AccessToken
+        from music_room.models import User, Artist, Track, Playlist, PlaylistTrack, PlayerSession, Event, EventAccess
+
+        artist = Artist.objects.create(name='bench')
+        Track.objects.bulk_create([Track(name=f'bench-{i}', artist=artist) for i in range(tracks_count * 2)])
+        tracks = list(Track.objects.filter(artist=artist).values_list('id', flat=True))
+        users = [User.objects.create(username=f'bench-{i}') for i in range(clients)]
+
+        rooms = []
+        for i in range(events):
+            members = users[i::events]
+            author = members[0]
+            playlist = Playlist.objects.create(name=f'bench-{i}', author=author)
+            PlaylistTrack.objects.bulk_create([
+                PlaylistTrack(playlist=playlist, track_id=track, order=order)
+                for order, track in enumerate(tracks[:tracks_count])
+            ])
+            player_session = PlayerSession.objects.create(playlist=playlist, author=author)
+            event = Event.objects.create(
+                name=f'bench-{i}', author=author, player_session=player_session,
+                start_date=timezone.now(), end_date=timezone.now() + timedelta(days=1)
+            )
+            EventAccess.objects.bulk_create([
+                EventAccess(event=event, user=user, access_mode=EventAccess.AccessMode.moderator)
+                for user in members[1:]
+            ])
+            rooms.append({
+                'path': f'/ws/event/{event.id}/',
+                'player_session': player_session.id,
+                'session_tracks': list(player_session.track_queue.values_list('id', flat=True)),
+                'tracks': tracks,
+                'tokens': [str(AccessToken.for_user(user)) for user in members],
+            })
+        return rooms
+
+    async def run(self, rooms: List[dict], mix: Dict[str, float], options: dict) -> dict:
+        from channels.testing import WebsocketCommunicator
+        from django_app.asgi import application
+        from music_room.services.sync import coalescer
+
+        for room in rooms:
+            room['clients'] = []
+            for token in room['tokens']:
+                communicator = WebsocketCommunicator(
+                    application, room['path'], headers=[(b'authorization', f'Bearer {token}'.encode())]
+                )
+                connected, _ = await communicator.connect()
+                if not connected:
+                    raise CommandError(f'Client is not connected to {room["path"]}')
+                await communicator.receive_json_from(options['timeout'])  # Restored session
+                room['clients'].append(communicator)
+
+        latencies: Dict[str, List[float]] = {action: [] for action in mix if action not in NO_RESPONSE}
+        sent: Dict[str, int] = {action: 0 for action in mix}
+        errors = []
+        started_at = time.perf_counter()
+        await asyncio.gather(*(
+            self.run_room(room, random.Random(options['seed'] + i), mix, options, sent, latencies, errors)
+            for i, room in enumerate(rooms)
+        ))
+        duration = time.perf_counter() - started_at
+
+        for room in rooms:
+            for communicator in room['clients']:
+                await communicator.disconnect()
+
+        measured = [latency for values in latencies.values() for latency in values]
+        return {
+            'config': {key: options[key] for key in ('clients', 'events', 'actions', 'tracks', 'mix', 'seed')},
+            'duration_s': duration,
+            'actions': sent,
+            'errors': len(errors),
+            'throughput_per_s': sum(sent.values()) / duration if duration else None,
+            'latency_ms': {'all': summary(measured), **{action: summary(values) for action, values in latencies.items()}},
+            'sync': coalescer.stats(),
+        }
+
+    @staticmethod
+    async def run_room(room: dict, rng: random.Random, mix: Dict[str, float], options: dict,
+                       sent: Dict[str, int], latencies: Dict[str, List[float]], errors: List[dict]):
+        """Actions of one event go one by one, so broadcast can be matched with action"""
+        from ws.base.utils import snake_to_camel
+        from ws.utils import dict_key_reformat
+
+        clients = room['clients']
+        actions, weights = list(mix), list(mix.values())
+        for i in range(options['actions']):
+            action = rng.choices(actions, weights)[0]
+            payload = {'player_session_id': room['player_session']}
+            if action == 'vote_track':
+                payload['track_id'] = rng.choice(room['session_tracks'])
+            elif action == 'sync_track':
+                payload['progress'] = rng.uniform(0, 180)
+            elif action == 'add_track':
+                payload['track_id'] = rng.choice(room['tracks'])
+
+            initiator = clients[i % len(clients)]
+            started_at = time.perf_counter()
+            await initiator.send_json_to({
+                'event': action.replace('_', '.'),
+                'payload': dict_key_reformat({action: payload}, snake_to_camel),
+            })
+            sent[action] += 1
+            if action in NO_RESPONSE:
+                continue
+
+            async def receive(communicator) -> float:
+                message = await communicator.receive_json_from(options['timeout'])
+                if message.get('event') == 'error':
+                    errors.append(message)
+                return time.perf_counter()
+
+            received_at = await asyncio.gather(*(receive(communicator) for communicator in clients))
+            latencies[action].append((max(received_at) - started_at) * 1000)
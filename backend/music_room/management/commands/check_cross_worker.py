@@ -0,0 +1,97 @@
+"""
+Check that websocket actions are delivered between ASGI workers through the shared channel layer
+"""
+import multiprocessing
+import uuid
+
+from asgiref.sync import async_to_sync
+from django.conf import settings
+from django.core.management import BaseCommand, CommandError
+
+IN_MEMORY_LAYER = 'channels.layers.InMemoryChannelLayer'
+
+
+def connect(user_id: int):
+    from channels.testing import WebsocketCommunicator
+    from rest_framework_simplejwt.tokens import AccessToken
+    from django_app.asgi import application
+    from music_room.models import User
+
+    token = AccessToken.for_user(User.objects.get(id=user_id))
+    return WebsocketCommunicator(application, '/ws/player/', headers=[(b'authorization', f'Bearer {token}'.encode())])
+
+
+def listen(user_id: int, timeout: float, ready, received):
+    """Second worker: connect to player session and report received events"""
+    import django
+    django.setup()
+    communicator = connect(user_id)
+
+    async def run():
+        events = []
+        connected, _ = await communicator.connect()
+        if connected:
+            await communicator.receive_json_from(timeout)  # Restored session
+            ready.set()
+            try:
+                while 'session.changed' not in events:
+                    events.append((await communicator.receive_json_from(timeout))['event'])
+            except Exception:
+                ...
+        received.put(events)
+
+    async_to_sync(run)()
+
+
+class Command(BaseCommand):
+    help = 'Check player session broadcast between two worker processes sharing channel layer (REDIS_URL)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--timeout', type=float, default=5, help='Seconds to wait for each message')
+
+    def handle(self, *args, **options):
+        from music_room.models import User, Artist, Track, Playlist, PlayerSession
+
+        if settings.CHANNEL_LAYERS['default']['BACKEND'] == IN_MEMORY_LAYER:
+            raise CommandError('In-memory channel layer is not shared between processes, set REDIS_URL')
+        timeout = options['timeout']
+
+        user = User.objects.create(username=f'cross-worker-{uuid.uuid4().hex[:8]}')
+        artist = Artist.objects.create(name=user.username)
+        playlist = Playlist.objects.create(name=user.username, author=user)
+        for order in range(2):
+            playlist.tracks.create(track=Track.objects.create(name=f'{user.username}-{order}', artist=artist), order=order)
+        player_session = PlayerSession.objects.create(playlist=playlist, author=user)
+
+        context = multiprocessing.get_context('spawn')
+        ready, received = context.Event(), context.Queue()
+        worker = context.Process(target=listen, args=(user.id, timeout, ready, received))
+        try:
+            worker.start()
+            if not ready.wait(timeout * 4):
+                raise CommandError('Second worker is not connected')
+            async_to_sync(self.play_next_track)(connect(user.id), player_session.id, timeout)
+            events = received.get(timeout=timeout * 2)
+        finally:
+            worker.join(timeout)
+            if worker.is_alive():
+                worker.terminate()
+            user.delete()
+            artist.delete()
+
+        if 'session.changed' not in events:
+            raise CommandError(f'Second worker did not receive session.changed, received: {events}')
+        self.stdout.write(self.style.SUCCESS('Second worker received session.changed'))
+
+    @staticmethod
+    async def play_next_track(communicator, player_session_id: int, timeout: float):
+        connected, _ = await communicator.connect()
+        if not connected:
+            raise CommandError('First worker is not connected')
+        await communicator.receive_json_from(timeout)  # Restored session
+        await communicator.send_json_to({
+            'event': 'play.next.track',
+            'payload': {'playNextTrack': {'playerSessionId': player_session_id}}
+        })
+        await communicator.receive_json_from(timeout)
+        await communicator.disconnect()
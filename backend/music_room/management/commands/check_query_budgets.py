@@ -0,0 +1,47 @@
+"""
+Check SQL queries count of every websocket action and REST view against budgets of :mod:`music_room.query_budgets`
+on a test database, the same check as ``music_room/tests/test_query_budgets.py`` with a report of all counts
+"""
+from django.core.management import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import setup_test_environment, teardown_test_environment
+
+from music_room import query_budgets
+
+
+class Command(BaseCommand):
+    help = 'Check queries count of websocket actions and REST views against budgets, on a test database'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--timeout', type=float, default=0.3, help='Seconds of silence after action is done')
+        parser.add_argument('--show-sql', action='store_true', help='Print queries of actions over budget')
+
+    def handle(self, *args, **options):
+        setup_test_environment()
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        try:
+            results = query_budgets.run(query_budgets.fixture(), options['timeout'])
+        except query_budgets.BudgetError as e:
+            raise CommandError(e)
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+
+        for result in results:
+            style = self.style.ERROR if result.exceeded else self.style.SUCCESS
+            self.stdout.write(style(
+                f'{"over" if result.exceeded else "ok":<5} {result.name:<34} '
+                f'initiator {result.initiator:>3}/{result.budget[0]:<3} receiver {result.receiver:>3}/{result.budget[1]}'
+            ))
+            if result.exceeded and options['show_sql']:
+                for label, queries in result.sql.items():
+                    self.stdout.write(f'      {label}:')
+                    for sql in queries:
+                        self.stdout.write(f'        {sql}')
+
+        from music_room.services.catalog import cache
+        self.stdout.write(f'catalog cache: {", ".join(f"{k} {v}" for k, v in cache.stats().items())}')
+
+        exceeded = [result.name for result in results if result.exceeded]
+        if exceeded:
+            raise CommandError(f'Queries budget exceeded: {", ".join(exceeded)}')
@@ -0,0 +1,82 @@
+"""
+Worker of transcode jobs: queued jobs are taken from database and run in pool of processes,
+so ffmpeg encodes don't block requests and use all CPU cores
+"""
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from concurrent.futures.process import BrokenProcessPool
+
+import django
+from django.conf import settings
+from django.core.management import BaseCommand, CommandError
+from django.db import connections
+
+#: Cache backends kept in process memory, version stamps bumped by worker are not seen by web processes
+LOCAL_CACHES = {
+    'django.core.cache.backends.locmem.LocMemCache',
+    'django.core.cache.backends.dummy.DummyCache',
+}
+
+
+class Command(BaseCommand):
+    help = 'Run queued transcode jobs of uploaded track files'
+
+    def add_arguments(self, parser):
+        # Each job runs TRANSCODE_RENDITION_WORKERS encodes at once
+        parser.add_argument(
+            '--processes', type=int, default=max(1, (os.cpu_count() or 1) // settings.TRANSCODE_RENDITION_WORKERS),
+            help='Jobs run at once, by default CPU count divided by TRANSCODE_RENDITION_WORKERS'
+        )
+        parser.add_argument('--poll', type=float, default=2, help='Seconds between checks for queued jobs')
+        parser.add_argument('--once', action='store_true', help='Exit when there are no queued jobs')
+        parser.add_argument(
+            '--allow-local-cache', action='store_true',
+            help="Run without shared cache (REDIS_URL), catalog changes are not seen by web processes till restart"
+        )
+
+    def handle(self, *args, **options):
+        from music_room.services import transcode
+
+        if settings.CACHES['default']['BACKEND'] in LOCAL_CACHES:
+            message = 'Cache is local to process, set REDIS_URL to share catalog version stamps with web processes'
+            if not options['allow_local_cache']:
+                raise CommandError(message)
+            self.stderr.write(self.style.WARNING(message))
+
+        requeued = transcode.requeue_stale()
+        if requeued:
+            self.stdout.write(f'Queued again {requeued} stale jobs')
+
+        processes = max(1, options['processes'])
+        connections.close_all()
+        # Spawned processes don't share database connections with this one
+        pool = ProcessPoolExecutor(processes, multiprocessing.get_context('spawn'), initializer=django.setup)
+        running, broken = {}, False
+        try:
+            while True:
+                if not broken:
+                    for job_id in transcode.claim(processes - len(running)):
+                        running[pool.submit(transcode.process, job_id)] = job_id
+                if not running:
+                    if options['once'] or broken:
+                        break
+                    time.sleep(options['poll'])
+                    continue
+
+                done, _ = wait(running, timeout=options['poll'], return_when=FIRST_COMPLETED)
+                for future in done:
+                    job_id = running.pop(future)
+                    try:
+                        status = future.result()
+                    except Exception as e:
+                        # Process is died, e.g. killed by OOM, attempt is failed
+                        broken = broken or isinstance(e, BrokenProcessPool)
+                        transcode.finish(job_id, repr(e))
+                        status = 'crashed'
+                    self.stdout.write(f'Job {job_id}: {status}')
+        finally:
+            pool.shutdown(wait=not broken)
+        if broken:
+            raise CommandError('Worker process died, pool is restarted with command')
@@ -0,0 +1,23 @@
+# Generated by Django 3.2.15 on 2026-10-17 06:49
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('music_room', '0073_auto_20240225_1801'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='playersession',
+            name='version',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AlterField(
+            model_name='playlist',
+            name='name',
+            field=models.CharField(default='<function uuid4 at 0x7f5dc7d47ec0>', max_length=150),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 3.2.15 on 2026-10-17 07:16
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('music_room', '0074_playersession_version'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='sessiontrack',
+            name='started_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AlterField(
+            model_name='playlist',
+            name='name',
+            field=models.CharField(default='<function uuid4 at 0x7f15ac167ec0>', max_length=150),
+        ),
+    ]
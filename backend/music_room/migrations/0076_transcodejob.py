@@ -0,0 +1,35 @@
+# Generated by Django 3.2.15 on 2026-10-17 07:38
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('music_room', '0075_sessiontrack_started_at'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='playlist',
+            name='name',
+            field=models.CharField(default='<function uuid4 at 0x7f634a613ec0>', max_length=150),
+        ),
+        migrations.CreateModel(
+            name='TranscodeJob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('status', models.CharField(choices=[('queued', 'Queued'), ('running', 'Running'), ('done', 'Done'), ('failed', 'Failed')], default='queued', max_length=50)),
+                ('attempts', models.IntegerField(default=0)),
+                ('error', models.TextField(blank=True, default='')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('started_at', models.DateTimeField(blank=True, null=True)),
+                ('finished_at', models.DateTimeField(blank=True, null=True)),
+                ('file', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='transcode_jobs', to='music_room.trackfile')),
+            ],
+            options={
+                'ordering': ['created_at'],
+            },
+        ),
+    ]
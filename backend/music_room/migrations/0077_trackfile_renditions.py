@@ -0,0 +1,54 @@
+# Generated by Django 3.2.15 on 2026-10-17 07:41
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def link_mp3_exports(apps, schema_editor):
+    """MP3 made of FLAC before renditions has the same name, it is 320k rendition of that FLAC"""
+    TrackFile = apps.get_model('music_room', 'TrackFile')
+    for flac in TrackFile.objects.filter(extension='flac', source__isnull=True):
+        TrackFile.objects.filter(
+            track_id=flac.track_id, extension='mp3', source__isnull=True, file=flac.file.name.rsplit('.', 1)[0] + '.mp3'
+        ).update(source=flac, codec='mp3', bitrate=320)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('music_room', '0076_transcodejob'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='trackfile',
+            name='bitrate',
+            field=models.IntegerField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='trackfile',
+            name='codec',
+            field=models.CharField(blank=True, editable=False, max_length=50, null=True),
+        ),
+        migrations.AddField(
+            model_name='trackfile',
+            name='size',
+            field=models.BigIntegerField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='trackfile',
+            name='source',
+            field=models.ForeignKey(blank=True, editable=False, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='renditions', to='music_room.trackfile'),
+        ),
+        migrations.AlterField(
+            model_name='playlist',
+            name='name',
+            field=models.CharField(default='<function uuid4 at 0x7f5a04f6bec0>', max_length=150),
+        ),
+        migrations.AlterField(
+            model_name='trackfile',
+            name='extension',
+            field=models.CharField(blank=True, choices=[('mp3', 'Mp3'), ('flac', 'Flac'), ('opus', 'Opus')], max_length=50, null=True),
+        ),
+        migrations.RunPython(link_mp3_exports, migrations.RunPython.noop),
+    ]
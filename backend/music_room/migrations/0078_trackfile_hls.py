@@ -0,0 +1,23 @@
+# Generated by Django 3.2.15 on 2026-10-17 07:42
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('music_room', '0077_trackfile_renditions'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='trackfile',
+            name='hls',
+            field=models.FileField(blank=True, editable=False, null=True, upload_to=''),
+        ),
+        migrations.AlterField(
+            model_name='playlist',
+            name='name',
+            field=models.CharField(default='<function uuid4 at 0x7f1884da7ec0>', max_length=150),
+        ),
+    ]
@@ -1,20 +1,22 @@
 from __future__ import annotations
 
+import random
 import uuid
-import subprocess
+from datetime import datetime
 from io import FileIO
 from typing import List, Union
-from django.core.files.base import ContentFile
-from django.core.files.storage import default_storage
+from django.conf import settings
 from django.contrib.auth.models import AbstractUser
 from django.core.exceptions import ValidationError
-from django.db import models
+from django.core.files.storage import default_storage
+from django.db import models, transaction, connection
 from django.db.models.fields.files import FieldFile
 from django.db.models.manager import Manager
-from django.db.models.signals import post_save, post_delete
+from django.db.models.signals import pre_save, post_save, post_delete
 from django.dispatch import receiver
+from django.utils import timezone
 
-from django_app.settings import AWS_S3_CUSTOM_DOMAIN
+from .ordering import ORDER_GAP
 
 
 class User(AbstractUser):
@@ -38,9 +40,12 @@ def user_post_save(instance: User, created, **kwargs):
     instance.playlists.add(favourites_playlist)
 
 
+#: Extensions of uploaded files, others are made only by transcoding
+UPLOAD_EXTENSIONS = ['mp3', 'flac']
+
+
 def audio_file_validator(file: FieldFile):
-    # allowed_extensions = TrackFile.Extensions.names
-    allowed_extensions = TrackFile.Extensions.names
+    allowed_extensions = UPLOAD_EXTENSIONS
     file_extension = file.name.split('.')[-1]
     if file_extension not in allowed_extensions:
         raise ValidationError(
@@ -70,19 +75,33 @@ class Track(models.Model):
     def __str__(self):
         return self.name
 
+    @property
+    def default_files(self) -> List[TrackFile]:
+        """Uploaded files and default rendition (see ``TRANSCODE_DEFAULT_RENDITION``), for clients without renditions"""
+        return [
+            file for file in self.files.all()
+            if file.source_id is None or (file.codec, file.bitrate) == settings.TRANSCODE_DEFAULT_RENDITION
+        ]
+
+    @property
+    def renditions(self) -> List[TrackFile]:
+        """Files made of uploaded ones by transcoding"""
+        return [file for file in self.files.all() if file.source_id is not None]
+
 
 class TrackFile(models.Model):
     class Extensions(models.TextChoices):
         """Allowed extensions"""
         mp3 = 'mp3'
         flac = 'flac'
+        opus = 'opus'
 
     #: Track file
     file: Union[FileIO[bytes], FieldFile] = models.FileField(
         upload_to='music',
         validators=[audio_file_validator],
         help_text=f'Send highest quality file, lowest will be make automatically<br>'
-                  f'Allowed:<br> {"<br>".join(Extensions.names)}'
+                  f'Allowed:<br> {"<br>".join(UPLOAD_EXTENSIONS)}'
     )
     #: Track file extension
     extension: Extensions = models.CharField(max_length=50, choices=Extensions.choices, blank=True, null=True)
@@ -90,83 +109,103 @@ class TrackFile(models.Model):
     duration: float = models.FloatField(blank=True, null=True)
     #: Track instance
     track: Track = models.ForeignKey(Track, models.SET_NULL, null=True, blank=True, related_name='files')
+    #: Uploaded file which this rendition is made of, empty for uploaded files
+    source: TrackFile = models.ForeignKey(
+        'self', models.CASCADE, null=True, blank=True, related_name='renditions', editable=False
+    )
+    #: Rendition codec, e.g. mp3 or opus
+    codec: str = models.CharField(max_length=50, blank=True, null=True, editable=False)
+    #: Rendition bitrate in kbps
+    bitrate: int = models.IntegerField(blank=True, null=True, editable=False)
+    #: File size in bytes
+    size: int = models.BigIntegerField(blank=True, null=True, editable=False)
+    #: HLS media playlist of rendition, segments are in the same directory
+    hls: Union[FileIO[bytes], FieldFile] = models.FileField(blank=True, null=True, editable=False)
+    #: Files made of this one
+    renditions: Union[TrackFile, Manager]
 
     def __str__(self):
+        if self.bitrate:
+            return f'{self.track.name} - {self.extension} {self.bitrate}k'
         return f'{self.track.name} - {self.extension}'
 
 
+class TranscodeJob(models.Model):
+    """Probing and transcoding of uploaded track file, done by ``transcode_worker`` command"""
+
+    class Statuses(models.TextChoices):
+        queued = 'queued'  #: Waits for worker, also after failed attempt if attempts are left
+        running = 'running'  #: Taken by worker
+        done = 'done'
+        failed = 'failed'  #: All attempts failed, see :attr:`error`
+
+    #: Uploaded file
+    file: TrackFile = models.ForeignKey(TrackFile, models.CASCADE, related_name='transcode_jobs')
+    #: Job status
+    status: Statuses = models.CharField(max_length=50, choices=Statuses.choices, default=Statuses.queued)
+    #: Started attempts
+    attempts: int = models.IntegerField(default=0)
+    #: Error of the last failed attempt
+    error: str = models.TextField(blank=True, default='')
+    #: When job is created
+    created_at: datetime = models.DateTimeField(auto_now_add=True)
+    #: When the last attempt is started
+    started_at: datetime = models.DateTimeField(blank=True, null=True)
+    #: When job is done or failed
+    finished_at: datetime = models.DateTimeField(blank=True, null=True)
+
+    class Meta:
+        ordering = ['created_at']
+
+    def __str__(self):
+        return f'{self.file} - {self.status}'
+
+
+@receiver(pre_save, sender=TrackFile)
+def file_pre_save(instance: TrackFile, update_fields=None, *args, **kwargs):
+    instance.file_changed = False
+    # Renditions are made by worker and never replaced, their saves don't change uploaded file
+    if instance.source_id is not None or (update_fields is not None and 'file' not in update_fields):
+        return
+    old_name = TrackFile.objects.filter(id=instance.id).values_list('file', flat=True).first()
+    instance.file_changed = instance.file.name != old_name
+    if instance.id is None or not instance.file_changed:
+        return
+    # Uploaded file is replaced, so everything made of the old one is stale. Renditions files and HLS
+    # segments are deleted with them, see file_post_delete
+    instance.renditions.all().delete()
+    if old_name:
+        default_storage.delete(old_name)
+    instance.duration = instance.size = None
+
+
 @receiver(post_save, sender=TrackFile)
 def file_post_save(instance: TrackFile, created, *args, **kwargs):
-    post_save.disconnect(file_post_save, sender=TrackFile)
-    if instance.file:
-        file_extension = instance.file.name.split('.')[-1]
-        if AWS_S3_CUSTOM_DOMAIN:
-            file_path = "https://" + AWS_S3_CUSTOM_DOMAIN + "/" + str(instance.file.name)
-        else:
-            file_path = instance.file.path
-
-        ffprobe_duration_cmd = [
-            'ffprobe',
-            '-i', file_path,
-            '-show_entries', 'format=duration',
-            '-v', 'quiet',
-            '-of', 'csv=p=0'
-        ]
-        ffprobe_duration_process = subprocess.Popen(ffprobe_duration_cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-        ffprobe_duration_output, ffprobe_duration_error = ffprobe_duration_process.communicate()
-
-        if ffprobe_duration_error:
-            print("Can't get duration:", ffprobe_duration_error.decode('utf-8'))
-            return
-        
-        file_duration = float(ffprobe_duration_output.decode('utf-8').strip())
-
-        instance.duration = file_duration
-        instance.extension = file_extension
-        instance.save()
-
-        mp3_path = file_path.replace('.flac', '.mp3')
-        mp3_name = instance.file.name.replace('.flac', '.mp3')
-
-        _, export_not_exist = TrackFile.objects.get_or_create(
-            id=instance.id + 1,
-            track=instance.track,
-            duration=instance.duration,
-            extension=TrackFile.Extensions.mp3,
-            file=mp3_name
-        )
-
-        if export_not_exist:
-            ffmpeg_mp3_cmd = [
-                'ffmpeg',
-                '-hide_banner',
-                '-loglevel', 'error',
-                '-i', file_path,
-                '-b:a', '320K',
-                '-vn',
-                '-f', 'mp3',
-                '-'
-            ]
-            ffmpeg_mp3_process = subprocess.Popen(ffmpeg_mp3_cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-            ffmpeg_mp3_output, ffmpeg_mp3_error = ffmpeg_mp3_process.communicate()
-            if ffmpeg_mp3_error:
-                print("Can't create MP3 file:", ffmpeg_mp3_error.decode('utf-8'))
-            else:
-                ffmpeg_mp3_content = ContentFile(ffmpeg_mp3_output)
-                if AWS_S3_CUSTOM_DOMAIN:
-                    default_storage.save(mp3_name, ffmpeg_mp3_content)
-                else:
-                    default_storage.save(mp3_path, ffmpeg_mp3_content)
-
-    post_save.connect(file_post_save, sender=TrackFile)
+    # Files made by worker are saved with duration, only new or replaced uploads are not probed yet
+    if not instance.file or not (instance.file_changed or instance.duration is None):
+        return
+    # Running job can be transcoding the replaced file, new one is queued then
+    statuses = [TranscodeJob.Statuses.queued]
+    if not instance.file_changed:
+        statuses.append(TranscodeJob.Statuses.running)
+    if not instance.transcode_jobs.filter(status__in=statuses).exists():
+        TranscodeJob.objects.create(file=instance)
 
 
 @receiver(post_delete, sender=TrackFile)
 def file_post_delete(instance: TrackFile, *args, **kwargs):
     try:
-        instance.file.delete()
+        # Saving would insert deleted row again
+        instance.file.delete(save=False)
     except FileNotFoundError:
         ...
+    if instance.hls:
+        directory = instance.hls.name.rsplit('/', 1)[0]
+        try:
+            for name in default_storage.listdir(directory)[1]:
+                default_storage.delete(f'{directory}/{name}')
+        except FileNotFoundError:
+            ...
 
 
 class Playlist(models.Model):
@@ -209,7 +248,7 @@ class Playlist(models.Model):
 
 class PlaylistTrack(models.Model):
     track: Track = models.ForeignKey(Track, models.CASCADE)  #: Track object
-    order: int = models.IntegerField(default=0)  #: Track order in playlist
+    order: int = models.IntegerField(default=0)  #: Track order in playlist, sparse (see :mod:`music_room.ordering`)
     playlist = models.ForeignKey(Playlist, models.CASCADE, related_name='tracks')
 
     class Meta:
@@ -243,9 +282,11 @@ class SessionTrack(models.Model):
     votes: Union[List[User], Manager] = models.ManyToManyField(User)
     #: Votes count for next play
     votes_count: int = models.PositiveIntegerField(default=0)
-    #: Track time progress from duration
+    #: Track time progress from duration, at :attr:`started_at` while playing
     progress: float = models.FloatField(default=0)
-    #: Tracks order in queue
+    #: When track is playing, time progress counted from, see :meth:`progress_at`
+    started_at: datetime = models.DateTimeField(null=True, blank=True)
+    #: Tracks order in queue, sparse (see :mod:`music_room.ordering`)
     order: int = models.IntegerField(default=0)
 
     class Meta:
@@ -254,6 +295,17 @@ class SessionTrack(models.Model):
     def __str__(self):
         return f'{self.track.name}-{self.state}-{self.order}'
 
+    @staticmethod
+    def progress_at(progress: float, started_at: [datetime, None], now: datetime) -> float:
+        """Playback clock: stored progress plus time passed since playing started"""
+        if started_at is None:
+            return progress
+        return progress + max((now - started_at).total_seconds(), 0)
+
+    @property
+    def current_progress(self) -> float:
+        return self.progress_at(self.progress, self.started_at, timezone.now())
+
 
 class PlayerSession(models.Model):
     class Modes:
@@ -273,6 +325,29 @@ class PlayerSession(models.Model):
     mode: Modes = models.CharField(max_length=50, choices=ModeChoice, default=Modes.normal)
     #: Player Session author
     author: User = models.ForeignKey(User, models.CASCADE)
+    #: Player Session version, increased on every change of track queue
+    version: int = models.PositiveIntegerField(default=0)
+
+    #: Track queue is created in random order, set before session is created. Not stored
+    shuffle_queue: bool = False
+
+    def create_track_queue(self, tracks: List[int], first_order: int = 0) -> List[SessionTrack]:
+        """Create session tracks for tracks ids in given order and add them to track queue, with bulk inserts"""
+        session_tracks = [
+            SessionTrack(track_id=track, order=first_order + i * ORDER_GAP) for i, track in enumerate(tracks)
+        ]
+        with transaction.atomic():
+            SessionTrack.objects.bulk_create(session_tracks)
+            if not connection.features.can_return_rows_from_bulk_insert:
+                # SQLite does not return ids, but holds write lock until commit, so the newest rows are just created
+                ids = SessionTrack.objects.order_by('-id').values_list('id', flat=True)[:len(session_tracks)]
+                for session_track, session_track_id in zip(session_tracks, reversed(list(ids))):
+                    session_track.id = session_track_id
+            PlayerSession.track_queue.through.objects.bulk_create([
+                PlayerSession.track_queue.through(playersession_id=self.id, sessiontrack_id=session_track.id)
+                for session_track in session_tracks
+            ])
+        return session_tracks
 
 
 @receiver(post_save, sender=PlayerSession)
@@ -282,10 +357,11 @@ def player_session_post_save(instance: PlayerSession, created, **kwargs):
 
     PlayerSession.objects.filter(author=instance.author).exclude(id=instance.id).delete()
 
-    playlist_tracks: List[PlaylistTrack] = instance.playlist.tracks.all()
-    for i, playlist_track in enumerate(playlist_tracks):
-        session_track = SessionTrack.objects.create(track=playlist_track.track, order=i)
-        instance.track_queue.add(session_track)
+    tracks = list(instance.playlist.tracks.values_list('track_id', flat=True))
+    if instance.shuffle_queue:
+        # Fisher-Yates in place
+        random.shuffle(tracks)
+    instance.create_track_queue(tracks)
 
 
 class Event(models.Model):
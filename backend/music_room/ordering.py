@@ -0,0 +1,23 @@
+"""
+Sparse ordering of playlist and session tracks: neighbours orders have gaps,
+so moving a track changes only its own order until the gap is exhausted
+"""
+from typing import Optional
+
+ORDER_GAP = 1024  #: Gap between neighbours orders after rebalancing
+ORDER_LIMIT = 2 ** 31 - 1  #: Orders are stored in IntegerField
+
+
+def order_between(before: Optional[int], after: Optional[int]) -> Optional[int]:
+    """Order between two neighbours (None for queue edge), None if there is no gap and orders must be rebalanced"""
+    if before is None and after is None:
+        return 0
+    if before is None:
+        order = after - ORDER_GAP
+    elif after is None:
+        order = before + ORDER_GAP
+    elif after - before > 1:
+        order = (before + after) // 2
+    else:
+        return None
+    return order if -ORDER_LIMIT <= order <= ORDER_LIMIT else None
@@ -0,0 +1,24 @@
+"""
+Keyset pagination of list views: next page starts after the last id of previous one,
+so a page costs the same at any depth of the list, unlike offset pagination
+"""
+from django.conf import settings
+from rest_framework import pagination
+
+
+class CursorPagination(pagination.CursorPagination):
+    """
+    Pages ordered by id, opaque ``cursor`` of next and previous pages is returned with results.
+    Pagination is enabled only if ``cursor`` or ``page_size`` is passed, otherwise the whole list
+    is returned as before, clients which don't know about pages keep working
+    """
+    ordering = 'id'
+    page_size = settings.PAGE_SIZE
+    page_size_query_param = 'page_size'
+    max_page_size = settings.MAX_PAGE_SIZE
+
+    def get_page_size(self, request):
+        if self.cursor_query_param not in request.query_params and \
+                self.page_size_query_param not in request.query_params:
+            return None
+        return super(CursorPagination, self).get_page_size(request)
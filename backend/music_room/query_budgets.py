@@ -0,0 +1,386 @@
+"""
+Queries budgets of every websocket action and REST view, checked by ``music_room/tests/test_query_budgets.py``
+and ``check_query_budgets`` command. Actions are driven through ASGI application with
+:class:`channels.testing.WebsocketCommunicator`, queries are recorded per connection: the initiator and each receiver.
+
+Budgets are exact counts on :func:`fixture`. Counts don't depend on timing or on size of queues and catalog
+(see ``test_queries_do_not_grow_with_queue``), so there is no headroom: any extra query is a change to review,
+and budget is raised in the same commit as the change which needs it
+"""
+import asyncio
+import json
+from collections import defaultdict
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from datetime import timedelta
+from typing import Callable, Dict, List, Optional
+
+from asgiref.sync import async_to_sync
+from channels.db import database_sync_to_async
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+#: Websocket action -> (initiator queries, queries of each receiver)
+WS_BUDGETS = {
+    'player.resync_session': (1, 0),
+    'player.play_track': (9, 0),
+    'player.play_next_track': (10, 0),
+    'player.play_previous_track': (10, 0),
+    'player.delay_play_track': (8, 0),
+    'player.vote_track': (15, 0),
+    'player.sync_track': (1, 0),
+    'player.pause_track': (8, 0),
+    'player.resume_track': (8, 0),
+    'player.stop_track': (8, 0),
+    'player.shuffle': (23, 0),
+    'player.create_session': (14, 0),
+    'playlists.add_playlist': (6, 0),
+    'playlists.change_playlist': (6, 0),
+    'playlists.remove_playlist': (9, 0),
+    'playlist.add_track': (10, 0),
+    'playlist.move_track': (12, 0),
+    'playlist.remove_track': (11, 0),
+    'playlist.invite_to_playlist': (6, 0),
+    'playlist.revoke_from_playlist': (6, 0),
+    'event.invite_to_event': (10, 1),
+    'event.change_user_access_mode': (8, 0),
+    'event.add_track': (13, 0),
+    'event.vote_track': (15, 0),
+    'event.play_next_track': (9, 0),
+    'event.remove_track': (11, 0),
+    'event.revoke_from_event': (8, 1),
+    'event.change_event': (5, 1),
+}
+
+#: REST view request -> queries
+REST_BUDGETS = {
+    'GET /api/track/': 3,
+    'GET /api/track/?summary=true': 2,
+    'GET /api/track/?page_size=<n>': 3,
+    'GET /api/playlist/': 5,
+    'GET /api/playlist/<id>/': 3,
+    'GET /api/playlist/own/': 4,
+    'GET /api/player/session/': 3,
+    'GET /api/users/': 2,
+    'GET /api/artist/': 4,
+    'GET /api/artist/?summary=true': 3,
+    'GET /api/artist/<id>/': 4,
+    'GET /api/track/<id>/hls/': 3,
+    'GET /api/track/ 304': 1,
+    'GET /api/track/ cached': 1,
+    'GET /api/artist/ cached': 1,
+    'GET /api/artist/ 304': 1,
+    'GET /api/playlist/<id>/ 304': 1,
+    'GET /api/track/<id>/hls/ 304': 1,
+    'GET /api/event/': 2,
+    'POST /api/event/add/': 14,
+    'POST /api/auth/': 8,
+    'POST /api/auth/token/refresh/': 0,
+}
+
+#: Request of views step which is sent again with ETag of previous response
+NOT_MODIFIED = object()
+#: Request of views step which is sent again and answered from catalog cache
+CACHED = object()
+
+#: Connection which runs the code, queries are counted for it
+connection_label: ContextVar[Optional[str]] = ContextVar('connection_label', default=None)
+
+
+class BudgetError(Exception):
+    """Action or request failed, so its queries can't be counted"""
+
+
+def labelled(application, label: str):
+    async def app(scope, receive, send):
+        connection_label.set(label)
+        return await application(scope, receive, send)
+
+    return app
+
+
+class QueryRecorder:
+    """Database execute wrapper, collects queries by connection label"""
+
+    def __init__(self):
+        self.queries: Dict[Optional[str], List[str]] = defaultdict(list)
+
+    def __call__(self, execute, sql, params, many, context):
+        self.queries[connection_label.get()].append(sql)
+        return execute(sql, params, many, context)
+
+
+@dataclass
+class Step:
+    group: str  #: Connections group, see :func:`connections`
+    event: str  #: Action event in snake case
+    payload: Callable[[dict], dict]  #: Context -> action payload
+    after: Callable[[dict, List[dict]], None] = None  #: Collect ids from initiator messages to context
+    receivers: bool = True  #: Action is delivered to other connections of group
+
+
+@dataclass
+class Result:
+    name: str
+    budget: tuple
+    initiator: int = 0
+    receiver: int = 0
+    sql: Dict[str, List[str]] = field(default_factory=dict)
+
+    @property
+    def exceeded(self) -> bool:
+        return self.initiator > self.budget[0] or self.receiver > self.budget[1]
+
+
+def session_tracks(messages: List[dict]) -> List[int]:
+    for message in reversed(messages):
+        payload = next(iter(message.get('payload', {}).values()), None)
+        if isinstance(payload, dict) and payload.get('player_session'):
+            return [track['id'] for track in payload['player_session']['track_queue']]
+    return []
+
+
+def fixture() -> dict:
+    from rest_framework_simplejwt.tokens import AccessToken, RefreshToken
+    from music_room.models import User, Artist, Track, TrackFile, Playlist, PlaylistTrack, PlayerSession, Event
+
+    users = {name: User.objects.create_user(username=name, password=f'{name}-password') for name in (
+        'alice', 'bob', 'carol'
+    )}
+    artists = [Artist.objects.create(name=f'artist-{i}') for i in range(3)]
+    tracks = Track.objects.bulk_create([
+        Track(name=f'track-{i}', artist=artists[i % len(artists)]) for i in range(8)
+    ])
+    tracks = list(Track.objects.order_by('id'))
+    TrackFile.objects.bulk_create([
+        TrackFile(track=track, file=f'music/{track.name}.{extension}', extension=extension, duration=180)
+        for track in tracks for extension in (TrackFile.Extensions.flac, TrackFile.Extensions.mp3)
+    ])
+    TrackFile.objects.create(
+        track=tracks[0], source=tracks[0].files.get(extension=TrackFile.Extensions.flac), codec='mp3', bitrate=96,
+        file=f'music/{tracks[0].name}_96k.mp3', extension=TrackFile.Extensions.mp3, duration=180,
+        hls=f'music/{tracks[0].name}_96k_mp3_hls/index.m3u8'
+    )
+
+    playlists = {}
+    for name in ('alice', 'bob'):
+        playlist = playlists[name] = Playlist.objects.create(name=f'{name}-playlist', author=users[name])
+        PlaylistTrack.objects.bulk_create([
+            PlaylistTrack(playlist=playlist, track=track, order=i) for i, track in enumerate(tracks[:5])
+        ])
+    player_session = PlayerSession.objects.create(playlist=playlists['alice'], author=users['alice'])
+    event = Event.objects.create(
+        name='event', author=users['bob'], start_date=timezone.now(), end_date=timezone.now() + timedelta(days=1),
+        player_session=PlayerSession.objects.create(playlist=playlists['bob'], author=users['bob'])
+    )
+
+    return {
+        'users': {name: user.id for name, user in users.items()},
+        'tokens': {name: str(AccessToken.for_user(user)) for name, user in users.items()},
+        'refresh': str(RefreshToken.for_user(users['alice'])),
+        'tracks': [track.id for track in tracks],
+        'artist': artists[0].id,
+        'playlist': playlists['alice'].id,
+        'bob_playlist': playlists['bob'].id,
+        'player_session': player_session.id,
+        'session_tracks': [track.id for track in player_session.track_queue.order_by('order')],
+        'event': event.id,
+        'event_session': event.player_session_id,
+        'event_tracks': [track.id for track in event.player_session.track_queue.order_by('order')],
+    }
+
+def connections(context: dict) -> Dict[str, tuple]:
+    """Connections group -> (user, path), each group has initiator and receiver connections"""
+    return {
+        'player': ('alice', '/ws/player/'),
+        'playlists': ('alice', '/ws/playlist/'),
+        'playlist': ('alice', f'/ws/playlist/{context["playlist"]}/'),
+        'event': ('bob', f'/ws/event/{context["event"]}/'),
+    }
+
+def steps() -> List[Step]:
+    def player(extra: Callable[[dict], dict] = lambda c: {}, session='player_session'):
+        return lambda c: {'player_session_id': c[session], **extra(c)}
+
+    def save_playlist(c: dict, messages: List[dict]):
+        from music_room.models import Playlist
+        c['new_playlist'] = Playlist.objects.filter(name='budget-playlist').values_list('id', flat=True).first()
+
+    def save_event_track(c: dict, messages: List[dict]):
+        c['event_tracks'] = session_tracks(messages) or c['event_tracks']
+
+    return [
+        Step('player', 'resync_session', player(), receivers=False),
+        Step('player', 'play_track', player(lambda c: {'track_id': c['session_tracks'][2]})),
+        Step('player', 'play_next_track', player()),
+        Step('player', 'play_previous_track', player()),
+        Step('player', 'delay_play_track', player(lambda c: {'track_id': c['session_tracks'][3]})),
+        Step('player', 'vote_track', player(lambda c: {'track_id': c['session_tracks'][4]})),
+        Step('player', 'sync_track', player(lambda c: {'progress': 42.0}), receivers=False),
+        Step('player', 'pause_track', player()),
+        Step('player', 'resume_track', player()),
+        Step('player', 'stop_track', player()),
+        Step('player', 'shuffle', player()),
+        Step('player', 'create_session', lambda c: {'playlist_id': c['playlist']}, receivers=False),
+        # Playlists changes are rendered only for the initiator connection
+        Step('playlists', 'add_playlist', lambda c: {'playlist_name': 'budget-playlist'}, after=save_playlist,
+             receivers=False),
+        Step('playlists', 'change_playlist', lambda c: {
+            'playlist_id': c['new_playlist'], 'playlist_name': 'new'
+        }, receivers=False),
+        Step('playlists', 'remove_playlist', lambda c: {'playlist_id': c['new_playlist']}, receivers=False),
+        Step('playlist', 'add_track', lambda c: {'track_id': c['tracks'][6]}),
+        Step('playlist', 'move_track', lambda c: {'track_id': c['tracks'][6], 'position': 0}),
+        Step('playlist', 'remove_track', lambda c: {'track_id': c['tracks'][6]}),
+        Step('playlist', 'invite_to_playlist', lambda c: {'user_id': c['users']['carol']}, receivers=False),
+        Step('playlist', 'revoke_from_playlist', lambda c: {'user_id': c['users']['carol']}, receivers=False),
+        Step('event', 'invite_to_event', lambda c: {'user_id': c['users']['carol']}),
+        Step('event', 'change_user_access_mode', lambda c: {
+            'user_id': c['users']['carol'], 'access_mode': 'moderator'
+        }, receivers=False),
+        Step('event', 'add_track', player(lambda c: {'track_id': c['tracks'][7]}, 'event_session'),
+             after=save_event_track),
+        Step('event', 'vote_track', player(lambda c: {'track_id': c['event_tracks'][-1]}, 'event_session')),
+        Step('event', 'play_next_track', player(session='event_session')),
+        Step('event', 'remove_track', player(lambda c: {
+            'session_track_id': c['event_tracks'][-1]
+        }, 'event_session')),
+        Step('event', 'revoke_from_event', lambda c: {'user_id': c['users']['carol']}),
+        Step('event', 'change_event', lambda c: {'event_name': 'new'}),
+    ]
+
+def run(context: dict, timeout: float = 0.3) -> List[Result]:
+    """Run every action, then every view request, on database with :func:`fixture`"""
+    recorder = QueryRecorder()
+    # Events queries run in this thread, see database_sync_to_async
+    with connection.execute_wrapper(recorder):
+        results = async_to_sync(run_actions)(context, recorder, timeout)
+    return results + run_views(context)
+
+
+async def run_actions(context: dict, recorder: QueryRecorder, timeout: float) -> List[Result]:
+    from channels.testing import WebsocketCommunicator
+    from django_app.asgi import application
+    from ws.base.utils import snake_to_camel
+    from ws.utils import dict_key_reformat
+
+    communicators = {}
+    for group, (user, path) in connections(context).items():
+        for role in ('initiator', 'receiver'):
+            communicator = WebsocketCommunicator(
+                labelled(application, f'{group}.{role}'), path,
+                headers=[(b'authorization', f'Bearer {context["tokens"][user]}'.encode())]
+            )
+            connected, _ = await communicator.connect()
+            if not connected:
+                raise BudgetError(f'{user} is not connected to {path}')
+            communicators[(group, role)] = communicator
+    await asyncio.gather(*(drain(communicator, timeout) for communicator in communicators.values()))
+
+    results = []
+    for step in steps():
+        name = f'{step.group}.{step.event}'
+        initiator, receiver = communicators[(step.group, 'initiator')], communicators[(step.group, 'receiver')]
+        payload = await database_sync_to_async(step.payload)(context)
+        recorder.queries.clear()
+        await initiator.send_json_to({
+            'event': step.event.replace('_', '.'),
+            'payload': dict_key_reformat({step.event: payload}, snake_to_camel),
+        })
+        messages, received = await asyncio.gather(drain(initiator, timeout), drain(receiver, timeout))
+        errors = [message for message in messages if message.get('event') == 'error']
+        if errors:
+            raise BudgetError(f'{name} failed: {errors}')
+        if step.receivers and not received:
+            raise BudgetError(f'{name} is not delivered to receiver')
+        if step.after:
+            await database_sync_to_async(step.after)(context, messages)
+        results.append(Result(
+            name=name,
+            budget=WS_BUDGETS[name],
+            initiator=len(recorder.queries[f'{step.group}.initiator']),
+            receiver=len(recorder.queries[f'{step.group}.receiver']),
+            sql={label: list(queries) for label, queries in recorder.queries.items()},
+        ))
+
+    for communicator in communicators.values():
+        await communicator.disconnect()
+    return results
+
+
+async def drain(communicator, timeout: float) -> List[dict]:
+    messages = []
+    while not await communicator.receive_nothing(timeout):
+        output = await communicator.receive_output()
+        if output.get('type') == 'websocket.send':
+            messages.append(json.loads(output['text']))
+    return messages
+
+
+def requests(context: dict) -> List[tuple]:
+    """REST view requests as (name, path, data): None for GET, :data:`NOT_MODIFIED`, :data:`CACHED` or POST data"""
+    return [
+        ('GET /api/track/', '/api/track/', None),
+        ('GET /api/track/?summary=true', '/api/track/?summary=true', None),
+        ('GET /api/track/?page_size=<n>', '/api/track/?page_size=2', None),
+        ('GET /api/playlist/', '/api/playlist/', None),
+        ('GET /api/playlist/<id>/', f'/api/playlist/{context["playlist"]}/', None),
+        ('GET /api/playlist/own/', '/api/playlist/own/', None),
+        ('GET /api/player/session/', '/api/player/session/', None),
+        ('GET /api/users/', '/api/users/', None),
+        ('GET /api/artist/', '/api/artist/', None),
+        ('GET /api/artist/?summary=true', '/api/artist/?summary=true', None),
+        ('GET /api/artist/<id>/', f'/api/artist/{context["artist"]}/', None),
+        ('GET /api/track/<id>/hls/', f'/api/track/{context["tracks"][0]}/hls/', None),
+        ('GET /api/event/', '/api/event/', None),
+        ('GET /api/track/ 304', '/api/track/', NOT_MODIFIED),
+        ('GET /api/track/ cached', '/api/track/', CACHED),
+        ('GET /api/artist/ cached', '/api/artist/', CACHED),
+        ('GET /api/artist/ 304', '/api/artist/', NOT_MODIFIED),
+        ('GET /api/playlist/<id>/ 304', f'/api/playlist/{context["playlist"]}/', NOT_MODIFIED),
+        ('GET /api/track/<id>/hls/ 304', f'/api/track/{context["tracks"][0]}/hls/', NOT_MODIFIED),
+        ('POST /api/event/add/', '/api/event/add/', {
+            'name': 'budget-event', 'start_date': timezone.now().isoformat(),
+            'end_date': (timezone.now() + timedelta(days=1)).isoformat(), 'playlist': context['playlist'],
+        }),
+        ('POST /api/auth/', '/api/auth/', {'username': 'alice', 'password': 'alice-password'}),
+        ('POST /api/auth/token/refresh/', '/api/auth/token/refresh/', {'refresh': context['refresh']}),
+    ]
+
+
+def client(context: dict):
+    from django.test import Client
+
+    return Client(HTTP_AUTHORIZATION=f'Bearer {context["tokens"]["alice"]}')
+
+
+def request(client, name: str, path: str, data, etags: dict):
+    """Send view request, ``etags`` are ETags of previous responses by path"""
+    if data is None or data is CACHED:
+        response = client.get(path)
+    elif data is NOT_MODIFIED:
+        response = client.get(path, HTTP_IF_NONE_MATCH=etags[path])
+    else:
+        response = client.post(path, data, content_type='application/json')
+    if response.status_code >= 400:
+        raise BudgetError(f'{name} failed with {response.status_code}: {response.content[:200]}')
+    if data is NOT_MODIFIED and response.status_code != 304:
+        raise BudgetError(f'{name} is modified, status {response.status_code}')
+    if response.has_header('ETag'):
+        etags[path] = response['ETag']
+    return response
+
+
+def run_views(context: dict) -> List[Result]:
+    view_client, results, etags = client(context), [], {}
+    for name, path, data in requests(context):
+        with CaptureQueriesContext(connection) as queries:
+            request(view_client, name, path, data, etags)
+        results.append(Result(
+            name=name,
+            budget=(REST_BUDGETS[name], 0),
+            initiator=len(queries.captured_queries),
+            sql={'request': [query['sql'] for query in queries.captured_queries]},
+        ))
+    return results
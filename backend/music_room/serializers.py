@@ -19,13 +19,22 @@ class FileSerializer(serializers.ModelSerializer):
 
 
 class TrackSerializer(serializers.ModelSerializer):
-    files = FileSerializer(many=True)
+    files = FileSerializer(many=True, source='default_files', read_only=True)
+    renditions = FileSerializer(many=True, read_only=True)
 
     class Meta:
         model = Track
         fields = '__all__'
 
 
+class TrackSummarySerializer(serializers.ModelSerializer):
+    """Track without files, for lists"""
+
+    class Meta:
+        model = Track
+        fields = ['id', 'name', 'artist']
+
+
 class PlaylistTrackSerializer(serializers.ModelSerializer):
     class Meta:
         model = PlaylistTrack
@@ -41,6 +50,8 @@ class PlaylistSerializer(serializers.ModelSerializer):
 
 
 class SessionTrackSerializer(serializers.ModelSerializer):
+    progress = serializers.FloatField(source='current_progress', read_only=True)
+
     class Meta:
         model = SessionTrack
         fields = ['id', 'state', 'progress', 'track', 'votes_count']
@@ -113,6 +124,14 @@ class ArtistSerializer(serializers.ModelSerializer):
         fields = '__all__'
 
 
+class ArtistSummarySerializer(serializers.ModelSerializer):
+    """Artist with tracks ids instead of nested tracks, for lists"""
+
+    class Meta:
+        model = Artist
+        fields = ['id', 'name', 'tracks']
+
+
 class EventCreateSerializer(serializers.ModelSerializer):
     playlist = serializers.IntegerField(required=False, default=0)
 
@@ -0,0 +1,86 @@
+"""
+Read-through cache of serialized catalog (tracks, files, artists) responses kept in process memory.
+Entries are stored with catalog version stamp (see :mod:`music_room.services.versions`) and are valid
+only while stamp is the same, so change in one worker invalidates entries of all workers
+"""
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Optional
+
+from django.conf import settings
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from music_room.models import Track, TrackFile, Artist
+from . import versions
+
+logger = logging.getLogger(__name__)
+
+
+class CatalogCache:
+    """
+    Least recently used entries are evicted when there are more than :attr:`max_size`.
+    Counters of process are logged with the next lookup after ``stats_interval`` seconds
+    """
+
+    def __init__(self, max_size: int = 256, stats_interval: float = 0):
+        self.max_size = max_size
+        self.stats_interval = stats_interval  #: Seconds between logged counters, 0 turns them off
+        self.logged_at = time.monotonic()  #: Last logged counters time
+        self.entries: OrderedDict = OrderedDict()  #: Key -> (stamp, data)
+        self.hits = 0
+        self.misses = 0
+        self.evicted = 0
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def stamp() -> float:
+        return versions.get(versions.CATALOG)
+
+    def get(self, key: str, stamp: float) -> Optional[Any]:
+        now = time.monotonic()
+        if self.stats_interval and now - self.logged_at >= self.stats_interval:
+            self.logged_at = now
+            logger.info('Catalog cache of process %s: %s', os.getpid(), self.stats())
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None or entry[0] != stamp:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def set(self, key: str, stamp: float, data: Any):
+        """Stamp must be taken before data is queried, so data changed meanwhile is not served"""
+        with self.lock:
+            self.entries[key] = (stamp, data)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+                self.evicted += 1
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {'size': len(self.entries), 'hits': self.hits, 'misses': self.misses, 'evicted': self.evicted}
+
+
+@receiver(post_save, sender=Track)
+@receiver(post_delete, sender=Track)
+@receiver(post_save, sender=TrackFile)
+@receiver(post_delete, sender=TrackFile)
+@receiver(post_save, sender=Artist)
+@receiver(post_delete, sender=Artist)
+def catalog_changed(**kwargs):
+    # Stamp is bumped by versions receivers, outdated entries are only freed here
+    cache.clear()
+
+
+cache = CatalogCache(settings.CATALOG_CACHE_SIZE, settings.STATS_LOG_INTERVAL)
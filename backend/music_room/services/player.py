@@ -1,15 +1,57 @@
 import random
+from bisect import bisect_left
 from functools import wraps
-from typing import Callable
+from typing import Callable, List, Tuple
 
+from django.conf import settings
 from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+from django.utils import timezone
 
 from music_room.models import PlayerSession, SessionTrack, Track
+from music_room.ordering import ORDER_GAP, order_between
+from .session_state import engine, SessionState, SessionTrackVote, TRACK, STATE, PROGRESS, VOTES_COUNT, ORDER, \
+    STARTED_AT
+from .sync import coalescer
 
 User = get_user_model()
 
+#: Compact session track fields, order of :meth:`PlayerService.snapshot` rows
+SNAPSHOT_FIELDS = ('id', 'track', 'state', 'progress', 'votes_count')
+
+
+def stable_indexes(indexes: List[int]) -> set:
+    """Positions of longest increasing subsequence, items which keep relative order"""
+    tails, tails_positions, parents = [], [], [None] * len(indexes)
+    for position, index in enumerate(indexes):
+        i = bisect_left(tails, index)
+        if i == len(tails):
+            tails.append(index)
+            tails_positions.append(position)
+        else:
+            tails[i] = index
+            tails_positions[i] = position
+        parents[position] = tails_positions[i - 1] if i else None
+    stable = set()
+    position = tails_positions[-1] if tails_positions else None
+    while position is not None:
+        stable.add(position)
+        position = parents[position]
+    return stable
+
 
 class PlayerService:
+    """
+    Player session actions. Reads and changes go to session state in memory, see :class:`SessionStateEngine`,
+    changes are written to database by :meth:`save`. Progress of playing track is counted by server clock
+    at :attr:`now`, moment when service is created
+    """
+
+    class TrackNotFound(Exception):
+        """Session track is not in session queue"""
+
     class Decorators:
         @staticmethod
         def lookup_player_session(f: Callable):
@@ -27,8 +69,11 @@ class PlayerService:
         def lookup_session_track(f: Callable):
             @wraps(f)
             def wrapper(self, track, *args):
-                if isinstance(track, int):
-                    track = SessionTrack.objects.get(id=track)
+                if isinstance(track, SessionTrack):
+                    track = track.id
+                # Checked before any change, unknown track must not leave state half changed
+                if track not in self.state.tracks:
+                    raise PlayerService.TrackNotFound(track)
                 return f(self, track, *args)
 
             return wrapper
@@ -46,17 +91,104 @@ class PlayerService:
     @Decorators.lookup_player_session
     def __init__(self, player_session: [int, PlayerSession]):
         self.player_session: PlayerSession = player_session
+        self.now = timezone.now()
+
+    @property
+    def state(self) -> SessionState:
+        return engine.get(self.player_session)
+
+    def snapshot(self) -> List[Tuple]:
+        """Track queue in play order as compact rows, see :data:`SNAPSHOT_FIELDS`"""
+        return self.state.snapshot(self.now)
 
     @staticmethod
-    def vote(track: [int, SessionTrack], user: User):
-        if isinstance(track, int):
-            track = SessionTrack.objects.get(id=track)
-        track.votes.remove(user) if user in track.votes.all() else track.votes.add(user)
-        track.votes_count = track.votes.all().count()
-        # If only one vote, is not affect the queue
-        if track.votes_count == 1:
-            track.votes_count = 0
-        track.save()
+    def delta(before: List[Tuple], after: List[Tuple]) -> dict:
+        """
+        Changes between two snapshots. To apply: drop removed tracks and moved tracks,
+        then put moved and inserted tracks to their indexes in ascending order
+        """
+        before_indexes = {row[0]: i for i, row in enumerate(before)}
+        before_rows = {row[0]: row for row in before}
+        after_ids = {row[0] for row in after}
+        common = [(i, row) for i, row in enumerate(after) if row[0] in before_indexes]
+        stable = stable_indexes([before_indexes[row[0]] for _, row in common])
+
+        delta = {
+            'removed': [row[0] for row in before if row[0] not in after_ids],
+            'inserted': [
+                {'index': i, 'track': dict(zip(SNAPSHOT_FIELDS, row))}
+                for i, row in enumerate(after) if row[0] not in before_indexes
+            ],
+            'moved': [{'id': row[0], 'index': i} for position, (i, row) in enumerate(common) if position not in stable],
+            'changed': [],
+        }
+        for _, row in common:
+            changes = {
+                field: value
+                for field, value, old_value in zip(SNAPSHOT_FIELDS[2:], row[2:], before_rows[row[0]][2:])
+                if value != old_value
+            }
+            if changes:
+                delta['changed'].append({'id': row[0], **changes})
+        return delta
+
+    def save(self, increase_version: bool = True) -> bool:
+        """Write session state changes in one transaction"""
+        state = self.state
+        saved = engine.flush(state, increase_version)
+        self.player_session.version = state.version
+        return saved
+
+    def reload(self):
+        engine.drop(self.player_session.id)
+
+    def to_data(self) -> dict:
+        return self.state.to_data(self.now)
+
+    def session_track(self, track: int) -> [SessionTrack, None]:
+        """Session track built from state, without database query"""
+        if track is None:
+            return None
+        row = self.state.tracks[track]
+        return SessionTrack(
+            id=track, track_id=row[TRACK], state=row[STATE], progress=self.state.progress(track, self.now),
+            votes_count=row[VOTES_COUNT], order=row[ORDER]
+        )
+
+    def set_track_state(self, track: int, state: str):
+        """Change track state, playback clock runs only while track is playing"""
+        playing = self.state.tracks[track][STATE] == SessionTrack.States.playing
+        if state == SessionTrack.States.playing and not playing:
+            self.state.set(track, STARTED_AT, self.now)
+        elif state != SessionTrack.States.playing and playing:
+            pending = coalescer.take(self.player_session.id, playing) if track == self.state.queue[0] else None
+            if pending is not None:
+                self.sync_track(pending)
+            self.state.set(track, PROGRESS, self.state.progress(track, self.now))
+            self.state.set(track, STARTED_AT, None)
+        self.state.set(track, STATE, state)
+
+    @Decorators.lookup_session_track
+    def vote(self, track: [int, SessionTrack], user: User) -> bool:
+        """
+        Toggle user vote for track, returns True if vote is added. Written at once: one delete or insert of vote,
+        then votes count is updated from votes in the same statement, so concurrent votes are not lost
+        """
+        with transaction.atomic():
+            voted = not SessionTrackVote.objects.filter(sessiontrack_id=track, user_id=user.id).delete()[0]
+            if voted:
+                SessionTrackVote.objects.bulk_create(
+                    [SessionTrackVote(sessiontrack_id=track, user_id=user.id)], ignore_conflicts=True
+                )
+            votes = SessionTrackVote.objects.filter(sessiontrack_id=OuterRef('id')).order_by().values(
+                'sessiontrack_id'
+            ).annotate(count=Count('id')).values('count')
+            session_track = SessionTrack.objects.filter(id=track)
+            session_track.update(votes_count=Coalesce(Subquery(votes), 0))
+            # If only one vote, is not affect the queue
+            session_track.filter(votes_count=1).update(votes_count=0)
+            self.state.voted(track, session_track.values_list('votes_count', flat=True).get())
+        return voted
 
     def play_next(self) -> SessionTrack:
         if self.player_session.mode == self.player_session.Modes.repeat:
@@ -69,120 +201,132 @@ class PlayerService:
         return self.play_track(self.previous_track)
 
     def reset_tracks_progress(self):
-        for track in self.player_session.track_queue.filter(progress__gt=0).all():
-            track: SessionTrack
-            track.progress = 0
-            track.save()
+        self.state.set_all(PROGRESS, 0.0)
 
     def reset_tracks_votes(self):
-        for track in self.player_session.track_queue.all():
-            track: SessionTrack
-            track.votes.clear()
-            track.votes_count = 0
-            track.save()
+        self.state.clear_votes()
+        self.state.set_all(VOTES_COUNT, 0)
 
     @Decorators.lookup_session_track
     def play_track(self, track: [int, SessionTrack]) -> SessionTrack:
-        first_track = self.current_track
-        next_track = track
-        last_track = self.previous_track
+        queue = self.state.queue
+        first_track, last_track = queue[0], queue[-1]
 
-        reverse = next_track == last_track
+        reverse = track == last_track
+        last_ordered = self.ordered()[-1]
 
-        next_track.order = -1
-        if not reverse:
-            first_track.order = self.player_session.track_queue.all().count()
+        # Voted track can be first in queue and last by order at once, then it is already in place
+        if not reverse and first_track != last_ordered:
+            self.move(first_track, last_ordered)
+        self.move(track)
 
-        first_track.state = SessionTrack.States.stopped
-        next_track.state = SessionTrack.States.playing
-        next_track.save()
-        first_track.save()
-        last_track.save()
-        track.save()
+        self.set_track_state(first_track, SessionTrack.States.stopped)
+        self.set_track_state(track, SessionTrack.States.playing)
 
         self.reset_tracks_progress()
         self.reset_tracks_votes()
-        self.resort()
-        return track
+        return self.session_track(track)
 
     @Decorators.lookup_session_track
     def delay_play_track(self, track: [int, SessionTrack]) -> SessionTrack:
-        self.current_track.order = -1
-        track.order = 0
-        self.current_track.save()
-        track.save()
-
-        self.resort()
-        return track
+        current_track = self.state.queue[0]
+        self.move(current_track)
+        if track != current_track:
+            self.move(track, current_track)
+        return self.session_track(track)
 
     @property
     def previous_track(self) -> SessionTrack:
-        return self.player_session.track_queue.last()
+        return self.session_track(self.state.queue[-1] if self.state.queue else None)
 
     @property
     def current_track(self) -> SessionTrack:
-        return self.player_session.track_queue.first()
+        return self.session_track(self.state.queue[0] if self.state.queue else None)
 
     @property
     def next_track(self) -> SessionTrack:
-        if self.player_session.track_queue.all().count() >= 2:
-            return self.player_session.track_queue.all()[1]
+        if len(self.state.queue) >= 2:
+            return self.session_track(self.state.queue[1])
         else:
             return self.current_track
 
-    def shuffle(self):
-        if self.current_track:
-            tracks = list(self.player_session.playlist.tracks.exclude(track=self.current_track.track).all())
-            self.player_session.track_queue.exclude(order=self.current_track.order).all().delete()
-        else:
-            tracks = list(self.player_session.playlist.tracks.all())
-        for i in range(len(tracks)):
-            random_track = random.choice(tracks)
-            session_track = SessionTrack.objects.create(
-                track=tracks.pop(tracks.index(random_track)).track,
-                order=i + 1
-            )
-            self.player_session.track_queue.add(session_track)
+    def shuffle(self, seed: int = None):
+        """Shuffle track queue, current track stays first. Pass ``seed`` to get reproducible order"""
+        current_track = self.current_track
+        if current_track:
+            self.state.set(current_track.id, ORDER, 0)
+        self.save(increase_version=False)
+        tracks = list(self.player_session.playlist.tracks.values_list('track_id', flat=True))
+        if current_track:
+            tracks = [track for track in tracks if track != current_track.track_id]
+            self.player_session.track_queue.exclude(id=current_track.id).delete()
+        # Fisher-Yates in place
+        random.Random(seed).shuffle(tracks)
+        self.player_session.create_track_queue(tracks, first_order=ORDER_GAP)
+        self.reload()
 
     def pause_track(self):
-        track: SessionTrack = self.current_track
-        track.state = SessionTrack.States.paused
-        track.save()
+        self.set_track_state(self.state.queue[0], SessionTrack.States.paused)
 
     def resume_track(self):
-        track: SessionTrack = self.current_track
-        track.state = SessionTrack.States.playing
-        track.save()
+        self.set_track_state(self.state.queue[0], SessionTrack.States.playing)
 
     def stop_track(self):
-        track: SessionTrack = self.current_track
-        track.state = SessionTrack.States.stopped
-        track.save()
+        self.set_track_state(self.state.queue[0], SessionTrack.States.stopped)
 
     def freeze_session(self):
-        track: SessionTrack = self.player_session.track_queue.filter(state=SessionTrack.States.playing).first()
-        if track:
-            track.state = SessionTrack.States.paused
-            track.save()
+        for track in self.state.queue:
+            if self.state.tracks[track][STATE] == SessionTrack.States.playing:
+                self.set_track_state(track, SessionTrack.States.paused)
+                break
+        if self.state.changed or self.state.dirty_progress:
+            self.save(increase_version=self.state.changed)
 
     def sync_track(self, progress: float):
-        track: SessionTrack = self.current_track
-        track.progress = progress
-        track.save()
+        """Correct server clock by reported progress, only if it drifted more than tolerance"""
+        track = self.state.queue[0]
+        if abs(self.state.progress(track, self.now) - progress) > settings.PLAYER_SYNC_TOLERANCE:
+            self.state.set(track, PROGRESS, progress)
+            if self.state.tracks[track][STATE] == SessionTrack.States.playing:
+                self.state.set(track, STARTED_AT, self.now)
+        engine.flush_behind(self.state)
+
+    def ordered(self) -> List[int]:
+        """Session tracks ids by order only, regardless of votes"""
+        tracks = self.state.tracks
+        return sorted(tracks, key=lambda i: (tracks[i][ORDER], i))
+
+    def move(self, track: int, after: int = None):
+        """Put track right after another one by order (first if not provided), changes only moved track order"""
+        for _ in range(2):
+            ordered = [i for i in self.ordered() if i != track]
+            index = ordered.index(after) + 1 if after is not None else 0
+            order = order_between(
+                self.state.tracks[ordered[index - 1]][ORDER] if index else None,
+                self.state.tracks[ordered[index]][ORDER] if index < len(ordered) else None
+            )
+            if order is not None:
+                self.state.set(track, ORDER, order)
+                return
+            self.rebalance()
 
-    def resort(self):
-        for i, track in enumerate(self.player_session.track_queue.all()):
-            track.order = i
-            track.save()
+    def rebalance(self):
+        """Spread orders with equal gaps, rewrites every track, needed only when there is no gap left"""
+        for i, track in enumerate(self.ordered()):
+            self.state.set(track, ORDER, i * ORDER_GAP)
 
     @Decorators.lookup_track
     def add_track(self, track: [int, Track]):
-        session_track = SessionTrack.objects.create(
-            track=track,
-            order=self.player_session.track_queue.all().count()
-        )
+        ordered = self.ordered()
+        order = order_between(self.state.tracks[ordered[-1]][ORDER] if ordered else None, None)
+        if order is None:
+            self.rebalance()
+            order = len(ordered) * ORDER_GAP
+        session_track = SessionTrack.objects.create(track=track, order=order)
         self.player_session.track_queue.add(session_track)
+        self.state.add(session_track)
 
     @Decorators.lookup_session_track
     def remove_track(self, track: [int, SessionTrack]):
         self.player_session.track_queue.remove(track)
+        self.state.remove(track)
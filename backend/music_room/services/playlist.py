@@ -2,7 +2,9 @@ from typing import Callable
 
 from django.contrib.auth import get_user_model
 
-from music_room.models import Track, Playlist
+from music_room.models import Track, Playlist, PlaylistTrack
+from music_room.ordering import ORDER_GAP, order_between
+from . import versions
 
 User = get_user_model()
 
@@ -48,13 +50,35 @@ class PlaylistService:
 
     @Decorators.lookup_track
     def add_track(self, track: [int, Track]):
-        self.playlist.tracks.create(track=track, order=self.playlist.tracks.all().count() + 1)
-        self.resort()
+        last = self.playlist.tracks.order_by('-order').values_list('order', flat=True).first()
+        order = order_between(last, None)
+        if order is None:
+            order = self.rebalance() * ORDER_GAP
+        self.playlist.tracks.create(track=track, order=order)
 
     @Decorators.lookup_track
     def remove_track(self, track: [int, Track]):
+        # Gaps are allowed, other tracks orders stay as is
         self.playlist.tracks.filter(track=track).delete()
-        self.resort()
+
+    @Decorators.lookup_track
+    def move_track(self, track: Track, position: int):
+        """Put track to position (from 0) in playlist, changes only moved track order"""
+        playlist_track = self.playlist.tracks.filter(track=track).first()
+        if not playlist_track:
+            return
+        for _ in range(2):
+            orders = self.playlist.tracks.exclude(id=playlist_track.id).values_list('order', flat=True)
+            position = max(0, min(position, orders.count()))
+            neighbours = list(orders[max(position - 1, 0):position + 1])
+            before = neighbours.pop(0) if position else None
+            after = neighbours[0] if neighbours else None
+            order = order_between(before, after)
+            if order is not None:
+                playlist_track.order = order
+                playlist_track.save(update_fields=['order'])
+                return
+            self.rebalance()
 
     def change(self, name: str = None, access_type: [str, Playlist.AccessTypes] = None):
         if not name:
@@ -67,7 +91,7 @@ class PlaylistService:
 
     @Decorators.lookup_user
     def invite_user(self, user: User):
-        self.playlist.playlist_access_users.add(user)
+        self.playlist.playlist_access_users.get_or_create(user=user)
 
     @Decorators.lookup_user
     def revoke_user(self, user: User):
@@ -77,7 +101,11 @@ class PlaylistService:
         self.playlist.access_type = access_type
         self.playlist.save()
 
-    def resort(self):
-        for i, track in enumerate(self.playlist.tracks.all()):
-            track.order = i
-            track.save()
+    def rebalance(self) -> int:
+        """Spread orders with equal gaps, rewrites every track, needed only when there is no gap left"""
+        tracks = list(self.playlist.tracks.all())
+        for i, track in enumerate(tracks):
+            track.order = i * ORDER_GAP
+        PlaylistTrack.objects.bulk_update(tracks, ['order'])
+        versions.bump(versions.playlist_key(self.playlist.id))
+        return len(tracks)
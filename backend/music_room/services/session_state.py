@@ -0,0 +1,261 @@
+import threading
+import time
+from datetime import datetime
+from typing import Dict, List, Set, Tuple
+
+from django.conf import settings
+from django.db import transaction, connection
+from django.db.models import F
+from django.db.models.signals import post_delete
+from django.dispatch import receiver
+
+from music_room.models import PlayerSession, SessionTrack
+
+#: Indexes of session track row fields in :attr:`SessionState.tracks`
+TRACK, STATE, PROGRESS, VOTES_COUNT, ORDER, STARTED_AT = range(6)
+
+SessionTrackVote = SessionTrack.votes.through
+
+#: Playback clock fields, changes of them only are written behind
+CLOCK = (PROGRESS, STARTED_AT)
+
+#: Session track columns by row field index, for fields which can be reset for the whole session
+RESET_COLUMNS = {PROGRESS: 'progress', VOTES_COUNT: 'votes_count'}
+
+UPDATE_SESSION_TRACK = 'UPDATE {} SET {} = %s, {} = %s, {} = %s, {} = %s, {} = %s WHERE {} = %s'.format(
+    *map(connection.ops.quote_name, (
+        SessionTrack._meta.db_table, 'state', 'progress', 'votes_count', 'order', 'started_at', 'id'
+    ))
+)
+
+UPDATE_SESSION_TRACK_CLOCK = 'UPDATE {} SET {} = %s, {} = %s WHERE {} = %s'.format(
+    *map(connection.ops.quote_name, (SessionTrack._meta.db_table, 'progress', 'started_at', 'id'))
+)
+
+class SessionState:
+    """
+    Compact state of player session: session track id -> [track id, state, progress, votes count, order, started at].
+    Changed rows are marked dirty until flushed by :class:`SessionStateEngine`. Voted users are not kept,
+    votes are written to database at once, see :meth:`PlayerService.vote`
+    """
+
+    def __init__(self, player_session: PlayerSession, tracks: Dict[int, list]):
+        self.id: int = player_session.id
+        self.version: int = player_session.version
+        self.mode: str = player_session.mode
+        self.playlist_id: int = player_session.playlist_id
+        self.author_id: int = player_session.author_id
+        self.tracks = tracks
+        self.dirty: Set[int] = set()  #: Session tracks with changed state, votes count or order
+        self.dirty_votes: Set[int] = set()  #: Session tracks with votes already written, only version is increased
+        self.dirty_progress: Set[int] = set()  #: Session tracks with changed playback clock only, written behind
+        self.reset: Dict[int, object] = {}  #: Fields set to one value for all session tracks, written by one update
+        self.reset_votes: bool = False  #: All votes removed, written by one delete
+        self.flushed_at = time.monotonic()
+        self._queue = None
+
+    @classmethod
+    def load(cls, player_session: PlayerSession) -> 'SessionState':
+        tracks = {
+            row[0]: list(row[1:])
+            for row in player_session.track_queue.values_list(
+                'id', 'track_id', 'state', 'progress', 'votes_count', 'order', 'started_at'
+            )
+        }
+        return cls(player_session, tracks)
+
+    @property
+    def queue(self) -> List[int]:
+        """Session tracks ids in play order, same as :class:`SessionTrack` ordering"""
+        if self._queue is None:
+            self._queue = sorted(self.tracks, key=lambda i: (-self.tracks[i][VOTES_COUNT], self.tracks[i][ORDER], i))
+        return self._queue
+
+    @property
+    def changed(self) -> bool:
+        """Has changes other workers must see, progress is not counted"""
+        return bool(self.dirty or self.dirty_votes or self.reset or self.reset_votes)
+
+    def set(self, session_track_id: int, field: int, value):
+        row = self.tracks[session_track_id]
+        if row[field] == value:
+            return
+        row[field] = value
+        if field in CLOCK:
+            self.dirty_progress.add(session_track_id)
+        else:
+            self.dirty.add(session_track_id)
+        if field in (VOTES_COUNT, ORDER):
+            self._queue = None
+
+    def set_all(self, field: int, value):
+        """Set field of every session track, see :data:`RESET_COLUMNS`"""
+        if all(row[field] == value for row in self.tracks.values()):
+            return
+        for row in self.tracks.values():
+            row[field] = value
+        self.reset[field] = value
+        if field == VOTES_COUNT:
+            self._queue = None
+
+    def voted(self, session_track_id: int, votes_count: int):
+        """Votes count already written to database"""
+        self.tracks[session_track_id][VOTES_COUNT] = votes_count
+        self.dirty_votes.add(session_track_id)
+        self._queue = None
+
+    def clear_votes(self):
+        self.reset_votes = True
+
+    def add(self, session_track: SessionTrack):
+        self.tracks[session_track.id] = [
+            session_track.track_id, session_track.state, session_track.progress,
+            session_track.votes_count, session_track.order, session_track.started_at
+        ]
+        self._queue = None
+
+    def remove(self, session_track_id: int):
+        self.tracks.pop(session_track_id, None)
+        for dirty in (self.dirty, self.dirty_votes, self.dirty_progress):
+            dirty.discard(session_track_id)
+        self._queue = None
+
+    def progress(self, session_track_id: int, now: datetime) -> float:
+        row = self.tracks[session_track_id]
+        return SessionTrack.progress_at(row[PROGRESS], row[STARTED_AT], now)
+
+    def snapshot(self, now: datetime) -> List[Tuple]:
+        return [
+            (i, self.tracks[i][TRACK], self.tracks[i][STATE], self.progress(i, now), self.tracks[i][VOTES_COUNT])
+            for i in self.queue
+        ]
+
+    def to_data(self, now: datetime) -> dict:
+        """Same as :class:`music_room.serializers.PlayerSessionSerializer` data, progress is counted at ``now``"""
+        return {
+            'id': self.id,
+            'track_queue': [
+                {
+                    'id': i,
+                    'state': self.tracks[i][STATE],
+                    'progress': self.progress(i, now),
+                    'track': self.tracks[i][TRACK],
+                    'votes_count': self.tracks[i][VOTES_COUNT],
+                }
+                for i in self.queue
+            ],
+            'mode': self.mode,
+            'version': self.version,
+            'playlist': self.playlist_id,
+            'author': self.author_id,
+        }
+
+
+class SessionStateEngine:
+    """
+    Player sessions state kept in process memory. State is valid while its version matches
+    player session version in database, otherwise it is loaded again (e.g. changed by another worker).
+    Changes are flushed in one transaction, playback clock only changes are written behind
+    """
+
+    def __init__(self, flush_interval: float = 5):
+        self.flush_interval = flush_interval  #: Seconds between progress only flushes
+        self.states: Dict[int, SessionState] = {}
+        self.lock = threading.RLock()
+
+    def get(self, player_session: PlayerSession) -> SessionState:
+        with self.lock:
+            state = self.states.get(player_session.id)
+            if not state or state.version != player_session.version:
+                state = self.states[player_session.id] = SessionState.load(player_session)
+            return state
+
+    def drop(self, player_session_id: int):
+        with self.lock:
+            self.states.pop(player_session_id, None)
+
+    def lock_version(self, state: SessionState, increase_version: bool = False) -> bool:
+        """
+        Lock player session row till the end of transaction if state is not outdated, otherwise drop state.
+        Session row is locked before :attr:`lock`, the same order as session actions take them
+        """
+        session = PlayerSession.objects.filter(id=state.id, version=state.version)
+        if increase_version:
+            locked = session.update(version=F('version') + 1)
+        else:
+            locked = session.select_for_update().exists()
+        if not locked:
+            self.drop(state.id)
+        return bool(locked)
+
+    @staticmethod
+    def write_clock(state: SessionState, rows: Set[int]):
+        if rows:
+            with connection.cursor() as cursor:
+                cursor.executemany(UPDATE_SESSION_TRACK_CLOCK, [
+                    (
+                        state.tracks[i][PROGRESS],
+                        connection.ops.adapt_datetimefield_value(state.tracks[i][STARTED_AT]),
+                        i
+                    )
+                    for i in rows
+                ])
+
+    def flush(self, state: SessionState, increase_version: bool = False) -> bool:
+        """Write dirty rows, reset fields and version, returns False if state is outdated and dropped"""
+        with transaction.atomic():
+            if not self.lock_version(state, increase_version):
+                return False
+
+            with self.lock:
+                if state.reset:
+                    SessionTrack.objects.filter(playersession=state.id).update(
+                        **{RESET_COLUMNS[field]: value for field, value in state.reset.items()}
+                    )
+                if state.reset_votes:
+                    SessionTrackVote.objects.filter(sessiontrack__playersession=state.id).delete()
+
+                if state.dirty:
+                    # One batched statement, bulk_update builds CASE expression per row which is slow for long queues
+                    with connection.cursor() as cursor:
+                        cursor.executemany(UPDATE_SESSION_TRACK, [
+                            (
+                                *state.tracks[i][STATE:ORDER + 1],
+                                connection.ops.adapt_datetimefield_value(state.tracks[i][STARTED_AT]),
+                                i
+                            )
+                            for i in state.dirty
+                        ])
+                self.write_clock(state, state.dirty_progress - state.dirty)
+
+                if increase_version:
+                    state.version += 1
+                state.dirty.clear()
+                state.dirty_votes.clear()
+                state.dirty_progress.clear()
+                state.reset.clear()
+                state.reset_votes = False
+                state.flushed_at = time.monotonic()
+                return True
+
+    def flush_behind(self, state: SessionState):
+        """
+        Write playback clock only if flush interval passed. Other changes are left to :meth:`flush`
+        of the action which made them, they could be not written yet
+        """
+        if not state.dirty_progress or time.monotonic() - state.flushed_at < self.flush_interval:
+            return
+        with transaction.atomic():
+            if not self.lock_version(state):
+                return
+            with self.lock:
+                self.write_clock(state, state.dirty_progress)
+                state.dirty_progress.clear()
+                state.flushed_at = time.monotonic()
+
+@receiver(post_delete, sender=PlayerSession)
+def player_session_post_delete(instance: PlayerSession, **kwargs):
+    engine.drop(instance.id)
+
+
+engine = SessionStateEngine(settings.PLAYER_STATE_FLUSH_INTERVAL)
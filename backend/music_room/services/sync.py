@@ -0,0 +1,76 @@
+import logging
+import os
+import threading
+import time
+from typing import Dict, Optional, Tuple
+
+from django.conf import settings
+from django.db.models.signals import post_delete
+from django.dispatch import receiver
+
+from music_room.models import PlayerSession
+
+logger = logging.getLogger(__name__)
+
+
+class SyncCoalescer:
+    """
+    Coalescing of reported track progress per player session: at most one sync is applied per window,
+    syncs received inside window replace each other and only the latest one is kept pending.
+    Counters of process are logged with the next sync after ``stats_interval`` seconds
+    """
+
+    def __init__(self, window: float = 1, stats_interval: float = 0):
+        self.window = window  #: Seconds between applied syncs of one session
+        self.stats_interval = stats_interval  #: Seconds between logged counters, 0 turns them off
+        self.logged_at = time.monotonic()  #: Last logged counters time
+        self.pending: Dict[int, Tuple[float, float]] = {}  #: Player session id -> (progress, received at)
+        self.applied_at: Dict[int, float] = {}  #: Player session id -> last applied sync time
+        self.received = 0  #: Syncs received
+        self.applied = 0  #: Syncs applied
+        self.dropped = 0  #: Syncs replaced by later ones and never applied
+        self.lock = threading.Lock()
+
+    def offer(self, player_session_id: int, progress: float) -> Optional[float]:
+        """Progress to apply now, None if sync is kept pending till window ends"""
+        now = time.monotonic()
+        if self.stats_interval and now - self.logged_at >= self.stats_interval:
+            self.logged_at = now
+            logger.info('Player syncs of process %s: %s', os.getpid(), self.stats())
+        with self.lock:
+            self.received += 1
+            if player_session_id in self.pending:
+                self.dropped += 1
+            if now - self.applied_at.get(player_session_id, -self.window) < self.window:
+                self.pending[player_session_id] = (progress, now)
+                return None
+            self.pending.pop(player_session_id, None)
+            self.applied_at[player_session_id] = now
+            self.applied += 1
+            return progress
+
+    def take(self, player_session_id: int, playing: bool) -> Optional[float]:
+        """Pending progress, moved on by time passed since it was received if track is playing"""
+        with self.lock:
+            pending = self.pending.pop(player_session_id, None)
+            if not pending:
+                return None
+            self.applied += 1
+            progress, received_at = pending
+            return progress + time.monotonic() - received_at if playing else progress
+
+    def forget(self, player_session_id: int):
+        with self.lock:
+            self.pending.pop(player_session_id, None)
+            self.applied_at.pop(player_session_id, None)
+
+    def stats(self) -> dict:
+        return {'received': self.received, 'applied': self.applied, 'dropped': self.dropped}
+
+
+@receiver(post_delete, sender=PlayerSession)
+def player_session_post_delete(instance: PlayerSession, **kwargs):
+    coalescer.forget(instance.id)
+
+
+coalescer = SyncCoalescer(settings.PLAYER_SYNC_WINDOW, settings.STATS_LOG_INTERVAL)
@@ -0,0 +1,286 @@
+"""
+Probing and transcoding of uploaded track files to renditions with ffmpeg, out of request. Upload only creates
+:class:`music_room.models.TranscodeJob`, jobs are taken by ``transcode_worker`` command and run in its processes
+"""
+import os
+import subprocess
+import tempfile
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from typing import Callable, List, IO, Optional, Tuple
+
+from django.conf import settings
+from django.core.files import File
+from django.core.files.storage import default_storage
+from django.db.models import F, Q
+from django.utils import timezone
+
+from music_room.models import TrackFile, TranscodeJob
+
+
+#: Rendition codec -> (ffmpeg encoder, ffmpeg output format, file extension)
+CODECS = {
+    'mp3': ('libmp3lame', 'mp3', TrackFile.Extensions.mp3),
+    'opus': ('libopus', 'ogg', TrackFile.Extensions.opus),
+}
+#: Rendition codec -> (HLS segment type, segment extension), Opus is not carried by MPEG-TS
+HLS_SEGMENTS = {
+    'mp3': ('mpegts', 'ts'),
+    'opus': ('fmp4', 'm4s'),
+}
+#: Name of HLS media playlist in rendition HLS directory
+HLS_PLAYLIST = 'index.m3u8'
+#: Rendition codec -> codec of HLS multivariant playlist
+HLS_CODECS = {
+    'mp3': 'mp4a.40.34',
+    'opus': 'Opus',
+}
+#: Extensions of files which get whole ladder of renditions
+LOSSLESS = {TrackFile.Extensions.flac}
+
+#: Bytes read from ffmpeg output at once
+CHUNK_SIZE = 64 * 1024
+#: Bytes of ffmpeg errors kept in job error
+ERROR_SIZE = 16 * 1024
+
+
+class TranscodeError(Exception):
+    """ffmpeg or ffprobe failed"""
+
+
+def source_path(file: TrackFile) -> str:
+    if settings.AWS_S3_CUSTOM_DOMAIN:
+        return f'https://{settings.AWS_S3_CUSTOM_DOMAIN}/{file.file.name}'
+    return file.file.path
+
+
+def run(cmd: List[str], stdin: IO[bytes] = None) -> bytes:
+    # ffmpeg reads commands from inherited stdin otherwise
+    process = subprocess.run(
+        cmd, stdin=stdin or subprocess.DEVNULL, stdout=subprocess.PIPE, stderr=subprocess.PIPE
+    )
+    if process.returncode:
+        raise TranscodeError(f'{cmd[0]} exited with {process.returncode}: {process.stderr.decode("utf-8")}')
+    return process.stdout
+
+
+def encode(cmd: List[str]) -> IO[bytes]:
+    """
+    Run ffmpeg writing to stdout, output is read in chunks to temporary file which is kept in memory
+    only up to ``TRANSCODE_SPOOL_SIZE``, so memory of job doesn't depend on track length
+    """
+    output = tempfile.SpooledTemporaryFile(max_size=settings.TRANSCODE_SPOOL_SIZE)
+    try:
+        # Errors go to file too, pipe of them could fill up and block ffmpeg
+        with tempfile.TemporaryFile() as errors:
+            process = subprocess.Popen(cmd, stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, stderr=errors)
+            with process.stdout:
+                for chunk in iter(lambda: process.stdout.read(CHUNK_SIZE), b''):
+                    output.write(chunk)
+            if process.wait():
+                errors.seek(0)
+                raise TranscodeError(
+                    f'{cmd[0]} exited with {process.returncode}: {errors.read(ERROR_SIZE).decode("utf-8", "replace")}'
+                )
+    except BaseException:
+        output.close()
+        raise
+    output.seek(0)
+    return output
+
+
+def probe(path: str) -> Tuple[float, Optional[int]]:
+    """Duration in seconds and bitrate in kbps (None if unknown)"""
+    output = run([
+        'ffprobe',
+        '-i', path,
+        '-show_entries', 'format=duration,bit_rate',
+        '-v', 'quiet',
+        '-of', 'default=noprint_wrappers=1'
+    ])
+    entries = dict(line.split('=', 1) for line in output.decode('utf-8').split() if '=' in line)
+    try:
+        duration = float(entries['duration'])
+    except (KeyError, ValueError):
+        raise TranscodeError(f"Can't get duration of {path}")
+    bitrate = entries.get('bit_rate', '')
+    return duration, int(bitrate) // 1000 if bitrate.isdigit() else None
+
+
+def ladder(extension: str, bitrate: Optional[int]) -> List[Tuple[str, int]]:
+    """Renditions of ``TRANSCODE_RENDITIONS`` worth making of file, lossy file gets only lower bitrates"""
+    return [
+        (codec, rendition_bitrate) for codec, rendition_bitrate in settings.TRANSCODE_RENDITIONS
+        if extension in LOSSLESS or (bitrate is not None and rendition_bitrate < bitrate)
+    ]
+
+
+def hls_directory(name: str) -> str:
+    """Storage directory of rendition HLS segments and playlist, next to rendition file"""
+    # Extension is kept, renditions of different codecs have the same base name
+    return name.replace('.', '_') + '_hls'
+
+
+def segment(source: [str, IO[bytes]], directory: str, codec: str) -> str:
+    """
+    Split encoded rendition (path or file on disk) to HLS segments of ``TRANSCODE_HLS_SEGMENT_TIME`` seconds,
+    without encoding. Saved to storage directory, playlist is saved last. Returns playlist name
+    """
+    segment_type, extension = HLS_SEGMENTS[codec]
+    with tempfile.TemporaryDirectory() as output:
+        run([
+            'ffmpeg',
+            '-hide_banner',
+            '-loglevel', 'error',
+            '-i', source if isinstance(source, str) else 'pipe:0',
+            '-vn',
+            '-c:a', 'copy',
+            '-f', 'hls',
+            '-hls_time', str(settings.TRANSCODE_HLS_SEGMENT_TIME),
+            '-hls_playlist_type', 'vod',
+            '-hls_segment_type', segment_type,
+            '-hls_segment_filename', os.path.join(output, f'segment_%05d.{extension}'),
+            os.path.join(output, HLS_PLAYLIST)
+        ], stdin=None if isinstance(source, str) else source)
+        for file_name in sorted(os.listdir(output), key=lambda file_name: file_name == HLS_PLAYLIST):
+            # Playlist refers to segments by these names, so they must not be changed by storage
+            name = f'{directory}/{file_name}'
+            if default_storage.exists(name):
+                default_storage.delete(name)
+            with open(os.path.join(output, file_name), 'rb') as f:
+                default_storage.save(name, File(f, name=name))
+    return f'{directory}/{HLS_PLAYLIST}'
+
+
+def master_playlist(renditions: List[TrackFile], url: Callable[[str], str]) -> str:
+    """HLS multivariant playlist of segmented renditions, ``url`` makes absolute url of media playlist"""
+    lines = ['#EXTM3U', '#EXT-X-INDEPENDENT-SEGMENTS']
+    for rendition in sorted(renditions, key=lambda rendition: (rendition.bitrate, rendition.codec)):
+        if not rendition.hls:
+            continue
+        lines.append(
+            f'#EXT-X-STREAM-INF:BANDWIDTH={rendition.bitrate * 1000},CODECS="{HLS_CODECS[rendition.codec]}"'
+        )
+        lines.append(url(rendition.hls.url))
+    return '\n'.join(lines) + '\n'
+
+
+def make_rendition(path: str, name: str, codec: str, bitrate: int) -> Tuple[str, int, str]:
+    """
+    Encode and save rendition with its HLS segments, returns saved name (storage can change it if file exists),
+    size and HLS playlist name
+    """
+    encoder, output_format, _ = CODECS[codec]
+    with encode([
+        'ffmpeg',
+        '-hide_banner',
+        '-loglevel', 'error',
+        '-i', path,
+        '-vn',
+        '-c:a', encoder,
+        '-b:a', f'{bitrate}K',
+        '-f', output_format,
+        '-'
+    ]) as output:
+        size = output.seek(0, os.SEEK_END)
+        output.seek(0)
+        # Storage reads file by chunks (multipart upload for S3)
+        name = default_storage.save(name, File(output, name=name))
+        # Segmenter reads file from disk
+        output.rollover()
+        output.seek(0)
+        return name, size, segment(output, hls_directory(name), codec)
+
+
+def transcode(file: TrackFile):
+    """
+    Set duration, extension and size of uploaded file, make its renditions with HLS segments. Renditions are encoded
+    at once by separate ffmpeg processes, made ones are kept if others failed, so retry makes only the rest
+    """
+    path = source_path(file)
+    file.duration, source_bitrate = probe(path)
+    file.extension = file.file.name.split('.')[-1]
+    file.size = file.file.size
+    file.save(update_fields=['duration', 'extension', 'size'])
+
+    # Renditions made before HLS segmenting
+    for rendition in file.renditions.filter(Q(hls='') | Q(hls__isnull=True)):
+        rendition.hls = segment(source_path(rendition), hls_directory(rendition.file.name), rendition.codec)
+        rendition.save(update_fields=['hls'])
+
+    made = set(file.renditions.values_list('codec', 'bitrate'))
+    renditions = [rendition for rendition in ladder(file.extension, source_bitrate) if rendition not in made]
+    if not renditions:
+        return
+    base_name = file.file.name.rsplit('.', 1)[0]
+    with ThreadPoolExecutor(settings.TRANSCODE_RENDITION_WORKERS) as pool:
+        futures = {
+            (codec, bitrate): pool.submit(
+                make_rendition, path, f'{base_name}_{bitrate}k.{CODECS[codec][2]}', codec, bitrate
+            )
+            for codec, bitrate in renditions
+        }
+    errors, created = [], []
+    for (codec, bitrate), future in futures.items():
+        try:
+            name, size, hls = future.result()
+        except Exception as e:
+            errors.append(f'{codec} {bitrate}k: {e}')
+            continue
+        created.append(TrackFile.objects.create(
+            track=file.track, source=file, codec=codec, bitrate=bitrate, size=size,
+            duration=file.duration, extension=CODECS[codec][2], file=name, hls=hls
+        ).id)
+    # Uploaded file is replaced while encoding, renditions are made of the old one. The new file has its own job
+    if not TrackFile.objects.filter(id=file.id, file=file.file.name).exists():
+        TrackFile.objects.filter(id__in=created).delete()
+        return
+    if errors:
+        raise TranscodeError('\n'.join(errors))
+
+
+def claim(limit: int) -> List[int]:
+    """Take up to ``limit`` queued jobs, each job is taken by one worker only"""
+    claimed = []
+    queued = TranscodeJob.objects.filter(status=TranscodeJob.Statuses.queued).values_list('id', flat=True)
+    for job_id in queued[:limit]:
+        if TranscodeJob.objects.filter(id=job_id, status=TranscodeJob.Statuses.queued).update(
+                status=TranscodeJob.Statuses.running, attempts=F('attempts') + 1, started_at=timezone.now()
+        ):
+            claimed.append(job_id)
+    return claimed
+
+
+def finish(job_id: int, error: str = None):
+    """Mark job done, or queue it again after failed attempt while attempts are left"""
+    job = TranscodeJob.objects.get(id=job_id)
+    if error is None:
+        job.status = TranscodeJob.Statuses.done
+    elif job.attempts < settings.TRANSCODE_MAX_ATTEMPTS:
+        job.status = TranscodeJob.Statuses.queued
+    else:
+        job.status = TranscodeJob.Statuses.failed
+    job.error = error or ''
+    job.finished_at = timezone.now() if job.status != TranscodeJob.Statuses.queued else None
+    job.save(update_fields=['status', 'error', 'finished_at'])
+
+
+def requeue_stale() -> int:
+    """Queue again jobs of died workers, which are running longer than job timeout"""
+    return TranscodeJob.objects.filter(
+        status=TranscodeJob.Statuses.running,
+        started_at__lt=timezone.now() - timedelta(seconds=settings.TRANSCODE_JOB_TIMEOUT)
+    ).update(status=TranscodeJob.Statuses.queued)
+
+
+def process(job_id: int) -> str:
+    """One attempt of claimed job, runs in worker process. Returns job status"""
+    job = TranscodeJob.objects.select_related('file__track').get(id=job_id)
+    try:
+        transcode(job.file)
+    except Exception:
+        finish(job_id, traceback.format_exc())
+    else:
+        finish(job_id)
+    return TranscodeJob.objects.values_list('status', flat=True).get(id=job_id)
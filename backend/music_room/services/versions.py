@@ -0,0 +1,61 @@
+"""
+Version stamps of REST resources for conditional GET. Stamp is the time of the last change,
+kept in the default cache (shared by workers with Redis) and bumped by model signals.
+Changes which don't send signals (``bulk_update``, ``QuerySet.update``) must call :func:`bump`
+"""
+import hashlib
+import time
+
+from django.core.cache import cache
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from music_room.models import Track, TrackFile, Artist, Playlist, PlaylistTrack, PlaylistAccess
+
+#: Tracks, their files and artists
+CATALOG = 'catalog'
+
+KEY_PREFIX = 'version:'
+
+
+def playlist_key(playlist_id: int) -> str:
+    return f'playlist:{playlist_id}'
+
+
+def get(key: str) -> float:
+    """Stamp of resource, set to now if there is no stamp yet (e.g. cache is cleared)"""
+    return cache.get_or_set(KEY_PREFIX + key, time.time(), None)
+
+
+def bump(*keys: str):
+    now = time.time()
+    cache.set_many({KEY_PREFIX + key: now for key in keys}, None)
+
+
+def etag(stamp: float, *parts) -> str:
+    """Stamp and everything else response depends on, e.g. query string and user"""
+    return '"{}"'.format(hashlib.md5(':'.join(map(str, (stamp, *parts))).encode()).hexdigest())
+
+
+@receiver(post_save, sender=Track)
+@receiver(post_delete, sender=Track)
+@receiver(post_save, sender=TrackFile)
+@receiver(post_delete, sender=TrackFile)
+@receiver(post_save, sender=Artist)
+@receiver(post_delete, sender=Artist)
+def catalog_changed(**kwargs):
+    bump(CATALOG)
+
+
+@receiver(post_save, sender=Playlist)
+@receiver(post_delete, sender=Playlist)
+def playlist_changed(instance: Playlist, **kwargs):
+    bump(playlist_key(instance.id))
+
+
+@receiver(post_save, sender=PlaylistTrack)
+@receiver(post_delete, sender=PlaylistTrack)
+@receiver(post_save, sender=PlaylistAccess)
+@receiver(post_delete, sender=PlaylistAccess)
+def playlist_item_changed(instance: [PlaylistTrack, PlaylistAccess], **kwargs):
+    bump(playlist_key(instance.playlist_id))
@@ -0,0 +1,27 @@
+import logging
+import os
+
+from music_room.services.catalog import CatalogCache
+
+
+def test_stats_are_logged_once_per_interval(caplog):
+    cache = CatalogCache(max_size=1, stats_interval=60)
+    caplog.set_level(logging.INFO, 'music_room.services.catalog')
+    cache.set('a', 1, 'data')
+    cache.get('a', 1)
+    assert caplog.records == []
+
+    cache.logged_at -= 60
+    cache.get('b', 1)
+    cache.get('a', 1)
+    assert [record.getMessage() for record in caplog.records] == [
+        f"Catalog cache of process {os.getpid()}: {{'size': 1, 'hits': 1, 'misses': 0, 'evicted': 0}}"
+    ]
+
+
+def test_cached_links_are_of_request_host(api_client, make_playlist, settings):
+    settings.ALLOWED_HOSTS = ['a.example', 'b.example']
+    make_playlist(tracks_count=3)
+    for host in ('a.example', 'b.example', 'a.example'):
+        response = api_client.get('/api/track/?page_size=2', HTTP_HOST=host)
+        assert response.data['next'].startswith(f'http://{host}/api/track/?')
@@ -0,0 +1,38 @@
+from music_room.ordering import ORDER_GAP, ORDER_LIMIT, order_between
+
+
+def test_order_of_empty_queue():
+    assert order_between(None, None) == 0
+
+
+def test_order_at_edges():
+    assert order_between(None, 0) == -ORDER_GAP
+    assert order_between(0, None) == ORDER_GAP
+
+
+def test_order_between_neighbours():
+    assert order_between(0, ORDER_GAP) == ORDER_GAP // 2
+    assert order_between(0, 2) == 1
+
+
+def test_no_gap_left():
+    assert order_between(0, 1) is None
+    assert order_between(1, 1) is None
+
+
+def test_order_out_of_integer_field():
+    assert order_between(ORDER_LIMIT - 1, None) is None
+    assert order_between(None, -ORDER_LIMIT + 1) is None
+
+
+def test_gap_is_exhausted_after_log_of_gap_inserts():
+    before, after = 0, ORDER_GAP
+    inserts = 0
+    while True:
+        order = order_between(before, after)
+        if order is None:
+            break
+        assert before < order < after
+        after = order
+        inserts += 1
+    assert inserts == ORDER_GAP.bit_length() - 1
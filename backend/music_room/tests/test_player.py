@@ -0,0 +1,152 @@
+import random
+
+import pytest
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+from music_room.models import PlayerSession, SessionTrack
+from music_room.services.player import PlayerService, SNAPSHOT_FIELDS, stable_indexes
+
+
+def apply_delta(rows: list, delta: dict) -> list:
+    """Client side of delta protocol, see :meth:`PlayerService.delta`"""
+    moved = {item['id'] for item in delta['moved']}
+    removed = set(delta['removed'])
+    queue = [dict(zip(SNAPSHOT_FIELDS, row)) for row in rows]
+    queue = [track for track in queue if track['id'] not in removed | moved]
+    tracks = {track['id']: track for track in map(lambda row: dict(zip(SNAPSHOT_FIELDS, row)), rows)}
+    placed = [(item['index'], tracks[item['id']]) for item in delta['moved']]
+    placed += [(item['index'], dict(item['track'])) for item in delta['inserted']]
+    for index, track in sorted(placed, key=lambda item: item[0]):
+        queue.insert(index, track)
+    changes = {item['id']: item for item in delta['changed']}
+    for track in queue:
+        track.update({field: value for field, value in changes.get(track['id'], {}).items() if field != 'id'})
+    return [tuple(track[field] for field in SNAPSHOT_FIELDS) for track in queue]
+
+
+def test_stable_indexes():
+    assert stable_indexes([]) == set()
+    assert stable_indexes([0, 1, 2]) == {0, 1, 2}
+    assert stable_indexes([2, 0, 1]) == {1, 2}
+    assert len(stable_indexes([3, 1, 2, 0, 4])) == 3
+
+
+def test_delta_moves_only_unstable_tracks():
+    before = [(i, i, 'stopped', 0.0, 0) for i in range(5)]
+    after = [before[4], *before[:4]]
+    delta = PlayerService.delta(before, after)
+    assert delta == {'removed': [], 'inserted': [], 'moved': [{'id': 4, 'index': 0}], 'changed': []}
+
+
+def test_delta_applied_gives_new_queue():
+    rnd = random.Random(0)
+    for _ in range(200):
+        before = [(i, i, 'stopped', 0.0, 0) for i in rnd.sample(range(20), rnd.randrange(10))]
+        after = [row for row in before if rnd.random() > 0.2]
+        after += [(i, i, 'stopped', 0.0, 0) for i in range(20, 20 + rnd.randrange(3))]
+        rnd.shuffle(after)
+        after = [
+            (row[0], row[1], 'playing', 1.5, 2) if rnd.random() < 0.2 else row
+            for row in after
+        ]
+        assert apply_delta(before, PlayerService.delta(before, after)) == after
+
+
+def test_play_track(make_session):
+    player_service = PlayerService(make_session())
+    track = player_service.state.queue[2]
+    player_service.play_track(track)
+    player_service.save()
+
+    queue = list(PlayerSession.objects.get(id=player_service.player_session.id).track_queue.all())
+    assert queue[0].id == track and queue[0].state == SessionTrack.States.playing
+    assert all(session_track.state == SessionTrack.States.stopped for session_track in queue[1:])
+    assert [session_track.id for session_track in queue] == PlayerService(player_service.player_session).state.queue
+
+
+def test_play_next_and_previous(make_session):
+    player_service = PlayerService(make_session())
+    queue = player_service.state.queue
+    assert player_service.play_next().id == queue[1]
+    assert player_service.play_previous().id == queue[0]
+    assert player_service.state.queue == queue
+
+
+def test_vote_moves_track_up(make_session, user, other_user):
+    player_service = PlayerService(make_session())
+    track = player_service.state.queue[-1]
+    assert player_service.vote(track, user)
+    assert player_service.state.queue[-1] == track, 'one vote does not affect the queue'
+    assert player_service.vote(track, other_user)
+    assert player_service.state.queue[0] == track
+    assert not player_service.vote(track, other_user)
+    assert player_service.state.queue[-1] == track
+
+
+def test_play_next_after_votes_for_last_track(make_session, user, other_user):
+    player_service = PlayerService(make_session())
+    track = player_service.ordered()[-1]
+    player_service.vote(track, user)
+    player_service.vote(track, other_user)
+    assert player_service.state.queue[0] == track
+
+    next_track = player_service.state.queue[1]
+    assert player_service.play_next().id == next_track
+    assert player_service.state.queue[0] == next_track
+    assert player_service.state.queue[-1] == track
+
+
+def test_unknown_track_leaves_state_unchanged(make_session):
+    player_service = PlayerService(make_session())
+    before = player_service.snapshot()
+    with pytest.raises(PlayerService.TrackNotFound):
+        player_service.play_track(-1)
+    assert player_service.snapshot() == before and not player_service.state.changed
+
+
+def test_shuffle_keeps_current_track_first(make_session):
+    player_service = PlayerService(make_session(20))
+    current_track = player_service.current_track
+    player_service.shuffle(seed=1)
+    session_tracks = list(player_service.player_session.track_queue.all())
+    assert session_tracks[0].id == current_track.id
+    assert sorted(session_track.track_id for session_track in session_tracks) == sorted(
+        player_service.player_session.playlist.tracks.values_list('track_id', flat=True)
+    )
+    assert [session_track.id for session_track in session_tracks] == player_service.state.queue
+
+
+def test_shuffled_session_queue_is_created_once(make_playlist, user):
+    playlist = make_playlist(20)
+    player_session = PlayerSession(playlist=playlist, author=user)
+    player_session.shuffle_queue = True
+    with CaptureQueriesContext(connection) as queries:
+        player_session.save()
+
+    assert not [query for query in queries.captured_queries if 'sessiontrack' in query['sql'] and
+                query['sql'].startswith('DELETE')]
+    tracks = list(player_session.track_queue.values_list('track_id', flat=True))
+    playlist_tracks = list(playlist.tracks.order_by('order').values_list('track_id', flat=True))
+    assert sorted(tracks) == sorted(playlist_tracks) and tracks != playlist_tracks
+
+
+def count_queries(action) -> int:
+    with CaptureQueriesContext(connection) as queries:
+        action()
+    return len(queries.captured_queries)
+
+
+@pytest.mark.parametrize('action', ['skip', 'vote'])
+def test_queries_do_not_grow_with_queue(make_session, user, other_user, action):
+    counts = []
+    for tracks_count, author in ((5, user), (200, other_user)):
+        player_service = PlayerService(make_session(tracks_count, author))
+        player_service.state
+        if action == 'skip':
+            player_service.play_next()
+            counts.append(count_queries(lambda: (player_service.play_next(), player_service.save())))
+        else:
+            track = player_service.state.queue[-1]
+            counts.append(count_queries(lambda: (player_service.vote(track, user), player_service.save())))
+    assert counts[0] == counts[1]
@@ -0,0 +1,41 @@
+import pytest
+from django.core.management import call_command
+from django.db import connection
+from asgiref.sync import async_to_sync
+
+from music_room import query_budgets
+from music_room.query_budgets import WS_BUDGETS, REST_BUDGETS, NOT_MODIFIED, CACHED
+
+
+@pytest.fixture(scope='module')
+def ws_results(django_db_setup, django_db_blocker):
+    """Actions depend on each other, so every action runs once in order for the whole module"""
+    with django_db_blocker.unblock():
+        try:
+            recorder = query_budgets.QueryRecorder()
+            with connection.execute_wrapper(recorder):
+                results = async_to_sync(query_budgets.run_actions)(query_budgets.fixture(), recorder, 0.3)
+        finally:
+            call_command('flush', interactive=False, verbosity=0)
+    return {result.name: result for result in results}
+
+
+# Marked for database of ws_results to be set up
+@pytest.mark.django_db
+@pytest.mark.parametrize('name', WS_BUDGETS)
+def test_ws_budget(ws_results, name):
+    result = ws_results[name]
+    assert not result.exceeded, f'initiator {result.initiator}, receiver {result.receiver}: {result.sql}'
+
+
+# Without test transaction, atomic blocks of views would add savepoints queries
+@pytest.mark.django_db(transaction=True)
+@pytest.mark.parametrize('name', REST_BUDGETS)
+def test_rest_budget(django_assert_max_num_queries, name):
+    context = query_budgets.fixture()
+    _, path, data = next(request for request in query_budgets.requests(context) if request[0] == name)
+    client, etags = query_budgets.client(context), {}
+    if data is NOT_MODIFIED or data is CACHED:
+        query_budgets.request(client, name, path, None, etags)
+    with django_assert_max_num_queries(REST_BUDGETS[name]):
+        query_budgets.request(client, name, path, data, etags)
@@ -0,0 +1,126 @@
+import pytest
+
+from music_room.models import PlayerSession, SessionTrack
+from music_room.services.session_state import SessionStateEngine, STATE, PROGRESS, VOTES_COUNT, ORDER
+
+
+@pytest.fixture
+def player_session(make_session) -> PlayerSession:
+    return make_session()
+
+
+def db_rows(player_session: PlayerSession) -> dict:
+    return {
+        row[0]: row[1:]
+        for row in player_session.track_queue.values_list('id', 'state', 'progress', 'votes_count', 'order')
+    }
+
+
+def test_state_is_loaded_once(player_session, django_assert_num_queries):
+    engine = SessionStateEngine()
+    with django_assert_num_queries(1):
+        state = engine.get(player_session)
+        assert engine.get(player_session) is state
+    assert state.queue == list(player_session.track_queue.values_list('id', flat=True))
+
+
+def test_queue_is_ordered_by_votes_then_order(player_session):
+    state = SessionStateEngine().get(player_session)
+    first, *_, last = state.queue
+    state.set(last, VOTES_COUNT, 2)
+    assert state.queue[0] == last
+    state.set(first, ORDER, state.tracks[last][ORDER] + 1)
+    assert state.queue[0] == last and state.queue[-1] == first
+
+
+def test_clock_changes_are_not_shared_changes(player_session):
+    state = SessionStateEngine().get(player_session)
+    track = state.queue[0]
+    state.set(track, PROGRESS, 10.0)
+    assert not state.changed and state.dirty_progress == {track}
+    state.set(track, STATE, SessionTrack.States.paused)
+    assert state.changed and state.dirty == {track}
+
+
+def test_flush_writes_changes_and_version(player_session):
+    engine = SessionStateEngine()
+    state = engine.get(player_session)
+    first, second = state.queue[:2]
+    state.set(first, STATE, SessionTrack.States.paused)
+    state.set(first, PROGRESS, 12.5)
+    state.set(second, PROGRESS, 3.0)
+    state.set_all(VOTES_COUNT, 0)
+
+    assert engine.flush(state, increase_version=True)
+
+    rows = db_rows(player_session)
+    assert rows[first][:2] == (SessionTrack.States.paused, 12.5)
+    assert rows[second][1] == 3.0
+    assert PlayerSession.objects.get(id=player_session.id).version == state.version == 1
+    assert not (state.dirty or state.dirty_progress or state.reset)
+
+
+def test_state_outdated_by_another_worker_is_dropped(player_session):
+    worker, other_worker = SessionStateEngine(), SessionStateEngine()
+    state = worker.get(player_session)
+    other_state = other_worker.get(player_session)
+    other_state.set(other_state.queue[0], STATE, SessionTrack.States.playing)
+    assert other_worker.flush(other_state, increase_version=True)
+
+    track = state.queue[0]
+    state.set(track, STATE, SessionTrack.States.stopped)
+    assert not worker.flush(state, increase_version=True)
+    assert db_rows(player_session)[track][0] == SessionTrack.States.playing
+
+    player_session.refresh_from_db()
+    reloaded = worker.get(player_session)
+    assert reloaded is not state and reloaded.tracks[track][STATE] == SessionTrack.States.playing
+
+
+def test_flush_behind_writes_only_clock(player_session):
+    engine = SessionStateEngine(flush_interval=0)
+    state = engine.get(player_session)
+    track = state.queue[0]
+    order = state.tracks[track][ORDER]
+    state.set(track, ORDER, order + 1)
+    state.set(track, PROGRESS, 42.0)
+
+    engine.flush_behind(state)
+
+    assert db_rows(player_session)[track][1:] == (42.0, 0, order)
+    assert state.dirty == {track} and not state.dirty_progress
+    assert PlayerSession.objects.get(id=player_session.id).version == state.version
+
+
+def test_flush_behind_waits_for_interval(player_session):
+    engine = SessionStateEngine(flush_interval=60)
+    state = engine.get(player_session)
+    track = state.queue[0]
+    state.set(track, PROGRESS, 42.0)
+    engine.flush_behind(state)
+    assert db_rows(player_session)[track][1] == 0
+    assert state.dirty_progress == {track}
+
+
+def test_flush_behind_of_outdated_state_is_not_written(player_session):
+    engine = SessionStateEngine(flush_interval=0)
+    state = engine.get(player_session)
+    PlayerSession.objects.filter(id=player_session.id).update(version=5)
+    track = state.queue[0]
+    state.set(track, PROGRESS, 42.0)
+
+    engine.flush_behind(state)
+
+    assert db_rows(player_session)[track][1] == 0
+    assert player_session.id not in engine.states
+
+
+def test_removed_track_is_not_flushed(player_session):
+    engine = SessionStateEngine()
+    state = engine.get(player_session)
+    track = state.queue[0]
+    state.set(track, STATE, SessionTrack.States.playing)
+    state.remove(track)
+    assert track not in state.tracks and track not in state.queue
+    assert not state.dirty
+    assert len(state.queue) == 4
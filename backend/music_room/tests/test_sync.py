@@ -0,0 +1,29 @@
+import logging
+import os
+
+from music_room.services.sync import SyncCoalescer
+
+
+def test_stats_are_logged_once_per_interval(caplog):
+    coalescer = SyncCoalescer(window=1, stats_interval=60)
+    caplog.set_level(logging.INFO, 'music_room.services.sync')
+
+    coalescer.offer(1, 10)
+    coalescer.offer(1, 11)
+    assert caplog.records == []
+
+    coalescer.logged_at -= 60
+    coalescer.offer(1, 12)
+    coalescer.offer(1, 13)
+    assert [record.getMessage() for record in caplog.records] == [
+        f"Player syncs of process {os.getpid()}: {{'received': 2, 'applied': 1, 'dropped': 0}}"
+    ]
+    assert coalescer.stats() == {'received': 4, 'applied': 1, 'dropped': 2}
+
+
+def test_stats_logging_is_off_by_default(caplog):
+    coalescer = SyncCoalescer(window=1)
+    caplog.set_level(logging.INFO, 'music_room.services.sync')
+    coalescer.logged_at -= 3600
+    coalescer.offer(1, 10)
+    assert caplog.records == []
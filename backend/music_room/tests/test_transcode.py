@@ -0,0 +1,198 @@
+import os
+import runpy
+import shutil
+import subprocess
+import sys
+from datetime import timedelta
+
+import pytest
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.utils import timezone
+
+from django_app import settings as settings_module
+from music_room.management.commands.transcode_worker import Command as WorkerCommand
+from music_room.models import Artist, Track, TrackFile, TranscodeJob
+from music_room.services import transcode
+
+
+@pytest.fixture
+def upload(db, media):
+    track = Track.objects.create(name='track', artist=Artist.objects.create(name='artist'))
+    return TrackFile.objects.create(track=track, file=ContentFile(b'flac', name='track.flac'))
+
+
+def make_rendition(file: TrackFile, bitrate: int = 96, segmented: bool = True) -> TrackFile:
+    name = default_storage.save(f'music/track_{bitrate}k.mp3', ContentFile(b'mp3'))
+    hls = None
+    if segmented:
+        hls = default_storage.save(f'{transcode.hls_directory(name)}/{transcode.HLS_PLAYLIST}', ContentFile(b'#EXTM3U'))
+    return TrackFile.objects.create(
+        track=file.track, source=file, codec='mp3', bitrate=bitrate, duration=1, file=name, hls=hls,
+        extension=TrackFile.Extensions.mp3
+    )
+
+
+def test_upload_is_queued_once(upload):
+    assert list(upload.transcode_jobs.values_list('status', flat=True)) == [TranscodeJob.Statuses.queued]
+    upload.save()
+    make_rendition(upload)
+    assert upload.transcode_jobs.count() == 1
+
+
+def test_replaced_upload_is_transcoded_again(upload):
+    rendition = make_rendition(upload)
+    upload.duration, upload.size = 1, 4
+    upload.save()
+    TranscodeJob.objects.update(status=TranscodeJob.Statuses.done)
+
+    old_name = upload.file.name
+    upload.file = ContentFile(b'new flac', name='new.flac')
+    upload.save()
+
+    assert not TrackFile.objects.filter(id=rendition.id).exists()
+    assert not default_storage.exists(old_name)
+    assert not default_storage.exists(rendition.file.name)
+    assert not default_storage.exists(rendition.hls.name)
+    upload.refresh_from_db()
+    assert (upload.duration, upload.size) == (None, None)
+    assert upload.transcode_jobs.filter(status=TranscodeJob.Statuses.queued).count() == 1
+
+
+def test_replaced_upload_is_queued_while_old_one_is_running(upload):
+    transcode.claim(1)
+    upload.file = ContentFile(b'new flac', name='new.flac')
+    upload.save()
+    assert sorted(upload.transcode_jobs.values_list('status', flat=True)) == [
+        TranscodeJob.Statuses.queued, TranscodeJob.Statuses.running
+    ]
+
+
+def test_claim_takes_job_once(upload):
+    job = upload.transcode_jobs.get()
+    assert transcode.claim(2) == [job.id]
+    assert transcode.claim(2) == []
+    job.refresh_from_db()
+    assert (job.status, job.attempts) == (TranscodeJob.Statuses.running, 1)
+
+
+def test_finish(upload, settings):
+    settings.TRANSCODE_MAX_ATTEMPTS = 2
+    job = upload.transcode_jobs.get()
+
+    transcode.claim(1)
+    transcode.finish(job.id, 'ffmpeg failed')
+    job.refresh_from_db()
+    assert (job.status, job.error, job.finished_at) == (TranscodeJob.Statuses.queued, 'ffmpeg failed', None)
+
+    transcode.claim(1)
+    transcode.finish(job.id, 'ffmpeg failed again')
+    job.refresh_from_db()
+    assert (job.status, job.attempts) == (TranscodeJob.Statuses.failed, 2)
+    assert job.finished_at is not None
+
+    job.status = TranscodeJob.Statuses.running
+    job.save()
+    transcode.finish(job.id)
+    job.refresh_from_db()
+    assert (job.status, job.error) == (TranscodeJob.Statuses.done, '')
+
+
+def test_requeue_stale(upload, settings):
+    stale = upload.transcode_jobs.get()
+    running = TranscodeJob.objects.create(file=upload)
+    assert sorted(transcode.claim(2)) == [stale.id, running.id]
+    # Worker of stale job died long ago, the other one is still working
+    TranscodeJob.objects.filter(id=stale.id).update(
+        started_at=timezone.now() - timedelta(seconds=settings.TRANSCODE_JOB_TIMEOUT + 1)
+    )
+
+    assert transcode.requeue_stale() == 1
+    assert TranscodeJob.objects.get(id=stale.id).status == TranscodeJob.Statuses.queued
+    assert TranscodeJob.objects.get(id=running.id).status == TranscodeJob.Statuses.running
+    assert transcode.claim(2) == [stale.id]
+
+
+def test_encode_spools_output_to_disk(settings):
+    settings.TRANSCODE_SPOOL_SIZE = 1024
+    size = 4 * transcode.CHUNK_SIZE + 1
+    with transcode.encode([sys.executable, '-c', f'import sys; sys.stdout.buffer.write(b"x" * {size})']) as output:
+        assert output._rolled
+        assert output.read() == b'x' * size
+
+
+def test_encode_error_keeps_head_of_errors():
+    script = f'import sys; sys.stderr.write("e" * {2 * transcode.ERROR_SIZE}); sys.exit(3)'
+    with pytest.raises(transcode.TranscodeError) as error:
+        transcode.encode([sys.executable, '-c', script])
+    message = str(error.value)
+    assert message == f'{sys.executable} exited with 3: {"e" * transcode.ERROR_SIZE}'
+
+
+@pytest.mark.parametrize('cpu_count, workers', [(None, 1), (2, 2), (16, 4)])
+def test_rendition_workers_default(monkeypatch, cpu_count, workers):
+    monkeypatch.delenv('TRANSCODE_RENDITION_WORKERS', raising=False)
+    monkeypatch.delenv('TRANSCODE_RENDITIONS', raising=False)
+    monkeypatch.setattr(os, 'cpu_count', lambda: cpu_count)
+    assert runpy.run_path(settings_module.__file__)['TRANSCODE_RENDITION_WORKERS'] == workers
+
+
+@pytest.mark.parametrize('cpu_count, rendition_workers, processes', [(None, 1, 1), (2, 4, 1), (16, 4, 4), (16, 1, 16)])
+def test_worker_processes_default(monkeypatch, settings, cpu_count, rendition_workers, processes):
+    monkeypatch.setattr(os, 'cpu_count', lambda: cpu_count)
+    settings.TRANSCODE_RENDITION_WORKERS = rendition_workers
+    parser = WorkerCommand().create_parser('manage.py', 'transcode_worker')
+    assert parser.parse_args([]).processes == processes
+
+
+def test_master_playlist_lists_segmented_renditions():
+    renditions = [
+        TrackFile(codec='opus', bitrate=96, hls='music/a_opus_hls/index.m3u8'),
+        TrackFile(codec='mp3', bitrate=320),
+        TrackFile(codec='mp3', bitrate=96, hls='music/a_mp3_hls/index.m3u8'),
+    ]
+    assert transcode.master_playlist(renditions, lambda url: f'https://host{url}').splitlines() == [
+        '#EXTM3U',
+        '#EXT-X-INDEPENDENT-SEGMENTS',
+        '#EXT-X-STREAM-INF:BANDWIDTH=96000,CODECS="mp4a.40.34"',
+        'https://host/media/music/a_mp3_hls/index.m3u8',
+        '#EXT-X-STREAM-INF:BANDWIDTH=96000,CODECS="Opus"',
+        'https://host/media/music/a_opus_hls/index.m3u8',
+    ]
+
+
+def test_track_hls(api_client, upload):
+    path = f'/api/track/{upload.track_id}/hls/'
+    assert api_client.get(path).status_code == 404
+
+    segmented = make_rendition(upload, 96)
+    make_rendition(upload, 160, segmented=False)
+    response = api_client.get(path)
+    assert response.status_code == 200
+    assert response['Content-Type'] == 'application/vnd.apple.mpegurl'
+    assert [line for line in response.content.decode().splitlines() if not line.startswith('#')] == [
+        f'http://testserver{segmented.hls.url}'
+    ]
+
+    not_modified = api_client.get(path, HTTP_IF_NONE_MATCH=response['ETag'])
+    assert (not_modified.status_code, not_modified.content) == (304, b'')
+
+
+@pytest.mark.skipif(not shutil.which('ffmpeg'), reason='ffmpeg is not installed')
+def test_make_rendition_segments_it(media, settings):
+    settings.TRANSCODE_HLS_SEGMENT_TIME = 1
+    source = media / 'source.flac'
+    subprocess.run([
+        'ffmpeg', '-loglevel', 'error', '-f', 'lavfi', '-i', 'sine=duration=3', str(source)
+    ], check=True)
+
+    name, size, playlist = transcode.make_rendition(str(source), 'music/track_96k.mp3', 'mp3', 96)
+
+    assert (name, playlist) == ('music/track_96k.mp3', f'music/track_96k_mp3_hls/{transcode.HLS_PLAYLIST}')
+    assert size == default_storage.size(name) > 0
+    with default_storage.open(playlist) as f:
+        lines = f.read().decode().splitlines()
+    segments = [line for line in lines if not line.startswith('#')]
+    assert lines[-1] == '#EXT-X-ENDLIST'
+    assert len(segments) >= 3
+    assert all(default_storage.exists(f'music/track_96k_mp3_hls/{segment}') for segment in segments)
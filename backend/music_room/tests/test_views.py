@@ -0,0 +1,109 @@
+import time
+from urllib.parse import urlsplit, parse_qs
+
+import pytest
+
+from music_room.models import Track, TrackFile, PlaylistTrack
+
+
+@pytest.mark.parametrize('path', ['/api/track/', '/api/artist/', '/api/playlist/', '/api/users/'])
+def test_list_is_not_paginated_by_default(api_client, make_playlist, path):
+    make_playlist(tracks_count=3)
+    response = api_client.get(path)
+    assert response.status_code == 200
+    assert isinstance(response.data, list)
+
+
+def test_pages_follow_each_other(api_client, make_playlist):
+    make_playlist(tracks_count=5)
+    tracks = api_client.get('/api/track/').data
+    assert [track['id'] for track in tracks] == list(Track.objects.order_by('id').values_list('id', flat=True))
+
+    page = api_client.get('/api/track/?page_size=2').data
+    assert set(page) == {'next', 'previous', 'results'}
+    assert page['previous'] is None
+    results = page['results']
+    while page['next']:
+        page = api_client.get(page['next']).data
+        assert page['previous'] is not None
+        results += page['results']
+    # Items of pages are the same as items of the whole list
+    assert results == tracks
+
+
+def test_cursor_alone_paginates(api_client, make_playlist):
+    make_playlist(tracks_count=3)
+    ids = list(Track.objects.order_by('id').values_list('id', flat=True))
+    page = api_client.get('/api/track/?page_size=1').data
+    cursor = parse_qs(urlsplit(page['next']).query)['cursor'][0]
+    # Default page size is more than the rest of tracks
+    page = api_client.get('/api/track/', {'cursor': cursor}).data
+    assert [track['id'] for track in page['results']] == ids[1:]
+
+
+
+def test_track_list_is_full_unless_summary_is_asked(api_client, make_playlist):
+    track = make_playlist(tracks_count=1).tracks.get().track
+    TrackFile.objects.bulk_create([TrackFile(track=track, file='music/track.mp3', extension='mp3', duration=1)])
+
+    full, = api_client.get('/api/track/').data
+    assert {'id', 'name', 'artist', 'files'} <= set(full)
+    assert (full['artist'], [file['extension'] for file in full['files']]) == (track.artist_id, ['mp3'])
+
+    summary, = api_client.get('/api/track/?summary=true').data
+    assert summary == {'id': track.id, 'name': track.name, 'artist': track.artist_id}
+
+
+def test_artist_list_nests_tracks_unless_summary_is_asked(api_client, make_playlist):
+    track = make_playlist(tracks_count=1).tracks.get().track
+
+    full, = api_client.get('/api/artist/').data
+    assert (full['id'], full['name']) == (track.artist_id, track.artist.name)
+    assert [(nested['id'], nested['name']) for nested in full['tracks']] == [(track.id, track.name)]
+
+    summary, = api_client.get('/api/artist/?summary=true').data
+    assert summary == {'id': track.artist_id, 'name': track.artist.name, 'tracks': [track.id]}
+
+def later(monkeypatch, seconds: float = 10):
+    """Version stamps bumped after this are newer by whole seconds of Last-Modified"""
+    now = time.time()
+    monkeypatch.setattr(time, 'time', lambda: now + seconds)
+
+
+def test_catalog_is_not_modified_till_it_is_changed(api_client, make_playlist, monkeypatch):
+    playlist = make_playlist(tracks_count=2)
+    response = api_client.get('/api/track/')
+    etag, last_modified = response['ETag'], response['Last-Modified']
+    assert api_client.get('/api/track/', HTTP_IF_NONE_MATCH=etag).status_code == 304
+    assert api_client.get('/api/track/', HTTP_IF_MODIFIED_SINCE=last_modified).status_code == 304
+    # Query string is part of ETag
+    assert api_client.get('/api/track/?summary=true', HTTP_IF_NONE_MATCH=etag).status_code == 200
+
+    later(monkeypatch)
+    Track.objects.create(name='new-track', artist=playlist.tracks.first().track.artist)
+    response = api_client.get('/api/track/', HTTP_IF_NONE_MATCH=etag)
+    assert response.status_code == 200
+    assert response['ETag'] != etag and response['Last-Modified'] != last_modified
+    assert len(response.data) == 3
+
+
+def test_playlist_is_not_modified_till_its_tracks_are_changed(api_client, make_playlist, monkeypatch):
+    playlist = make_playlist(tracks_count=2)
+    path = f'/api/playlist/{playlist.id}/'
+    etag = api_client.get(path)['ETag']
+    assert api_client.get(path, HTTP_IF_NONE_MATCH=etag).status_code == 304
+
+    later(monkeypatch)
+    PlaylistTrack.objects.filter(playlist=playlist).first().delete()
+    response = api_client.get(path, HTTP_IF_NONE_MATCH=etag)
+    assert response.status_code == 200
+    assert response['ETag'] != etag
+
+
+def test_playlist_etag_is_per_user(api_client, make_playlist, other_user):
+    path = f'/api/playlist/{make_playlist().id}/'
+    etag = api_client.get(path)['ETag']
+    api_client.force_authenticate(other_user)
+    response = api_client.get(path, HTTP_IF_NONE_MATCH=etag)
+    assert response.status_code == 200 and response['ETag'] != etag
+    assert 'Authorization' in response['Vary']
@@ -7,7 +7,7 @@ from rest_framework.authentication import BasicAuthentication
 
 from .views import TrackListView, PlaylistListView, PlaylistOwnListView, PlayerSessionRetrieveView, AuthView, \
     TokenRefreshWithExpiresView, UserListView, ArtistListView, ArtistRetrieveView, PlaylistRetrieveView, \
-    EventCreateView, EventListView
+    EventCreateView, EventListView, TrackHlsView
 
 
 class BothHttpAndHttpsSchemaGenerator(OpenAPISchemaGenerator):
@@ -35,6 +35,7 @@ urlpatterns = [
     re_path(r'^$', schema_view.with_ui('swagger', cache_timeout=0), name='schema-swagger-ui'),
     re_path(r'^redoc/$', schema_view.with_ui('redoc', cache_timeout=0), name='schema-redoc'),
     path('track/', TrackListView.as_view()),
+    path('track/<int:pk>/hls/', TrackHlsView.as_view()),
     path('playlist/', PlaylistListView.as_view()),
     path('playlist/<int:pk>/', PlaylistRetrieveView.as_view()),
     path('playlist/own/', PlaylistOwnListView.as_view()),
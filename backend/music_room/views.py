@@ -1,5 +1,9 @@
 from django.contrib.auth import get_user_model, authenticate, login
-from django.db.models import Q
+from django.db.models import Q, Prefetch
+from django.http import Http404, HttpResponse
+from drf_yasg import openapi
+from django.utils.cache import get_conditional_response, patch_vary_headers
+from django.utils.http import http_date, urlencode
 from drf_yasg.utils import swagger_auto_schema
 from rest_framework.generics import ListAPIView, RetrieveAPIView, CreateAPIView
 from rest_framework.permissions import IsAuthenticated
@@ -7,21 +11,135 @@ from rest_framework.response import Response
 from rest_framework_simplejwt.views import TokenObtainPairView, TokenRefreshView
 
 from .models import Track, Playlist, PlayerSession, Artist, Event
+from .services import versions, catalog, transcode
 from .serializers import TrackSerializer, PlaylistSerializer, PlayerSessionSerializer, UserSerializer, \
     TokenObtainPairSerializer, TokenRefreshSerializer, TokenResponseSerializer, ArtistSerializer, EventCreateSerializer, \
-    EventListSerializer
+    EventListSerializer, TrackSummarySerializer, ArtistSummarySerializer
 
 User = get_user_model()
 
+summary_parameter = openapi.Parameter(
+    'summary', openapi.IN_QUERY, description='Without nested objects, only their ids', type=openapi.TYPE_BOOLEAN
+)
 
-class TrackListView(ListAPIView):
+
+class SummaryMixin:
+    """
+    Full representation by default, ``?summary=true`` switches to :attr:`summary_serializer_class`
+    with :attr:`summary_queryset`. Both querysets prefetch everything serializer needs,
+    so number of queries does not depend on number of objects
+    """
+    summary_serializer_class = None
+    summary_queryset = None
+
+    @property
+    def summary(self) -> bool:
+        return self.request.query_params.get('summary', '').lower() in ('1', 'true')
+
+    def get_serializer_class(self):
+        if self.summary:
+            return self.summary_serializer_class
+        return super().get_serializer_class()
+
+    def get_queryset(self):
+        if self.summary:
+            return self.summary_queryset.all()
+        return super().get_queryset()
+
+
+class ConditionalMixin:
+    """
+    Conditional GET by version stamp of :meth:`get_version_key` resource, see :mod:`music_room.services.versions`.
+    Not modified response is returned before query and serializer
+    """
+    #: Response depends on user, e.g. by access rights
+    per_user = False
+
+    def get_version_key(self) -> str:
+        raise NotImplementedError
+
+    def get(self, request, *args, **kwargs):
+        stamp = versions.get(self.get_version_key())
+        etag = versions.etag(stamp, request.get_full_path(), request.user.pk if self.per_user else None)
+        response = get_conditional_response(request, etag=etag, last_modified=int(stamp))
+        if response is None:
+            response = super().get(request, *args, **kwargs)
+            if response.status_code != 200:
+                return response
+        response['ETag'] = etag
+        response['Last-Modified'] = http_date(stamp)
+        if self.per_user:
+            patch_vary_headers(response, ['Authorization'])
+        return response
+
+
+class CatalogCacheMixin:
+    """
+    Serialized response is cached by url and query parameters it depends on till catalog is changed,
+    see :mod:`music_room.services.catalog`. Other parameters don't make new entries. Links to pages and files
+    are absolute, so scheme and host are part of key
+    """
+    cache_query_params = ('summary', 'cursor', 'page_size')
+
+    def get_cache_key(self, request) -> str:
+        return '{}?{}'.format(request.build_absolute_uri(request.path), urlencode([
+            (param, request.query_params.get(param, '')) for param in self.cache_query_params
+        ]))
+
+    def get(self, request, *args, **kwargs):
+        key = self.get_cache_key(request)
+        stamp = catalog.cache.stamp()
+        data = catalog.cache.get(key, stamp)
+        if data is not None:
+            return Response(data)
+        response = super().get(request, *args, **kwargs)
+        if response.status_code == 200:
+            catalog.cache.set(key, stamp, response.data)
+        return response
+
+
+class TrackListView(ConditionalMixin, CatalogCacheMixin, SummaryMixin, ListAPIView):
     """
     Tracks
 
     Get all tracks
     """
-    queryset = Track.objects.all()
+    queryset = Track.objects.prefetch_related('files')
     serializer_class = TrackSerializer
+    summary_queryset = Track.objects.all()
+    summary_serializer_class = TrackSummarySerializer
+
+    def get_version_key(self) -> str:
+        return versions.CATALOG
+
+    @swagger_auto_schema(manual_parameters=[summary_parameter])
+    def get(self, request, *args, **kwargs):
+        return super(TrackListView, self).get(request, *args, **kwargs)
+
+
+class TrackHlsView(ConditionalMixin, RetrieveAPIView):
+    """
+    Track HLS
+
+    Get HLS multivariant playlist of track renditions, media playlists and segments are served by storage
+    """
+    queryset = Track.objects.prefetch_related('files')
+
+    def get_version_key(self) -> str:
+        return versions.CATALOG
+
+    @swagger_auto_schema(responses={200: openapi.Response('HLS multivariant playlist')})
+    def get(self, request, *args, **kwargs):
+        return super(TrackHlsView, self).get(request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        renditions = [rendition for rendition in self.get_object().renditions if rendition.hls]
+        if not renditions:
+            raise Http404('Track has no HLS renditions')
+        return HttpResponse(
+            transcode.master_playlist(renditions, request.build_absolute_uri),
+            content_type='application/vnd.apple.mpegurl'
+        )
 
 
 class PlaylistListView(ListAPIView):
@@ -48,7 +166,7 @@ class PlaylistListView(ListAPIView):
         )
 
 
-class PlaylistRetrieveView(RetrieveAPIView):
+class PlaylistRetrieveView(ConditionalMixin, RetrieveAPIView):
     """
     Playlist
 
@@ -56,6 +174,10 @@ class PlaylistRetrieveView(RetrieveAPIView):
     """
     queryset = Playlist.objects.filter(access_type=Playlist.AccessTypes.public).all()
     serializer_class = PlaylistSerializer
+    per_user = True
+
+    def get_version_key(self) -> str:
+        return versions.playlist_key(self.kwargs['pk'])
 
     def get_queryset(self):
         if not self.request.user.is_authenticated:
@@ -150,24 +272,42 @@ class UserListView(ListAPIView):
         return User.objects.exclude(username=self.request.user.username)
 
 
-class ArtistListView(ListAPIView):
+class ArtistListView(ConditionalMixin, CatalogCacheMixin, SummaryMixin, ListAPIView):
     """
     Artists
 
     Get artists list
     """
-    queryset = Artist.objects.all()
+    queryset = Artist.objects.prefetch_related('tracks__files')
     serializer_class = ArtistSerializer
+    summary_queryset = Artist.objects.prefetch_related(Prefetch('tracks', Track.objects.only('id', 'artist_id')))
+    summary_serializer_class = ArtistSummarySerializer
+
+    def get_version_key(self) -> str:
+        return versions.CATALOG
 
+    @swagger_auto_schema(manual_parameters=[summary_parameter])
+    def get(self, request, *args, **kwargs):
+        return super(ArtistListView, self).get(request, *args, **kwargs)
 
-class ArtistRetrieveView(RetrieveAPIView):
+
+class ArtistRetrieveView(ConditionalMixin, CatalogCacheMixin, SummaryMixin, RetrieveAPIView):
     """
     Artist
 
     Get artist's information
     """
-    queryset = Artist.objects.all()
+    queryset = Artist.objects.prefetch_related('tracks__files')
     serializer_class = ArtistSerializer
+    summary_queryset = ArtistListView.summary_queryset
+    summary_serializer_class = ArtistSummarySerializer
+
+    def get_version_key(self) -> str:
+        return versions.CATALOG
+
+    @swagger_auto_schema(manual_parameters=[summary_parameter])
+    def get(self, request, *args, **kwargs):
+        return super(ArtistRetrieveView, self).get(request, *args, **kwargs)
 
 
 class EventCreateView(CreateAPIView):
@@ -5,13 +5,14 @@ Base websocket consumer
 """
 
 from __future__ import annotations
+import json
 import uuid
-from typing import Callable
+from typing import Callable, List
 
 from asgiref.sync import async_to_sync
 from channels.consumer import get_handler_name
 from channels.db import database_sync_to_async
-from channels.generic.websocket import JsonWebsocketConsumer
+from channels.generic.websocket import JsonWebsocketConsumer, AsyncJsonWebsocketConsumer
 from django.contrib.auth.models import AnonymousUser
 from django.core.cache import cache
 
@@ -32,6 +33,8 @@ class BaseEvent:
     response_payload_type_target = BasePayload
     target = TargetsEnum.for_all
     hidden = False
+    #: Initiator and targets receive the same response, so it is rendered once by initiator
+    shared_response = False
     event_name = None
     consumer = None
 
@@ -63,9 +66,28 @@ class BaseEvent:
                 action_for_initiator=self.action_for_initiator,
                 target=self.target,
                 before_send=self.before_send,
-                payload_type=self.request_payload_type
+                payload_type=self.request_payload_type,
+                shared_response=self.shared_response,
+                select_response=self.select_response
             )
 
+    def apply(self, message: Message, payload: request_payload_type):
+        """Apply action mutation by initiator once before broadcast"""
+        error = self.before_send(message, payload)
+        if isinstance(error, Action):
+            self.consumer.send_json(content=error.to_data())
+
+    def prepare(self, message: Message, payload: request_payload_type) -> dict:
+        """Render shared responses by initiator after :meth:`apply`, see :attr:`shared_response`"""
+        response: Action = self.action_for_target(message, payload)
+        if not response:
+            return {}
+        return {'default': self.consumer.encode_json(response.to_data(pop_system=True))}
+
+    def select_response(self, message: Message, responses: dict) -> [str, None]:
+        """Pick rendered response for current receiver"""
+        return responses.get('default')
+
     def before_send(self, message: Message, payload: request_payload_type):
         ...
 
@@ -82,13 +104,17 @@ class BaseEvent:
         return Action(event=event.pop('type'), system=event.pop('system'), payload=payload)
 
 
-class BaseConsumer(JsonWebsocketConsumer):
+class BaseConsumerMixin:
+    """
+    Consumer logic shared by sync :class:`BaseConsumer` and async :class:`AsyncBaseConsumer`,
+    which provide websocket send and channel layer calls
+    """
     broadcast_group = None
     authed = True
-    custom_target_resolver = {}
+    custom_audience_resolver = {}  #: Custom target -> callable returns receivers users ids or None for anyone
 
     def __init__(self):
-        super(BaseConsumer, self).__init__()
+        super(BaseConsumerMixin, self).__init__()
         attributes = list(filter(lambda attr: not attr.startswith('_') and not attr.startswith('__'), dir(self)))
         classes = list(filter(lambda cls: hasattr(getattr(self, cls), '__base__'), attributes))
         events = list(filter(lambda e: issubclass(getattr(self, e), BaseEvent), classes))
@@ -98,20 +124,13 @@ class BaseConsumer(JsonWebsocketConsumer):
             if not hidden:
                 setattr(self, camel_to_snake(event), event_class)
 
-    @auth
-    def connect(self):
+    def on_connect(self):
         self.cache_system()
         self.join_group(self.broadcast_group)
         self.after_connect()
 
-    @database_sync_to_async
-    def dispatch(self, message):
-        handler: Callable = getattr(self, get_handler_name(message), None)
-        if hasattr(handler, 'hidden'):
-            handler: BaseEvent.__class__
-            handler(consumer=self, event=message)
-        else:
-            handler(message)
+    def handle_event(self, handler: BaseEvent.__class__, message: dict):
+        handler(consumer=self, event=message)
 
     def after_connect(self):
         ...
@@ -119,13 +138,16 @@ class BaseConsumer(JsonWebsocketConsumer):
     def before_disconnect(self):
         ...
 
-    def disconnect(self, code):
+    def close_connection(self):
+        """
+        Close websocket from sync code, e.g. connect hooks of events, and run :meth:`before_disconnect`.
+        ``disconnect`` itself can't be called there, it is a coroutine of async consumer
+        """
+        self.close()
         self.before_disconnect()
 
-    def send_json(self, content, close=False):
-        if 'system' in content:
-            content.pop('system')
-        super(BaseConsumer, self).send_json(content, close)
+    def call_channel_layer(self, method: Callable, *args):
+        raise NotImplementedError
 
     def cache_system(self):
         if not self.get_user().is_anonymous:
@@ -135,12 +157,18 @@ class BaseConsumer(JsonWebsocketConsumer):
         return User.objects.get(id=user_id) if user_id else self.scope.get('user', AnonymousUser())
 
     def join_group(self, group_name: str):
-        if group_name:
-            async_to_sync(self.channel_layer.group_add)(group_name, self.channel_name)
+        if group_name and group_name not in self.groups:
+            self.call_channel_layer(self.channel_layer.group_add, group_name, self.channel_name)
+            self.groups.append(group_name)  # Discarded by consumer on disconnect
 
     def leave_group(self, group_name: str):
-        if group_name:
-            async_to_sync(self.channel_layer.group_discard)(group_name, self.channel_name)
+        if group_name and group_name in self.groups:
+            self.call_channel_layer(self.channel_layer.group_discard, group_name, self.channel_name)
+            self.groups.remove(group_name)
+
+    def get_broadcast_group(self, action: Action) -> [str, None]:
+        """Group which receive action, if not provided action delivered only to initiator"""
+        return self.broadcast_group
 
     def get_systems(self) -> ActionSystem:
         return ActionSystem(
@@ -149,15 +177,7 @@ class BaseConsumer(JsonWebsocketConsumer):
             action_id=str(uuid.uuid4())
         )
 
-    @safe
-    def receive(self, *arg, **kwargs):
-        super().receive(*arg, **kwargs)
-
-    @safe
-    def send(self, *arg, **kwargs):
-        super().send(*arg, **kwargs)
-
-    def receive_json(self, content, **kwargs):
+    def receive_action(self, content: dict):
         if self.broadcast_group:
             action, error = self.check_signature(lambda: Action(**content, system=self.get_systems()))
             if error:
@@ -169,12 +189,61 @@ class BaseConsumer(JsonWebsocketConsumer):
                 if not action_handler:
                     self.Error(payload=ResponsePayload.ActionNotExist(), consumer=self)
                     return
-                async_to_sync(self.channel_layer.group_send)(self.broadcast_group, action.to_system_data())
+                if action_handler.target == TargetsEnum.only_for_initiator:
+                    self.send_to_initiator(action)
+                    return
+                payload, error = self.parse_payload(action.to_system_data(), action_handler.request_payload_type)
+                if error:
+                    return
+                self.apply_action(action, action_handler, payload)
+                self.send_to_group(action, self.get_broadcast_group(action))
 
     def send_to_group(self, action: Action, group_name: str = None):
-        async_to_sync(
-            self.channel_layer.group_send
-        )(self.broadcast_group if not group_name else group_name, action.to_system_data())
+        group_name = self.broadcast_group if not group_name else group_name
+        if not group_name:
+            self.send_to_initiator(action)
+            return
+        self.call_channel_layer(self.channel_layer.group_send, group_name, action.to_system_data())
+
+    def send_to_initiator(self, action: Action):
+        self.call_channel_layer(self.channel_layer.send, self.channel_name, action.to_system_data())
+
+    def resolve_audience(self, payload: BasePayload, target: str) -> [List[int], None]:
+        """Resolve once by initiator users ids who must receive action, None if anyone in group"""
+        if target in (TargetsEnum.for_all, TargetsEnum.only_for_initiator):
+            return None
+        message = Message(**payload.to_data(), user=self.get_user(), target=target)
+        if target == TargetsEnum.for_user:
+            target_user = message.target_user
+            return [target_user.id] if target_user else []
+        resolver = self.custom_audience_resolver.get(target)
+        audience = resolver(message) if resolver else []
+        return list(audience) if audience is not None else None
+
+    def apply_action(self, action: Action, action_handler: BaseEvent.__class__, payload: BasePayload):
+        """
+        Apply action mutation once by initiator before broadcast, then resolve audience
+        and render shared response, receivers only render or forward the result
+        """
+        event: BaseEvent = action_handler(consumer=self, event=action.to_system_data(), trigger=False)
+        message = self.get_message(event.event, payload, action_handler.target)
+        event.apply(message, payload)
+        action.system.applied = True
+        action.system.audience = self.resolve_audience(payload, action_handler.target)
+        if action_handler.shared_response:
+            action.system.responses = event.prepare(message, payload)
+            action.system.prepared = True
+
+    def get_message(self, event: dict, payload: BasePayload, target: str) -> Message:
+        return Message(
+            **payload.to_data(),
+            system=MessageSystem(
+                **ActionSystem(**event['system']).to_data(),
+                receiver_channel=self.channel_name
+            ),
+            user=self.scope['user'],
+            target=target
+        )
 
     def check_signature(self, f: Callable):
         error = False
@@ -202,58 +271,46 @@ class BaseConsumer(JsonWebsocketConsumer):
     @safe
     def send_broadcast(self, event, action_for_target: Callable = None, action_for_initiator: Callable = None,
                        target=TargetsEnum.for_all, before_send: Callable = None,
-                       system_before_send: Callable = None, payload_type: BasePayload() = None):
+                       system_before_send: Callable = None, payload_type: BasePayload() = None,
+                       shared_response: bool = False, select_response: Callable = None):
 
         payload, error = self.parse_payload(event, payload_type)
         if error:
             return
 
-        message = Message(
-            **payload.to_data(),
-            system=MessageSystem(
-                **ActionSystem(**event['system']).to_data(),
-                receiver_channel=self.channel_name
-            ),
-            user=self.scope['user'],
-            target=target,
-            custom_target_resolver=self.custom_target_resolver
-        )
+        message = self.get_message(event, payload, target)
 
         if system_before_send:
             system_before_send()
 
-        if (message.target == TargetsEnum.for_user and not message.target_user) and message.is_initiator:
+        if (message.target == TargetsEnum.for_user and not message.system.audience) and message.is_initiator:
             self.Error(payload=ResponsePayload.RecipientNotExist(), consumer=self)
             return  # Interrupt action for initiator and action for target if recipient not found
 
-        def before():
-            if before_send and not message.before_send_activated:
-                e: Action = before_send(message, payload)
-                message.before_send_activate()
-                if e:
-                    return e
-                return True
-            return False
+        if shared_response and message.system.prepared:
+            if message.system.responses and (message.is_initiator or message.is_target):
+                response = select_response(message, message.system.responses)
+                if response:
+                    self.send(text_data=response)
+            return
+
+        error = None
+        if message.is_initiator and before_send and not message.system.applied:
+            # Action is not broadcast, e.g. only for initiator or triggered by consumer
+            error = before_send(message, payload)
 
         if message.is_initiator and action_for_initiator:
-            activated = before()
             action: Action = action_for_initiator(message, payload)
             if action:
                 self.send_json(content=action.to_data())
-            if isinstance(activated, Action):
-                self.send_json(content=activated.to_data())
-            if message.before_send_activated and not activated:
-                message.before_send_drop()
 
         if message.is_target and action_for_target:
-            activated = before()
             action: Action = action_for_target(message, payload)
             if action:
                 self.send_json(content=action.to_data())
-            if isinstance(activated, Action):
-                self.send_json(content=activated.to_data())
-            if message.before_send_activated and not activated:
-                message.before_send_drop()
+
+        if isinstance(error, Action):
+            self.send_json(content=error.to_data())
 
     class Error(BaseEvent):
         """Show error message"""
@@ -261,3 +318,114 @@ class BaseConsumer(JsonWebsocketConsumer):
 
         def action_for_initiator(self, message: Message, payload: request_payload_type):
             return self(payload=ResponsePayload.Error(message=payload.message))
+
+
+class BaseConsumer(BaseConsumerMixin, JsonWebsocketConsumer):
+    @auth
+    def connect(self):
+        self.on_connect()
+
+    @database_sync_to_async
+    def dispatch(self, message):
+        handler: Callable = getattr(self, get_handler_name(message), None)
+        if hasattr(handler, 'hidden'):
+            self.handle_event(handler, message)
+        else:
+            handler(message)
+
+    def disconnect(self, code):
+        self.before_disconnect()
+
+    def send_json(self, content, close=False):
+        if 'system' in content:
+            content.pop('system')
+        super(BaseConsumer, self).send_json(content, close)
+
+    @safe
+    def receive(self, *arg, **kwargs):
+        super().receive(*arg, **kwargs)
+
+    @safe
+    def send(self, *arg, **kwargs):
+        super().send(*arg, **kwargs)
+
+    def receive_json(self, content, **kwargs):
+        self.receive_action(content)
+
+    def call_channel_layer(self, method: Callable, *args):
+        async_to_sync(method)(*args)
+
+
+class AsyncBaseConsumer(BaseConsumerMixin, AsyncJsonWebsocketConsumer):
+    """
+    Asyncio consumer with the same events contract as :class:`BaseConsumer`.
+    Events run in a thread because of database queries, websocket sends and channel layer calls
+    made by them are collected to outbox and awaited on event loop after
+    """
+
+    def __init__(self):
+        super(AsyncBaseConsumer, self).__init__()
+        self.outbox = []  #: Websocket sends and channel layer calls awaiting for event loop
+
+    @classmethod
+    def encode_json(cls, content):
+        return json.dumps(content)
+
+    @classmethod
+    def decode_json(cls, text_data):
+        return json.loads(text_data)
+
+    async def connect(self):
+        if self.authed and self.get_user().is_anonymous:
+            await AsyncJsonWebsocketConsumer.close(self)
+            return
+        await self.accept()
+        await self.run_sync(self.on_connect)
+
+    async def dispatch(self, message):
+        handler: Callable = getattr(self, get_handler_name(message), None)
+        if not hasattr(handler, 'hidden'):
+            await super(AsyncBaseConsumer, self).dispatch(message)
+            return
+        if handler.shared_response and message.get('system', {}).get('prepared'):
+            # Response already rendered by initiator, receiver only picks and sends it without database queries
+            self.call_safe(self.handle_event, handler, message)
+            await self.flush_outbox()
+            return
+        await self.run_sync(self.handle_event, handler, message)
+
+    async def disconnect(self, code):
+        await self.run_sync(self.before_disconnect)
+
+    async def receive(self, text_data=None, bytes_data=None, **kwargs):
+        if text_data:
+            await self.run_sync(lambda: self.receive_action(self.decode_json(text_data)))
+        else:
+            raise ValueError('No text section for incoming WebSocket frame!')
+
+    async def run_sync(self, func: Callable, *args):
+        await database_sync_to_async(self.call_safe)(func, *args)
+        await self.flush_outbox()
+
+    @safe
+    def call_safe(self, func: Callable, *args):
+        return func(*args)
+
+    async def flush_outbox(self):
+        while self.outbox:
+            method, args = self.outbox.pop(0)
+            await method(*args)
+
+    def send_json(self, content, close=False):
+        if 'system' in content:
+            content.pop('system')
+        self.send(text_data=self.encode_json(content), close=close)
+
+    def send(self, text_data=None, bytes_data=None, close=False):
+        self.outbox.append((AsyncJsonWebsocketConsumer.send, (self, text_data, bytes_data, close)))
+
+    def close(self, code=None):
+        self.outbox.append((AsyncJsonWebsocketConsumer.close, (self, code)))
+
+    def call_channel_layer(self, method: Callable, *args):
+        self.outbox.append((method, args))
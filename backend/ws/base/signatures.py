@@ -1,9 +1,8 @@
 import dataclasses
 import json
 from dataclasses import dataclass
-from typing import Any, Optional
+from typing import Any, Optional, List, FrozenSet
 from django.contrib.auth import get_user_model
-from django.core.cache import cache
 
 User = get_user_model()
 
@@ -64,12 +63,20 @@ class ActionSystem:
     initiator_channel: str = None  #: Action initiator channel name
     initiator_user_id: int = None  #: Action initiator user id
     action_id: str = None
+    audience: Optional[List[int]] = None  #: Receivers users ids resolved by initiator, None if not restricted
+    applied: bool = False  #: Action mutation (before send) already applied by initiator
+    prepared: bool = False  #: Shared responses already rendered by initiator
+    responses: Optional[dict] = None  #: Responses rendered once by initiator for events with shared response
 
     def to_data(self):
         return {
             'initiator_channel': self.initiator_channel,
             'initiator_user_id': self.initiator_user_id,
             'action_id': self.action_id,
+            'audience': self.audience,
+            'applied': self.applied,
+            'prepared': self.prepared,
+            'responses': self.responses,
         }
 
 
@@ -129,12 +136,24 @@ class MessageSystem:
     receiver_channel: str  #: Receiver channel name
     initiator_user_id: int  #: Initiator user id
     action_id: str  #: Action id
+    audience: Optional[FrozenSet[int]] = None  #: Receivers users ids resolved by initiator, None if not restricted
+    applied: bool = False  #: Action mutation (before send) already applied by initiator
+    prepared: bool = False  #: Shared responses already rendered by initiator
+    responses: Optional[dict] = None  #: Responses rendered once by initiator for events with shared response
+
+    def __post_init__(self):
+        if self.audience is not None:
+            self.audience = frozenset(self.audience)
 
     def to_data(self):
         return {
             'initiator_channel': self.initiator_channel,
             'initiator_user_id': self.initiator_user_id,
             'action_id': self.action_id,
+            'audience': list(self.audience) if self.audience is not None else None,
+            'applied': self.applied,
+            'prepared': self.prepared,
+            'responses': self.responses,
         }
 
 
@@ -151,7 +170,6 @@ class Message:
     target: TargetsEnum  #: Target for broadcast
     to_user_id: int = None  #: Message target user id
     to_username: str = None  #: Message target user username
-    custom_target_resolver: dict  #: Custom target resolver
 
     def __init__(self, **kwargs):
         self.__dict__.update(kwargs)
@@ -160,13 +178,12 @@ class Message:
     def is_target(self):
         if self.target == TargetsEnum.only_for_initiator and self.is_initiator:
             return True
-        if self.is_initiator:
+        if self.is_initiator or self.target == TargetsEnum.only_for_initiator:
             return False
-        if self.target == TargetsEnum.for_all:
+        if self.target == TargetsEnum.for_all or self.system.audience is None:
             return True
-        if self.target == TargetsEnum.for_user:
-            return self.user.id == self.to_user_id or self.user.username == self.to_username
-        return self.custom_target_resolver.get(self.target, lambda _: False)(self)
+        # Audience already resolved by initiator, see BaseConsumer.resolve_audience
+        return self.user.id in self.system.audience
 
     @property
     def is_initiator(self):
@@ -184,13 +201,3 @@ class Message:
         if self.to_username:
             return User.objects.filter(username=self.to_username).first()
 
-    @property
-    def before_send_activated(self):
-        result = cache.get(f'{self.system.action_id, self.system.initiator_channel}')
-        return result
-
-    def before_send_activate(self):
-        cache.set(f'{self.system.action_id, self.system.initiator_channel}', True, 180)
-
-    def before_send_drop(self):
-        cache.delete(f'{self.system.action_id, self.system.initiator_channel}')
@@ -32,6 +32,10 @@ class EventRetrieveConsumer(PlayerConsumer):
         self.join_group(self.broadcast_group)
         self.Session(consumer=self)
 
+    def get_broadcast_group(self, action: Action) -> str:
+        # Event shares single player session, so event group is the session group
+        return self.broadcast_group
+
     class EventChanged(BaseEvent):
         request_payload_type = RequestPayload.ModifyEvent
         target = TargetsEnum.for_all
@@ -13,8 +13,7 @@ def get_event_from_path(f: Callable):
             event = Event.objects.get(id=int(self.scope['url_route']['kwargs']['event_id']))
             return f(self, event)
         except Event.DoesNotExist:
-            self.close()
-            self.disconnect(1000)
+            self.close_connection()
             return
 
     return wrapper
@@ -41,11 +40,9 @@ def only_for_accessed(f: Callable):
 
         user = self.get_user()
 
-        if user not in event.event_access_users.all():
-            if user != event.author:
-                self.close()
-                self.disconnect(1000)
-                return
+        if user != event.author and not event.event_access_users.filter(user=user).exists():
+            self.close_connection()
+            return
         return f(self, event)
 
     return wrapper
@@ -125,7 +122,7 @@ def only_for_moderator(f: Callable):
 
 def check_access(event, user, access_roles: list):
     user_access = event.event_access_users.filter(user=user).first()
-    user_access_mode = EventAccess.AccessMode.guest
+    user_access_mode = user_access.access_mode if user_access else EventAccess.AccessMode.guest
     if not user_access and event.author == user:
         user_access_mode = EventAccess.AccessMode.administrator
 
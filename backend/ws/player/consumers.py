@@ -1,31 +1,48 @@
-from typing import Union
+from typing import Union, Set
+from urllib.parse import parse_qs
+
+from django.db import transaction
 
 from music_room.models import PlayerSession, Playlist
 from music_room.serializers import PlayerSessionSerializer
 from music_room.services.player import PlayerService
-from ws.base import TargetsEnum, Message, BaseEvent, camel_to_dot, ActionSystem
-from ws.utils import ActionRef as Action, BaseConsumerRef as BaseConsumer
+from music_room.services.sync import coalescer
+from ws.base import TargetsEnum, Message, BaseEvent, camel_to_dot, ActionSystem, camel_to_snake, dot_to_snake
+from ws.utils import ActionRef as Action, AsyncBaseConsumerRef as BaseConsumer, dict_key_reformat
 from .decorators import restore_player_session, check_player_session, get_player_service, get_playlist
 from .signatures import RequestPayload, ResponsePayload, CustomTargetEnum, RequestPayloadWrap
 
 
-def for_accessed(message: Union[Message, RequestPayload.ModifyTrack]):
-    player_session = PlayerSession.objects.get(id=message.player_session_id)
-    if player_session.playlist.access_type == Playlist.AccessTypes.public:
-        return True
-    if message.user in player_session.playlist.playlist_access_users.values_list('id', flat=True):
-        return True
-    return False
+def session_audience(player_session_id: int) -> [Set[int], None]:
+    """Anyone for public playlist, otherwise session and playlist authors and invited users"""
+    player_session = PlayerSession.objects.select_related('playlist').filter(id=player_session_id).first()
+    if not player_session:
+        return set()
+    playlist = player_session.playlist
+    if playlist.access_type == Playlist.AccessTypes.public:
+        return None
+    audience = set(playlist.playlist_access_users.values_list('user_id', flat=True))
+    audience.update({playlist.author_id, player_session.author_id})
+    return audience
+
+
+def for_accessed(message: Union[Message, RequestPayload.ModifyTrack]) -> [Set[int], None]:
+    return session_audience(message.player_session_id)
+
+
+def player_session_group(player_session_id: int) -> str:
+    return f'player-session-{player_session_id}'
 
 
 class PlayerConsumer(BaseConsumer):
-    broadcast_group = 'player'
+    broadcast_group = None
     authed = True
-    custom_target_resolver = {CustomTargetEnum.for_accessed: for_accessed}
+    custom_audience_resolver = {CustomTargetEnum.for_accessed: for_accessed}
     multiplayer = False
 
     request_type_resolver = {
         'create_session': RequestPayloadWrap.CreateSession,
+        'resync_session': RequestPayloadWrap.ResyncSession,
         'play_track': RequestPayloadWrap.PlayTrack,
         'play_next_track': RequestPayloadWrap.PlayNextTrack,
         'play_previous_track': RequestPayloadWrap.PlayPreviousTrack,
@@ -35,10 +52,52 @@ class PlayerConsumer(BaseConsumer):
         'stop_track': RequestPayloadWrap.StopTrack,
     }
 
+    def __init__(self):
+        super(PlayerConsumer, self).__init__()
+        self.session_versions = {}  #: Player session id -> last version sent to client
+        self.delta_protocol = False  #: Client connected with ?protocol=delta and receives session delta
+
+    def on_connect(self):
+        # Before after_connect, which is overridden by event consumer
+        query = parse_qs(self.scope.get('query_string', b'').decode())
+        self.delta_protocol = query.get('protocol', [None])[0] == 'delta'
+        super(PlayerConsumer, self).on_connect()
+
     @restore_player_session
     def after_connect(self, player_session: PlayerSession):
+        # Actions without player session (e.g. remove session) shared only between user's connections
+        self.broadcast_group = f'player-user-{self.get_user().id}'
+        self.join_group(self.broadcast_group)
+        if player_session:
+            self.join_player_session(player_session.id)
         self.Session(consumer=self)
 
+    def join_player_session(self, player_session_id: int):
+        self.join_group(player_session_group(player_session_id))
+
+    def leave_player_sessions(self):
+        for group_name in list(self.groups):
+            if group_name.startswith(player_session_group('')):
+                self.leave_group(group_name)
+
+    def get_broadcast_group(self, action: Action) -> [str, None]:
+        payload = dict_key_reformat(action.payload, camel_to_snake)
+        payload = payload.get(dot_to_snake(action.event), payload)
+        player_session_id = payload.get('player_session_id') if isinstance(payload, dict) else None
+        if not player_session_id:
+            return self.broadcast_group
+        group_name = player_session_group(player_session_id)
+        if group_name not in self.groups:
+            audience = session_audience(player_session_id)
+            if audience is not None and self.get_user().id not in audience:
+                # Session is not accessed, its actions must not be received, own action goes to user's connections
+                return self.broadcast_group
+            # Connection follows one player session at once
+            self.leave_player_sessions()
+            # Initiator must be subscribed to receive own action
+            self.join_player_session(player_session_id)
+        return group_name
+
     @restore_player_session
     def before_disconnect(self, player_session: PlayerSession):
         if player_session:
@@ -50,10 +109,12 @@ class PlayerConsumer(BaseConsumer):
 
         @restore_player_session
         def action_for_initiator(self, message: Message, payload: request_payload_type, player_session: PlayerSession):
+            if player_session:
+                self.consumer.session_versions[player_session.id] = player_session.version
             return Action(
                 event=str(EventsList.session),
                 payload=ResponsePayload.PlayerSession(
-                    player_session=PlayerSessionSerializer(player_session).data if player_session else None
+                    player_session=PlayerService(player_session).to_data() if player_session else None
                 ).to_data(),
                 system=self.event['system']
             )
@@ -66,15 +127,18 @@ class PlayerConsumer(BaseConsumer):
 
         @get_playlist
         def action_for_initiator(self, message: Message, payload: request_payload_type, playlist: Playlist):
-            player_session = PlayerSession.objects.create(playlist=playlist, author=message.initiator_user)
-            if payload.shuffle:
-                player_session = PlayerService(player_session)
-                player_session.shuffle()
-                player_session = player_session.player_session
+            player_session = PlayerSession(playlist=playlist, author=message.initiator_user)
+            # Queue is created shuffled, not created and shuffled again
+            player_session.shuffle_queue = payload.shuffle
+            player_session.save()
+            player_service = PlayerService(player_session)
+            # Previous sessions of author are removed on create
+            self.consumer.leave_player_sessions()
+            self.consumer.join_player_session(player_session.id)
+            self.consumer.session_versions[player_session.id] = player_session.version
             return Action(
                 event=str(EventsList.session_changed),
-                payload=ResponsePayload.PlayerSession(
-                    player_session=PlayerSessionSerializer(player_session).data).to_data(),
+                payload=ResponsePayload.PlayerSession(player_session=player_service.to_data()).to_data(),
                 system=self.event['system']
             )
 
@@ -85,32 +149,111 @@ class PlayerConsumer(BaseConsumer):
         def before_send(self, message: Message, payload: request_payload_type):
             PlayerSession.objects.filter(author=message.initiator_user).delete()
 
+    class ResyncSession(BaseEvent):
+        """Send full player session, e.g. when client missed some version of session delta"""
+        request_payload_type = RequestPayload.ModifyTrack
+        response_payload_type = ResponsePayload.PlayerSession
+        target = TargetsEnum.only_for_initiator
+
+        @get_player_service
+        def action_for_initiator(self, message: Message, payload: request_payload_type, player_service: PlayerService):
+            player_session = player_service.player_session
+            self.consumer.session_versions[player_session.id] = player_session.version
+            return Action(
+                event=str(EventsList.session_changed),
+                payload=ResponsePayload.PlayerSession(player_session=player_service.to_data()).to_data(),
+                system=self.event['system']
+            )
+
     class SessionChanged(BaseEvent):
         request_payload_type = RequestPayload.ModifyTrack
         target = CustomTargetEnum.for_accessed
         hidden = True
+        shared_response = True
 
-        @check_player_session
-        def action_for_target(self, message: Message, payload: request_payload_type):
-            action = Action(
+        def session_changed(self, player_service: PlayerService) -> Action:
+            return Action(
                 event=str(EventsList.session_changed),
-                payload=ResponsePayload.PlayerSession(
-                    player_session=PlayerSessionSerializer(
-                        PlayerService(payload.player_session_id).player_session).data).to_data(),
+                payload=ResponsePayload.PlayerSession(player_session=player_service.to_data()).to_data(),
                 system=self.event['system']
             )
-            return action
+
+        def apply(self, message: Message, payload: request_payload_type):
+            with transaction.atomic():
+                self.player_service = PlayerService(
+                    PlayerSession.objects.select_for_update().filter(id=payload.player_session_id).first()
+                )
+                if not self.player_service.player_session:
+                    return super().apply(message, payload)
+
+                self.base_version = self.player_service.player_session.version
+                try:
+                    before = self.player_service.snapshot()
+                    error = self.before_send(message, payload)
+                    self.delta = self.player_service.delta(before, self.player_service.snapshot())
+                    if any(self.delta.values()) or self.player_service.state.changed:
+                        self.player_service.save()
+                except Exception:
+                    # State could be changed in memory only, next action must not write it
+                    self.player_service.reload()
+                    raise
+                self.version = self.player_service.player_session.version
+
+            if isinstance(error, Action):
+                self.consumer.send_json(content=error.to_data())
+
+        def prepare(self, message: Message, payload: request_payload_type) -> dict:
+            if not self.player_service.player_session:
+                return super().prepare(message, payload)
+
+            player_session = self.player_service.player_session
+            responses = {
+                'player_session_id': player_session.id,
+                'version': self.version,
+                'base_version': self.base_version,
+                'default': self.consumer.encode_json(
+                    self.session_changed(self.player_service).to_data(pop_system=True)
+                ),
+            }
+            if self.version != self.base_version:
+                responses['delta'] = self.consumer.encode_json(Action(
+                    event=str(EventsList.session_delta),
+                    payload=ResponsePayload.SessionDelta(
+                        player_session_id=player_session.id,
+                        base_version=self.base_version,
+                        version=self.version,
+                        **self.delta
+                    ).to_data(),
+                    system=self.event['system']
+                ).to_data(pop_system=True))
+            return responses
+
+        def select_response(self, message: Message, responses: dict) -> [str, None]:
+            if 'version' not in responses:
+                return responses.get('default')
+            player_session_id = responses['player_session_id']
+            known_version = self.consumer.session_versions.get(player_session_id)
+            self.consumer.session_versions[player_session_id] = responses.get('version')
+            if not self.consumer.delta_protocol:
+                return responses.get('default')
+            if known_version == responses.get('version'):
+                return None  # Nothing changed since last sent version
+            if known_version == responses.get('base_version') and responses.get('delta'):
+                return responses['delta']
+            return responses.get('default')  # Version gap, send full session
+
+        @check_player_session
+        def action_for_target(self, message: Message, payload: request_payload_type):
+            return self.session_changed(PlayerService(payload.player_session_id))
 
         @check_player_session
         def action_for_initiator(self, message: Message, payload: request_payload_type):
-            action = Action(
-                event=str(EventsList.session_changed),
-                payload=ResponsePayload.PlayerSession(
-                    player_session=PlayerSessionSerializer(
-                        PlayerService(payload.player_session_id).player_session).data).to_data(),
-                system=self.event['system']
-            )
-            return action
+            return self.session_changed(PlayerService(payload.player_session_id))
+
+    class SessionDelta(BaseEvent):
+        """Player session changes since base version, sent instead of session changed for delta protocol"""
+        request_payload_type = None
+        hidden = True
 
     class PlayTrack(SessionChanged, BaseEvent):
         """Play track by id, or current track if id not provided"""
@@ -201,12 +344,25 @@ class PlayerConsumer(BaseConsumer):
             player_service.stop_track()
 
     class SyncTrack(BaseEvent):
-        """Sync current track progress from duration for current player session"""
+        """
+        Sync current track progress from duration for current player session. Progress is counted by server clock,
+        reported progress only corrects drift larger than ``PLAYER_SYNC_TOLERANCE`` seconds.
+        Nothing is sent to listeners, so sync is not broadcast
+        """
         request_payload_type = RequestPayload.SyncTrack
+        target = TargetsEnum.only_for_initiator
+
+        def before_send(self, message: Message, payload: request_payload_type):
+            # Syncs from many devices are coalesced per session, see PLAYER_SYNC_WINDOW
+            progress = coalescer.offer(payload.player_session_id, payload.progress)
+            if progress is not None:
+                return self.sync_track(message, payload, progress)
 
         @get_player_service
-        def before_send(self, message: Message, payload: request_payload_type, player_service: PlayerService):
-            player_service.sync_track(payload.progress)
+        def sync_track(
+                self, message: Message, payload: request_payload_type, player_service: PlayerService, progress: float
+        ):
+            player_service.sync_track(progress)
 
     class VoteTrack(SessionChanged, BaseEvent):
         """Vote to next track"""
@@ -217,12 +373,14 @@ class PlayerConsumer(BaseConsumer):
 
         @get_player_service
         def before_send(self, message: Message, payload: request_payload_type, player_service: PlayerService):
-            player_service.vote(track=payload.track_id, user=message.initiator_user)
+            player_service.vote(payload.track_id, message.initiator_user)
 
 
 class EventsList:
     session: PlayerConsumer.Session = camel_to_dot(PlayerConsumer.Session.__name__)
     session_changed: PlayerConsumer.SessionChanged = camel_to_dot(PlayerConsumer.SessionChanged.__name__)
+    session_delta: PlayerConsumer.SessionDelta = camel_to_dot(PlayerConsumer.SessionDelta.__name__)
+    resync_session: PlayerConsumer.ResyncSession = camel_to_dot(PlayerConsumer.ResyncSession.__name__)
     create_session: PlayerConsumer.CreateSession = camel_to_dot(PlayerConsumer.CreateSession.__name__)
     remove_session: PlayerConsumer.RemoveSession = camel_to_dot(PlayerConsumer.RemoveSession.__name__)
     play_track: PlayerConsumer.PlayTrack = camel_to_dot(PlayerConsumer.PlayTrack.__name__)
@@ -250,6 +408,26 @@ class Examples:
         system=ActionSystem()
     ).to_data(pop_system=True, to_json=True)
 
+    session_delta_response = Action(
+        event=str(EventsList.session_delta),
+        payload=ResponsePayload.SessionDelta(
+            player_session_id=1,
+            base_version=4,
+            version=5,
+            removed=[],
+            inserted=[],
+            moved=[{'id': 1, 'index': 4}],
+            changed=[{'id': 1, 'state': 'stopped'}, {'id': 2, 'state': 'playing'}],
+        ).to_data(),
+        system=ActionSystem()
+    ).to_data(pop_system=True, to_json=True)
+
+    resync_session_request = Action(
+        event=str(EventsList.resync_session),
+        payload=RequestPayload.ModifyTrack(player_session_id=1).to_data(),
+        system=ActionSystem()
+    ).to_data(pop_system=True, to_json=True)
+
     create_session_request = Action(
         event=str(EventsList.create_session),
         payload=RequestPayload.CreateSession(playlist_id=1, shuffle=True).to_data(),
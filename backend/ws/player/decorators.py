@@ -4,7 +4,7 @@ from django.db.models import Q
 
 from music_room.models import PlayerSession, Playlist, Event
 from music_room.services import PlayerService
-from ws.base import BaseEvent, BaseConsumer, Message
+from ws.base import BaseEvent, BaseConsumerMixin, Message
 from ws.utils import ActionRef as Action
 
 
@@ -17,16 +17,19 @@ def get_player_service(f: Callable):
         player_session = PlayerService(payload.player_session_id)
         if not player_session.player_session:
             return Action(event='error', payload={'message': 'Session not found'}, system=message.system.to_data())
-        return f(self, message, payload, player_session, *args)
+        try:
+            return f(self, message, payload, player_session, *args)
+        except PlayerService.TrackNotFound:
+            return Action(event='error', payload={'message': 'Track not found'}, system=message.system.to_data())
 
     return wrapper
 
 
 def restore_player_session(f: Callable):
-    def wrapper(self: [BaseConsumer, BaseEvent], *args):
+    def wrapper(self: [BaseConsumerMixin, BaseEvent], *args):
         from .consumers import PlayerConsumer
         from ..event.consumers import EventRetrieveConsumer
-        consumer: BaseConsumer = self if isinstance(self, BaseConsumer) else self.consumer
+        consumer: BaseConsumerMixin = self if isinstance(self, BaseConsumerMixin) else self.consumer
         consumer: Union[PlayerConsumer, EventRetrieveConsumer]
 
         if consumer.get_user().is_anonymous:
@@ -35,7 +38,9 @@ def restore_player_session(f: Callable):
         player_session = PlayerSession.objects.filter(author=consumer.get_user()).first()
 
         if consumer.multiplayer:
-            player_session = Event.objects.filter(id=consumer.event_id).first().player_session
+            # No event when connection is closed before it is joined, e.g. event is not accessed
+            event = Event.objects.filter(id=consumer.event_id).first()
+            player_session = event.player_session if event else None
 
         if isinstance(self, BaseEvent):
             return f(self, *args, player_session)
@@ -1,5 +1,5 @@
 from dataclasses import dataclass
-from typing import Optional, Union
+from typing import Optional, Union, List
 
 from music_room.models import PlayerSession
 from ws.base import BasePayload, TargetsEnum, ResponsePayload as BaseResponsePayload
@@ -37,6 +37,10 @@ class RequestPayloadWrap:
     class CreateSession(BasePayload):
         create_session: Union[RequestPayload.CreateSession, dict]  #: Create session signature mock for swift
 
+    @dataclass
+    class ResyncSession(BasePayload):
+        resync_session: Union[RequestPayload.ModifyTrack, dict]  #: Resync session signature mock for swift
+
     @dataclass
     class PlayTrack(BasePayload):
         play_track: Union[RequestPayload.ModifyTrack, dict]  #: Play track signature mock for swift
@@ -87,6 +91,16 @@ class ResponsePayload:
     class PlayerSession(BasePayload):
         player_session: PlayerSession  #: player session object
 
+    @dataclass
+    class SessionDelta(BasePayload):
+        player_session_id: int  #: Player session id
+        base_version: int  #: Version delta applies to, send resync session if known version differs
+        version: int  #: New player session version
+        removed: List[int]  #: Removed session tracks ids
+        inserted: List[dict]  #: Inserted session tracks with index in new track queue
+        moved: List[dict]  #: Moved session tracks ids with index in new track queue
+        changed: List[dict]  #: Session tracks ids with changed fields (state, progress, votes_count)
+
 
 class CustomTargetEnum(TargetsEnum):
     """Who must receive this event"""
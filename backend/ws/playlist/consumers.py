@@ -1,7 +1,7 @@
 from music_room.models import Playlist as PlaylistModel, Track, Playlist
 from music_room.serializers import PlaylistSerializer
 from ws.base import TargetsEnum, Message, BaseEvent, ActionSystem
-from ws.utils import ActionRef as Action, BaseConsumerRef as BaseConsumer
+from ws.utils import ActionRef as Action, AsyncBaseConsumerRef as BaseConsumer
 from music_room.services import PlaylistService
 from .decorators import get_playlist_from_path, get_playlist, only_for_author
 from .signatures import RequestPayload, ResponsePayload, RequestPayloadWrap
@@ -9,7 +9,7 @@ from ws.base.utils import camel_to_dot
 
 
 class PlaylistsConsumer(BaseConsumer):
-    broadcast_group = 'playlist'
+    broadcast_group = None
     authed = True
 
     request_type_resolver = {
@@ -18,6 +18,13 @@ class PlaylistsConsumer(BaseConsumer):
         'remove_playlist': RequestPayloadWrap.RemovePlaylist,
     }
 
+    def after_connect(self):
+        # Playlists changes are rendered only for the initiator user
+        if self.get_user().is_anonymous:
+            return
+        self.broadcast_group = f'playlists-user-{self.get_user().id}'
+        self.join_group(self.broadcast_group)
+
     class PlaylistsChanged(BaseEvent):
         request_payload_type = RequestPayload.ModifyPlaylists
         hidden = True
@@ -75,6 +82,7 @@ class PlaylistRetrieveConsumer(BaseConsumer):
     request_type_resolver = {
         'add_track': RequestPayloadWrap.AddTrack,
         'remove_track': RequestPayloadWrap.RemoveTrack,
+        'move_track': RequestPayloadWrap.MoveTrack,
         'invite_to_playlist': RequestPayloadWrap.InviteToPlaylist,
         'revoke_from_playlist': RequestPayloadWrap.RevokeFromPlaylist,
     }
@@ -91,6 +99,7 @@ class PlaylistRetrieveConsumer(BaseConsumer):
         change_message = None
         target = TargetsEnum.for_all
         hidden = True
+        shared_response = True
 
         def playlist(self, message: Message, payload: request_payload_type, playlist: PlaylistModel):
             action = Action(event=str(EventsList.playlist_changed), system=self.event['system'])
@@ -137,6 +146,19 @@ class PlaylistRetrieveConsumer(BaseConsumer):
             playlist = PlaylistService(playlist.id)
             playlist.remove_track(payload.track_id)
 
+    class MoveTrack(PlaylistChanged, BaseEvent):
+        """Move track to another position in already existed playlist"""
+        request_payload_type = RequestPayload.MoveTrack
+        change_message = '{} move track {} in playlist'
+        response_payload_type_target = ResponsePayload.PlaylistChanged
+        response_payload_type_initiator = ResponsePayload.PlaylistChanged
+        hidden = False
+
+        @get_playlist
+        def before_send(self, message: Message, payload: request_payload_type, playlist: PlaylistModel):
+            playlist = PlaylistService(playlist.id)
+            playlist.move_track(payload.track_id, payload.position)
+
     class InviteToPlaylist(BaseEvent):
         """Invite someone to access this playlist"""
         request_payload_type = RequestPayload.ModifyPlaylistAccess
@@ -167,6 +189,7 @@ class EventsList:
     remove_playlist: PlaylistsConsumer.RemovePlaylist = camel_to_dot(PlaylistsConsumer.RemovePlaylist.__name__)
     add_track: PlaylistRetrieveConsumer.AddTrack = camel_to_dot(PlaylistRetrieveConsumer.AddTrack.__name__)
     remove_track: PlaylistRetrieveConsumer.RemoveTrack = camel_to_dot(PlaylistRetrieveConsumer.RemoveTrack.__name__)
+    move_track: PlaylistRetrieveConsumer.MoveTrack = camel_to_dot(PlaylistRetrieveConsumer.MoveTrack.__name__)
     invite_to_playlist: PlaylistRetrieveConsumer.InviteToPlaylist = camel_to_dot(
         PlaylistRetrieveConsumer.InviteToPlaylist.__name__)
     revoke_from_playlist: PlaylistRetrieveConsumer.RevokeFromPlaylist = camel_to_dot(
@@ -226,6 +249,12 @@ class Examples:
         system=ActionSystem()
     ).to_data(pop_system=True, to_json=True)
 
+    move_track_request = Action(
+        event=str(EventsList.move_track),
+        payload=RequestPayload.MoveTrack(track_id=1, position=0).to_data(),
+        system=ActionSystem()
+    ).to_data(pop_system=True, to_json=True)
+
     invite_to_playlist_request = Action(
         event=str(EventsList.invite_to_playlist),
         payload=RequestPayload.ModifyPlaylistAccess(user_id=1).to_data(),
@@ -11,8 +11,7 @@ def get_playlist_from_path(f: Callable):
             playlist = Playlist.objects.get(id=int(self.scope['url_route']['kwargs']['playlist_id']))
             return f(self, playlist)
         except Playlist.DoesNotExist:
-            self.close()
-            self.disconnect(1000)
+            self.close_connection()
             return
 
     return wrapper
@@ -38,8 +37,7 @@ def only_for_author(f: Callable):
         self: PlaylistRetrieveConsumer
 
         if self.get_user() != playlist.author:
-            self.close()
-            self.disconnect(1000)
+            self.close_connection()
             return
         return f(self, playlist)
     return wrapper
\ No newline at end of file
@@ -11,6 +11,12 @@ class RequestPayload:
         """Modify playlist tracks"""
         track_id: int  #: Track if for any actions with it (eg. remove, add)
 
+    @dataclass
+    class MoveTrack(BasePayload):
+        """Move track in playlist"""
+        track_id: int  #: Track id to move
+        position: int  #: New track position in playlist, from 0
+
     @dataclass
     class ModifyPlaylist(BasePayload):
         """Modify playlist"""
@@ -56,6 +62,11 @@ class RequestPayloadWrap:
         #: Remove track from playlist signature mock for swift
         remove_track: Union[RequestPayload.ModifyPlaylistTracks, dict]
 
+    @dataclass
+    class MoveTrack(BasePayload):
+        #: Move track in playlist signature mock for swift
+        move_track: Union[RequestPayload.MoveTrack, dict]
+
     @dataclass
     class InviteToPlaylist(BasePayload):
         #: Invite someone to access this playlist mock for swift
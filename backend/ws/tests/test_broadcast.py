@@ -0,0 +1,128 @@
+"""
+Two ASGI workers sharing Redis channel layer (fakeredis server): an action of a connection to one worker
+reaches connections to the other one. Workers are two channel layers in one process, messages go through Redis
+"""
+import asyncio
+import threading
+
+import pytest
+from asgiref.sync import async_to_sync
+from channels.routing import URLRouter
+from channels_redis.core import RedisChannelLayer
+from django.urls import re_path
+from fakeredis import TcpFakeServer
+
+from django_app.asgi import application
+from django_app.middleware import TokenAuthMiddleware
+from music_room.services.sync import coalescer
+from ws.player import PlayerConsumer
+from ws.playlist import PlaylistRetrieveConsumer
+from .utils import connect, drain, events
+
+
+class OtherWorkerPlayerConsumer(PlayerConsumer):
+    channel_layer_alias = 'other_worker'
+
+
+class OtherWorkerPlaylistRetrieveConsumer(PlaylistRetrieveConsumer):
+    channel_layer_alias = 'other_worker'
+
+
+other_worker = TokenAuthMiddleware(URLRouter([
+    re_path(r'^ws/player/', OtherWorkerPlayerConsumer.as_asgi()),
+    re_path(r'^ws/playlist/(?P<playlist_id>\d+)/', OtherWorkerPlaylistRetrieveConsumer.as_asgi()),
+]))
+
+
+@pytest.fixture
+def redis_layers(settings):
+    server = TcpFakeServer(('127.0.0.1', 0), server_type='redis')
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    host, port = server.server_address
+    layer = {'BACKEND': 'channels_redis.core.RedisChannelLayer', 'CONFIG': {'hosts': [f'redis://{host}:{port}']}}
+    settings.CHANNEL_LAYERS = {'default': layer, 'other_worker': layer}
+    yield
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.mark.django_db(transaction=True)
+def test_player_action_reaches_other_worker(redis_layers, make_session, user):
+    player_session = make_session()
+    track = player_session.track_queue.order_by('order').values_list('id', flat=True)[2]
+
+    async def run():
+        initiator = await connect(application, user, '/ws/player/?protocol=delta')
+        receiver = await connect(other_worker, user, '/ws/player/?protocol=delta')
+        await asyncio.gather(drain(initiator), drain(receiver))
+
+        await initiator.send_json_to({'event': 'play.track', 'payload': {
+            'playTrack': {'playerSessionId': player_session.id, 'trackId': track}
+        }})
+        sent, received = await asyncio.gather(drain(initiator), drain(receiver))
+        await initiator.disconnect()
+        await receiver.disconnect()
+        return sent, received
+
+    sent, received = async_to_sync(run)()
+    assert events(sent) == events(received) == ['session.delta']
+    delta = received[0]['payload']['sessionDelta']
+    assert (delta['base_version'], delta['version']) == (0, 1)
+    assert {'id': track, 'index': 0} in delta['moved']
+    assert {'id': track, 'state': 'playing'} in delta['changed']
+
+
+@pytest.mark.django_db(transaction=True)
+def test_playlist_action_reaches_other_worker(redis_layers, make_playlist, user):
+    playlist = make_playlist()
+    track = playlist.tracks.order_by('order').values_list('track_id', flat=True)[0]
+    path = f'/ws/playlist/{playlist.id}/'
+
+    async def run():
+        initiator = await connect(application, user, path)
+        receiver = await connect(other_worker, user, path)
+        await asyncio.gather(drain(initiator), drain(receiver))
+
+        await initiator.send_json_to({'event': 'remove.track', 'payload': {
+            'removeTrack': {'trackId': track}
+        }})
+        sent, received = await asyncio.gather(drain(initiator), drain(receiver))
+        await initiator.disconnect()
+        await receiver.disconnect()
+        return sent, received
+
+    sent, received = async_to_sync(run)()
+    assert events(sent) == events(received) == ['playlist.changed']
+    assert received == sent
+
+
+@pytest.mark.django_db(transaction=True)
+def test_sync_track_is_not_broadcast(redis_layers, make_session, user, monkeypatch):
+    player_session = make_session()
+    received = coalescer.received
+    group_sends = []
+    group_send = RedisChannelLayer.group_send
+
+    async def recorded_group_send(self, group, message):
+        group_sends.append(message['type'])
+        return await group_send(self, group, message)
+
+    monkeypatch.setattr(RedisChannelLayer, 'group_send', recorded_group_send)
+
+    async def run():
+        initiator = await connect(application, user, '/ws/player/')
+        receiver = await connect(other_worker, user, '/ws/player/')
+        await asyncio.gather(drain(initiator), drain(receiver))
+
+        await initiator.send_json_to({'event': 'sync.track', 'payload': {
+            'syncTrack': {'playerSessionId': player_session.id, 'progress': 42.0}
+        }})
+        sent, received = await asyncio.gather(drain(initiator), drain(receiver))
+        await initiator.disconnect()
+        await receiver.disconnect()
+        return sent, received
+
+    assert async_to_sync(run)() == ([], [])
+    assert coalescer.received == received + 1
+    assert group_sends == []
@@ -0,0 +1,66 @@
+import asyncio
+
+import pytest
+from asgiref.sync import async_to_sync
+
+from django_app.asgi import application
+from music_room.models import Event, EventAccess
+from ws.event.decorators import check_access
+from .utils import connect, drain, events, action
+
+
+@pytest.mark.django_db(transaction=True)
+def test_event_client_gets_delta(make_event, user):
+    event = make_event()
+    path = f'/ws/event/{event.id}/?protocol=delta'
+
+    async def run():
+        initiator = await connect(application, user, path)
+        receiver = await connect(application, user, path)
+        await asyncio.gather(drain(initiator), drain(receiver))
+
+        await initiator.send_json_to(action('play_next_track', player_session_id=event.player_session_id))
+        sent, received = await asyncio.gather(drain(initiator), drain(receiver))
+        await initiator.disconnect()
+        await receiver.disconnect()
+        return sent, received
+
+    sent, received = async_to_sync(run)()
+    assert events(sent) == events(received) == ['session.delta']
+    delta = received[0]['payload']['sessionDelta']
+    assert (delta['base_version'], delta['version']) == (0, 1)
+
+
+@pytest.mark.django_db(transaction=True)
+def test_only_invited_users_connect_to_private_event(make_event, user, other_user, django_user_model):
+    event = make_event(access_type=Event.AccessTypes.private)
+    EventAccess.objects.create(event=event, user=other_user)
+    stranger = django_user_model.objects.create_user(username='carol', password='carol-password')
+    path = f'/ws/event/{event.id}/'
+
+    async def run():
+        connections = [await connect(application, member, path) for member in (user, other_user, stranger)]
+        messages = await asyncio.gather(*map(drain, connections))
+        for communicator in connections:
+            await communicator.disconnect()
+        return messages
+
+    author_messages, invited_messages, stranger_messages = async_to_sync(run)()
+    assert 'close' not in events(author_messages) and 'close' not in events(invited_messages)
+    assert events(stranger_messages) == ['close']
+
+
+@pytest.mark.django_db
+@pytest.mark.parametrize('access_mode, allowed', [
+    (None, [EventAccess.AccessMode.guest]),
+    (EventAccess.AccessMode.guest, [EventAccess.AccessMode.guest]),
+    (EventAccess.AccessMode.moderator, [EventAccess.AccessMode.moderator]),
+    (EventAccess.AccessMode.administrator, [EventAccess.AccessMode.administrator]),
+])
+def test_check_access_uses_access_mode(make_event, user, other_user, access_mode, allowed):
+    event = make_event()
+    if access_mode:
+        EventAccess.objects.create(event=event, user=other_user, access_mode=access_mode)
+    for mode in EventAccess.AccessMode:
+        assert check_access(event, other_user, [mode]) == (mode in allowed)
+    assert check_access(event, user, [EventAccess.AccessMode.administrator])
@@ -0,0 +1,62 @@
+import asyncio
+
+import pytest
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+
+from django_app.asgi import application
+from music_room.models import Playlist
+from ws.player.consumers import player_session_group
+from .utils import connect, drain, events, action
+
+
+@pytest.mark.django_db(transaction=True)
+def test_not_accessed_session_is_not_followed(make_session, user, other_user):
+    session = make_session(author=other_user)
+    Playlist.objects.filter(id=session.playlist_id).update(access_type=Playlist.AccessTypes.private)
+
+    async def run():
+        stranger = await connect(application, user, '/ws/player/')
+        author = await connect(application, other_user, '/ws/player/')
+        await asyncio.gather(drain(stranger), drain(author))
+
+        await stranger.send_json_to(action('play_next_track', player_session_id=session.id))
+        await asyncio.gather(drain(stranger), drain(author))
+        # Receivers drop actions of not accessed sessions too, so group itself is checked
+        members = len(get_channel_layer().groups.get(player_session_group(session.id), {}))
+        await author.send_json_to(action('play_next_track', player_session_id=session.id))
+        sent, received = await asyncio.gather(drain(author), drain(stranger))
+        await stranger.disconnect()
+        await author.disconnect()
+        return members, sent, received
+
+    members, sent, received = async_to_sync(run)()
+    assert members == 1
+    assert events(sent) == ['session.changed']
+    assert received == []
+
+
+@pytest.mark.django_db(transaction=True)
+def test_previous_session_is_left(make_session, user, other_user):
+    own_session, other_session = make_session(), make_session(author=other_user)
+
+    async def run():
+        follower = await connect(application, user, '/ws/player/')
+        own_device = await connect(application, user, '/ws/player/')
+        author = await connect(application, other_user, '/ws/player/')
+        await asyncio.gather(drain(follower), drain(own_device), drain(author))
+
+        await follower.send_json_to(action('play_next_track', player_session_id=other_session.id))
+        await asyncio.gather(drain(follower), drain(own_device), drain(author))
+
+        await own_device.send_json_to(action('play_next_track', player_session_id=own_session.id))
+        _, own_received = await asyncio.gather(drain(own_device), drain(follower))
+        await author.send_json_to(action('play_next_track', player_session_id=other_session.id))
+        _, other_received = await asyncio.gather(drain(author), drain(follower))
+        for communicator in (follower, own_device, author):
+            await communicator.disconnect()
+        return own_received, other_received
+
+    own_received, other_received = async_to_sync(run)()
+    assert own_received == []
+    assert events(other_received) == ['session.changed']
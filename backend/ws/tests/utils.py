@@ -0,0 +1,40 @@
+import json
+
+from channels.testing import WebsocketCommunicator
+from rest_framework_simplejwt.tokens import AccessToken
+
+from ws.base.utils import snake_to_camel
+from ws.utils import dict_key_reformat
+
+#: Seconds of silence after which connection is considered drained
+TIMEOUT = 0.5
+
+
+async def connect(app, user, path: str) -> WebsocketCommunicator:
+    communicator = WebsocketCommunicator(
+        app, path, headers=[(b'authorization', f'Bearer {AccessToken.for_user(user)}'.encode())]
+    )
+    connected, _ = await communicator.connect()
+    assert connected
+    return communicator
+
+
+async def drain(communicator: WebsocketCommunicator) -> list:
+    """Messages sent to client till connection is silent, close is returned as ``{'event': 'close'}``"""
+    messages = []
+    while not await communicator.receive_nothing(TIMEOUT):
+        output = await communicator.receive_output()
+        if output.get('type') == 'websocket.send':
+            messages.append(json.loads(output['text']))
+        elif output.get('type') == 'websocket.close':
+            messages.append({'event': 'close'})
+    return messages
+
+
+def events(messages: list) -> list:
+    return [message['event'] for message in messages]
+
+
+def action(event: str, **payload) -> dict:
+    """Client message of action given in snake case, e.g. ``action('play_track', player_session_id=1)``"""
+    return {'event': event.replace('_', '.'), 'payload': dict_key_reformat({event: payload}, snake_to_camel)}
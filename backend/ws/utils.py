@@ -1,6 +1,6 @@
 from typing import Callable
 
-from ws.base import Action, BaseConsumer, dot_to_camel, snake_to_camel, BasePayload, camel_to_snake, dot_to_snake, \
+from ws.base import Action, BaseConsumer, AsyncBaseConsumer, dot_to_camel, snake_to_camel, BasePayload, camel_to_snake, dot_to_snake, \
     BaseEvent, Message, ResponsePayload
 
 
@@ -40,7 +40,7 @@ class BaseEventRef(BaseEvent):
         return ActionRef(event=event.pop('type'), system=event.pop('system'), payload={self.event_name: payload})
 
 
-class BaseConsumerRef(BaseConsumer):
+class BaseConsumerRefMixin:
     request_type_resolver = {}
 
     def parse_payload(self, event, payload_type: BasePayload()):
@@ -71,3 +71,11 @@ class BaseConsumerRef(BaseConsumer):
 
         def action_for_initiator(self, message: Message, payload: request_payload_type):
             return self(payload=ResponsePayload.Error(message=payload.message))
+
+
+class BaseConsumerRef(BaseConsumerRefMixin, BaseConsumer):
+    ...
+
+
+class AsyncBaseConsumerRef(BaseConsumerRefMixin, AsyncBaseConsumer):
+    ...